@@ -0,0 +1,65 @@
+"""
+The actions of the players as bits of a mask. The possible actions of a player are sent to the clients as the int of
+the mask, so the codes are a part of the wire format: new actions have to take new bits.
+
+The same bits make up the standing orders of a player: the actions the server takes for the player without waiting
+for a message, see ORDERABLE.
+
+The masks are plain ints on the hot path, an IntFlag operation costs as much as building a set::
+
+    if CODES[message["action"]] & turn.get_actions(message["my_uuid"]):
+        ...
+"""
+from enum import IntFlag
+
+
+class Action(IntFlag):
+    ADD_PLAYER = 1
+    UPDATE_PLAYER = 2
+    START_GAME = 4
+    ROLL = 8
+    PAYOUT = 16
+    USE_CARD = 32
+    BUY = 64
+    AUCTION = 128
+    END_TURN = 256
+    BID = 512
+    PASS = 1024
+    CLOSE_AUCTION = 2048
+    REMOVE_PLAYER = 4096
+
+
+NONE = 0
+""" The empty mask. """
+
+ORDERABLE = int(Action.END_TURN | Action.BUY | Action.AUCTION | Action.PAYOUT | Action.USE_CARD)
+""" The actions a player can leave to a standing order, see Turn.set_orders. Rolling is never ordered, so every turn
+waits for at least one message of its player and the orders cannot play a game on their own. """
+
+ORDER_PRIORITY: tuple[int, ...] = tuple(
+    action.value for action in (Action.USE_CARD, Action.PAYOUT, Action.BUY, Action.AUCTION, Action.END_TURN))
+""" The order in which the standing orders are tried when more of them apply. """
+
+CODES: dict[str, int] = {action.name.lower(): action.value for action in Action}
+""" The bits of the actions by their names in the client messages. """
+NAMES: dict[int, str] = {code: name for name, code in CODES.items()}
+""" The names of the actions by their bits. """
+
+_NAMES: dict[int, frozenset[str]] = {}
+""" The names of the actions by the masks that have occurred. Only a few of all masks are possible, so they are not
+built in advance. """
+
+
+def names(mask: int) -> frozenset[str]:
+    """
+    Returns the names of the actions in the mask.
+    :param mask: The mask of Action bits.
+    :type mask: int
+    :return: The names, as they are used in the client messages.
+    :rtype: frozenset[str]
+    """
+    try:
+        return _NAMES[mask]
+    except KeyError:
+        result = _NAMES[mask] = frozenset(name for name, code in CODES.items() if code & mask)
+        return result
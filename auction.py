@@ -0,0 +1,140 @@
+"""
+The auction of an unowned property the player on turn did not buy. Every player of the game bids, not only the player
+on turn, so the bids arrive from all seats at once. They are resolved in the order the server parses them: a bid has to
+raise the high bid by at least the increment, so of two equal bids the first one wins and the second one is too low.
+The auction closes when all players but the high bidder have passed, or when its closing timer runs out (see
+config.stage_timeouts); a bid parsed after the close is not a possible action any more.
+
+The bids change only the auction, not the game data, so they are not broadcast one by one. The high bid is announced
+once per config.auction_bid_window, see Turn._announce_bid.
+"""
+
+
+class Auction:
+    """
+    An English auction of one property.
+    """
+
+    def __init__(self, field_id: int, bidders: tuple[int, ...], increment: int):
+        self.field_id: int = field_id
+        """ The id of the auctioned property. """
+        self.bidders: tuple[int, ...] = bidders
+        """ The player_ids of the bidders, in the order in which they are asked to bid, see next_bidder. """
+        self.increment: int = increment
+        """ The smallest raise of the high bid. """
+        self.high_bid: int = 0
+        self.high_bidder: int | None = None
+        self.passed: frozenset[int] = frozenset()
+        """ The player_ids of the bidders who left the auction. """
+        self.bids: int = 0
+        """ The number of accepted bids. """
+        self.rejected: int = 0
+        """ The number of bids that were too low, a tie included, or came from a bidder who cannot bid. """
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.field_id}, high_bid={self.high_bid}, high_bidder={self.high_bidder})"
+
+    @property
+    def minimum(self) -> int:
+        """
+        The lowest bid that is accepted.
+        """
+        return self.high_bid + self.increment
+
+    @property
+    def is_over(self) -> bool:
+        """
+        True if no bidder can raise the high bid any more.
+        """
+        return self.next_bidder() is None
+
+    def can_bid(self, player_id: int) -> bool:
+        """
+        Returns True if the player is a bidder who has not passed. The high bidder can bid, but not raise their own bid.
+        :param player_id: The player_id.
+        :type player_id: int
+        :rtype: bool
+        """
+        return player_id in self.bidders and player_id not in self.passed
+
+    def bid(self, player_id: int, amount: int, cash: int) -> bool:
+        """
+        Places the bid, if it raises the high bid by at least the increment and the bidder has the cash.
+        :param player_id: The player_id of the bidder.
+        :type player_id: int
+        :param amount: The bid.
+        :type amount: int
+        :param cash: The cash of the bidder.
+        :type cash: int
+        :return: False if the bid was rejected.
+        :rtype: bool
+        """
+        if not self.can_bid(player_id) or player_id == self.high_bidder or not self.minimum <= amount <= cash:
+            self.rejected += 1
+            return False
+        self.high_bid = amount
+        self.high_bidder = player_id
+        self.bids += 1
+        return True
+
+    def leave(self, player_id: int) -> bool:
+        """
+        Passes for the bidder. The high bidder cannot take their bid back.
+        :param player_id: The player_id of the bidder.
+        :type player_id: int
+        :return: False if the bidder could not pass.
+        :rtype: bool
+        """
+        if not self.can_bid(player_id) or player_id == self.high_bidder:
+            return False
+        self.passed |= {player_id}
+        return True
+
+    def next_bidder(self) -> int | None:
+        """
+        Returns the bidder who is asked to raise the high bid next: the first bidder after the high bidder who has not
+        passed. Players bid whenever they want, the order is used where the bidders take turns, e.g. in the simulation.
+        :return: The player_id, None if the auction is over.
+        :rtype: int | None
+        """
+        start = 0 if self.high_bidder is None else self.bidders.index(self.high_bidder) + 1
+        for i in range(len(self.bidders)):
+            player_id = self.bidders[(start + i) % len(self.bidders)]
+            if player_id not in self.passed and player_id != self.high_bidder:
+                return player_id
+        return None
+
+    def get_state(self) -> tuple:
+        """
+        Returns the state of the auction as plain values, see Turn.get_state.
+        :return: The state as (field_id, bidders, increment, high bid, high bidder, passed bidders, bids, rejected
+        bids).
+        :rtype: tuple
+        """
+        return (
+            self.field_id, self.bidders, self.increment, self.high_bid, self.high_bidder, tuple(sorted(self.passed)),
+            self.bids, self.rejected,
+        )
+
+    @classmethod
+    def from_state(cls, state: tuple) -> "Auction":
+        """
+        Rebuilds the auction from the state returned by get_state.
+        :param state: The state.
+        :type state: tuple
+        :rtype: Auction
+        """
+        field_id, bidders, increment, high_bid, high_bidder, passed, bids, rejected = state
+        auction = cls(field_id, tuple(bidders), increment)
+        auction.high_bid, auction.high_bidder, auction.passed = high_bid, high_bidder, frozenset(passed)
+        auction.bids, auction.rejected = bids, rejected
+        return auction
+
+    def fork(self) -> "Auction":
+        """
+        Returns a copy of the auction for the fork of the game, see Turn.fork.
+        :rtype: Auction
+        """
+        auction = object.__new__(type(self))
+        auction.__dict__.update(self.__dict__)
+        return auction
@@ -0,0 +1,934 @@
+"""
+Micro-benchmarks of the server internals. Run `python benchmarks.py` to run all of them or
+`python benchmarks.py <name> ...` to run the selected ones.
+"""
+import copy
+import gc
+import itertools
+import logging
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable
+from uuid import UUID
+
+import actions as turn_actions
+import config
+import event_log
+import markov
+import simulation
+import snapshot
+import turn
+from bots import BotPool
+from encoders import BinaryEncoder, FrameDecoder, PickleEncoder
+from event_log import EventLog
+from game_controller import GameController
+from registry import GameRegistry, GameSession
+from rng import Rng
+from stages import StageMachine, StageStats
+from timer_wheel import TimerWheel
+from turn import Turn
+
+
+class NullClient:
+    """
+    Stands in for a client connection. Everything sent to it is dropped.
+    """
+    is_bot: bool = False
+
+    def __init__(self):
+        self.player_uuid: UUID | None = None
+        self.player_id: int | None = None
+        self.session = None
+
+    def send(self, message: Any) -> None:
+        pass
+
+    def write_frames(self, frames: list[bytes]) -> None:
+        pass
+
+
+class RecordingClient(NullClient):
+    """
+    Client connection that keeps everything sent to it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.messages: list = []
+
+    def send(self, message: Any) -> None:
+        self.messages.append(message)
+
+    def write_frames(self, frames: list[bytes]) -> None:
+        self.messages.extend(config.encoder.decode(b"".join(frames)))
+
+
+class TickScheduler:
+    """
+    Stands in for reactor.callLater. The scheduled calls are run by run(), which plays the role of one reactor
+    iteration.
+    """
+
+    def __init__(self):
+        self.pending: list[Callable[[], Any]] = []
+
+    def __call__(self, delay: float, function: Callable[[], Any]) -> None:
+        self.pending.append(function)
+
+    def run(self) -> None:
+        pending, self.pending = self.pending, []
+        for function in pending:
+            function()
+
+
+def play_game(
+        seed: int = 1, players: int = 4, max_actions: int = 5000,
+        scheduler: TickScheduler | None = None, actions_per_tick: int = 1,
+        log_dir: str | None = None, actions_per_sync: int = 0) -> tuple[GameSession, list[RecordingClient]]:
+    """
+    Plays a game with players choosing randomly from their possible actions until somebody goes bankrupt, the bidders
+    of an auction take turns, see simulation.acting_player. A reactor iteration of the scheduler is run after every
+    `actions_per_tick` actions. The game is logged to log_dir if given, and the log is synced and compacted as on the
+    server (see GameRegistry.sync_logs) after every `actions_per_sync` actions if that is not 0.
+    """
+    rng = random.Random(seed)
+    actions = itertools.count(1)
+
+    def tick():
+        count = next(actions)
+        if scheduler is not None and count % actions_per_tick == 0:
+            scheduler.run()
+        if actions_per_sync and count % actions_per_sync == 0:
+            registry.sync_logs()
+
+    registry = GameRegistry(scheduler, log_dir=log_dir, seed=seed)
+    session = registry.create()
+    clients = [RecordingClient() for _ in range(players)]
+    for client in clients:
+        session.join(client)
+        tick()
+    for client in clients:
+        for attribute, value in (("token", f"token_{client.player_id}"), ("ready", True)):
+            session.messenger.receive({
+                "my_uuid": client.player_uuid, "action": "update_player",
+                "parameters": {"attribute": attribute, "value": value}
+            })
+            tick()
+    game_data = session.controller.gd
+    for _ in range(max_actions):
+        player = simulation.acting_player(session.controller)
+        if any(game_data.players[uuid].cash < 0 for uuid in game_data.players):
+            break
+        action = rng.choice(sorted(session.controller.turn.get_possible_actions(player.uuid)))
+        session.messenger.receive({"my_uuid": player.uuid, "action": action, "parameters": {}})
+        tick()
+    if scheduler is not None:
+        scheduler.run()
+    return session, clients
+
+
+def record_game(seed: int = 1, players: int = 4, max_actions: int = 5000) -> list:
+    """
+    Plays a game (see play_game) and returns the messages sent to the clients.
+    """
+    _, clients = play_game(seed, players, max_actions)
+    return [message for client in clients for message in client.messages]
+
+
+def _report(name: str, **figures: Any) -> None:
+    print(f"{name}:")
+    for key, value in figures.items():
+        if isinstance(value, float):
+            value = f"{value:,.2f}"
+        elif isinstance(value, int):
+            value = f"{value:,}"
+        print(f"    {key:<32} {value}")
+
+
+def bench_game_density(games: int = 200, players: int = 2) -> None:
+    """
+    Hosts the given number of games with seated players in one registry and reports what a game costs.
+    """
+    gc.collect()
+    tracemalloc.start()
+    registry = GameRegistry()
+    clients = []
+    start = time.perf_counter()
+    for _ in range(games):
+        session = registry.create()
+        for _ in range(players):
+            client = NullClient()
+            session.join(client)
+            clients.append(client)
+    created = time.perf_counter() - start
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = registry.stats()
+    start = time.perf_counter()
+    for client in clients:
+        client.session.leave(client)
+    torn_down = time.perf_counter() - start
+    _report(
+        "game_density",
+        games=games,
+        bytes_per_game=traced // games,
+        games_created_per_s=games / created,
+        games_torn_down_per_s=games / torn_down,
+        process_rss_mb=stats["rss_bytes"] / 2**20,
+        games_per_gb=stats["games_per_gb"],
+        games_per_core=stats["games_per_core"],
+    )
+
+
+def bench_framing(frames: int = 10_000, chunk: int = 1460) -> None:
+    """
+    Decodes a burst of small frames delivered in one read and the same burst split into TCP-sized chunks.
+    """
+    encoder = config.encoder
+    message = [{"section": "players", "item": 0, "attribute": "cash", "value": 1500}]
+    burst = b"".join(encoder.encode(message) for _ in range(frames))
+    results = {"frames": frames, "burst_bytes": len(burst)}
+    for count in (frames // 10, frames):
+        data = burst[:len(burst) * count // frames]
+        start = time.perf_counter()
+        decoded = FrameDecoder(encoder).feed(data)
+        elapsed = time.perf_counter() - start
+        assert len(decoded) == count
+        results[f"one_read_{count}_us_per_frame"] = elapsed / count * 1e6
+    decoder = FrameDecoder(encoder)
+    decoded = 0
+    start = time.perf_counter()
+    for offset in range(0, len(burst), chunk):
+        decoded += len(decoder.feed(burst[offset:offset + chunk]))
+    elapsed = time.perf_counter() - start
+    assert decoded == frames and not len(decoder)
+    results["chunked_us_per_frame"] = elapsed / frames * 1e6
+    _report("framing", **results)
+
+
+def bench_codecs(seed: int = 1, rounds: int = 3) -> None:
+    """
+    Compares the wire size and the encoding/decoding speed of the encoders on the messages of a recorded game.
+    """
+    messages = record_game(seed)
+    records = sum(len(message) for message in messages)
+    for encoder in (PickleEncoder, BinaryEncoder):
+        frames = [encoder.encode(message) for message in messages]
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for message in messages:
+                encoder.encode(message)
+        encoding = (time.perf_counter() - start) / rounds
+        stream = b"".join(frames)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            decoded = FrameDecoder(encoder, len(stream)).feed(stream)
+        decoding = (time.perf_counter() - start) / rounds
+        assert len(decoded) == len(messages)
+        _report(
+            f"codec_{encoder.__name__}",
+            messages=len(messages),
+            records=records,
+            total_bytes=len(stream),
+            bytes_per_message=len(stream) / len(messages),
+            bytes_per_record=len(stream) / records,
+            encoded_records_per_s=records / encoding,
+            decoded_records_per_s=records / decoding,
+        )
+
+
+def bench_broadcast(rounds: int = 2000, records: int = 12) -> None:
+    """
+    Measures the cost of broadcasting a typical batch of changes to tables of growing size.
+    """
+    results = {}
+    max_players = config.max_players
+    try:
+        for players in (2, 4, 8, 16):
+            config.max_players = players
+            session = GameRegistry().create()
+            for _ in range(players):
+                session.join(NullClient())
+            messenger = session.messenger
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for i in range(records):
+                    messenger.add(section="players", item=i % players, attribute="cash", value=1500 + i)
+                messenger.broadcast()
+            results[f"us_per_broadcast_{players}_players"] = (time.perf_counter() - start) / rounds * 1e6
+    finally:
+        config.max_players = max_players
+    _report("broadcast", records_per_broadcast=records, **results)
+
+
+def bench_coalescing(seed: int = 1) -> None:
+    """
+    Plays the same game with writes sent immediately and with writes coalesced once per reactor iteration. Under load
+    a reactor iteration handles several actions, which is modelled by running it after every 4 actions.
+    """
+    results = {}
+    for name, scheduler, actions_per_tick in (
+            ("immediate", None, 1), ("per_tick", TickScheduler(), 1), ("per_tick_loaded", TickScheduler(), 4)):
+        session, _ = play_game(seed, scheduler=scheduler, actions_per_tick=actions_per_tick)
+        stats = session.messenger.stats
+        results[f"{name}_writes"] = stats["writes"]
+        results[f"{name}_frames"] = stats["frames"]
+        results[f"{name}_frames_per_write"] = stats["frames"] / stats["writes"]
+    _report("coalescing", **results)
+
+
+def bench_field_access(rounds: int = 20_000, snapshots: int = 200) -> None:
+    """
+    Measures rent resolution over all properties of a board in the middle of a game and the snapshot of the game data
+    sent to a joining player.
+    """
+    session, _ = play_game(1, max_actions=300)
+    game_data = session.controller.gd
+    properties = [field for field in game_data.fields if field.is_property()]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for field in properties:
+            field.rent
+    rent = (time.perf_counter() - start) / (rounds * len(properties))
+    player_uuid = next(iter(session.connected_clients))
+    start = time.perf_counter()
+    for _ in range(snapshots):
+        game_data.get_all_for_player(player_uuid)
+    snapshot = (time.perf_counter() - start) / snapshots
+    _report(
+        "field_access",
+        owned_properties=sum(field.owner is not None for field in properties),
+        ns_per_rent=rent * 1e9,
+        us_per_get_all_for_player=snapshot * 1e6,
+    )
+
+
+def bench_initial_state(joins: int = 2000) -> None:
+    """
+    Measures the cost of the initial state sent to a joining player in the middle of a game: encoding everything from
+    GameData.get_all_for_player for every join, and the cached initial state with the dynamic part still valid
+    (a reconnect storm) or stale (the game changed since the last join).
+    """
+    tail = [{"section": "events", "item": "initialize", "value": True}]
+    for encoder in (PickleEncoder, BinaryEncoder):
+        original_encoder = config.encoder
+        config.encoder = encoder
+        try:
+            session, _ = play_game(1, max_actions=300, scheduler=TickScheduler())  # flushes only when the tick is run
+            messenger = session.messenger
+            game_data = session.controller.gd
+            player_uuid = next(iter(session.connected_clients))
+            start = time.perf_counter()
+            for _ in range(joins):
+                frame = encoder.encode(game_data.get_all_for_player(player_uuid) + tail)
+            uncached = (time.perf_counter() - start) / joins
+            messenger.send_initial_state(player_uuid, tail)
+            assert encoder.decode(messenger._outbox.pop(player_uuid)[0])[0][-1] == tail[0]
+            start = time.perf_counter()
+            for _ in range(joins):
+                messenger.send_initial_state(player_uuid, tail)
+                messenger._outbox.clear()  # the frames are not written, the recording clients would decode them
+            cached = (time.perf_counter() - start) / joins
+            start = time.perf_counter()
+            for _ in range(joins):
+                messenger._dynamic_chunk = None
+                messenger.send_initial_state(player_uuid, tail)
+                messenger._outbox.clear()
+            stale = (time.perf_counter() - start) / joins
+        finally:
+            config.encoder = original_encoder
+        _report(
+            f"initial_state_{encoder.__name__}",
+            frame_bytes=len(frame),
+            us_per_join_uncached=uncached * 1e6,
+            us_per_join_cached=cached * 1e6,
+            us_per_join_stale_dynamic=stale * 1e6,
+        )
+
+
+def bench_event_log(
+        seed: int = 1, rounds: int = 5, restores: int = 20, games: int = 2000, actions_per_sync: int = 25) -> None:
+    """
+    Plays the same game with and without the write-ahead log, the overhead is the time spent logging without the
+    writes to the disk. Then the game is played with the log synced and compacted as on the server, and the size of
+    the log and how fast the game is rebuilt from its snapshot and the records after it are measured, once for the game
+    and for as many copies of the log as `games` recovered at once, as after a crash.
+    """
+    log_dir = tempfile.mkdtemp()
+    try:
+        unlogged = logged = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            play_game(seed)
+            unlogged = min(unlogged, time.perf_counter() - start)
+            start = time.perf_counter()
+            session, _ = play_game(seed, log_dir=log_dir)
+            logged = min(logged, time.perf_counter() - start)
+            session.log.close(delete=True)
+        session, _ = play_game(seed, log_dir=log_dir, actions_per_sync=actions_per_sync)
+        log = session.log
+        replayed = log.records
+        log.sync()
+        size = os.path.getsize(log.path)
+        start = time.perf_counter()
+        for _ in range(restores):
+            restored = GameSession(session.game_id, GameRegistry())
+            event_log.restore(restored.controller, EventLog.read(log.path))
+        restore = (time.perf_counter() - start) / restores
+        assert restored.controller.turn.get_state() == session.controller.turn.get_state()
+        recover_dir = os.path.join(log_dir, "recover")
+        os.mkdir(recover_dir)
+        for i in range(games):
+            shutil.copyfile(log.path, EventLog.path_for(recover_dir, f"game_{i}"))
+        registry = GameRegistry(log_dir=recover_dir)
+        start = time.perf_counter()
+        recovered = registry.recover()
+        recover = time.perf_counter() - start
+        assert recovered == games
+    finally:
+        shutil.rmtree(log_dir)
+    _report(
+        "event_log",
+        records_replayed=replayed,
+        log_bytes=size,
+        logging_overhead_percent=(logged / unlogged - 1) * 100,
+        ms_per_restore=restore * 1e3,
+        games_restored_per_s=1 / restore,
+        games_recovered=games,
+        s_per_recovery=recover,
+        games_recovered_per_s=games / recover,
+    )
+
+
+def bench_snapshot(seed: int = 1, rounds: int = 1000, restores: int = 20) -> None:
+    """
+    Measures the size of a snapshot of a finished game, how fast it is taken and restored, and how much faster the game
+    is recovered from a compacted log than from the full one.
+    """
+    log_dir = tempfile.mkdtemp()
+    try:
+        session, _ = play_game(seed, log_dir=log_dir)
+        log = session.log
+        log.sync()
+        full_size = os.path.getsize(log.path)
+        start = time.perf_counter()
+        for _ in range(restores):
+            event_log.restore(GameSession(session.game_id, GameRegistry()).controller, EventLog.read(log.path))
+        full_restore = (time.perf_counter() - start) / restores
+        start = time.perf_counter()
+        for _ in range(rounds):
+            data = session.snapshot()
+        dumps = (time.perf_counter() - start) / rounds
+        restored = GameSession(session.game_id, GameRegistry())
+        start = time.perf_counter()
+        for _ in range(rounds):
+            snapshot.loads(restored.controller, data)
+        loads = (time.perf_counter() - start) / rounds
+        assert restored.controller.get_state() == session.controller.get_state()
+        log.compact(data)
+        start = time.perf_counter()
+        for _ in range(restores):
+            event_log.restore(GameSession(session.game_id, GameRegistry()).controller, EventLog.read(log.path))
+        compacted_restore = (time.perf_counter() - start) / restores
+        compacted_size = os.path.getsize(log.path)
+    finally:
+        shutil.rmtree(log_dir)
+    _report(
+        "snapshot",
+        snapshot_bytes=len(data),
+        us_per_dumps=dumps * 1e6,
+        us_per_loads=loads * 1e6,
+        log_bytes=full_size,
+        compacted_log_bytes=compacted_size,
+        ms_per_restore=full_restore * 1e3,
+        ms_per_compacted_restore=compacted_restore * 1e3,
+    )
+
+
+def bench_rng(rolls: int = 200_000, seed: int = 1) -> None:
+    """
+    Compares rolling the dice from the per-game stream with rolling them one by one from the global generator, and
+    checks that a game played twice with the same seed ends the same.
+    """
+    start = time.perf_counter()
+    for _ in range(rolls):
+        tuple(random.randint(1, 6) for _ in range(2))
+    global_random = (time.perf_counter() - start) / rolls
+    stream = Rng(seed).spawn("dice")
+    start = time.perf_counter()
+    for _ in range(rolls):
+        stream.roll(2, 6)
+    per_game = (time.perf_counter() - start) / rolls
+    games = []
+    for _ in range(2):
+        (players, fields, misc, _, _), cc, chance, turn, _ = play_game(seed, max_actions=2000)[0].controller.get_state()
+        games.append(([player[1:] for player in players], fields, misc, cc, chance, turn))  # the uuids are random
+    _report(
+        "rng",
+        ns_per_roll_global_randint=global_random * 1e9,
+        ns_per_roll_stream=per_game * 1e9,
+        speedup=global_random / per_game,
+        reproducible=int(games[0] == games[1]),
+    )
+
+
+def bench_simulation(games: int = 20, max_actions: int = 2000) -> None:
+    """
+    Compares the speed of the headless simulation with games played through the sessions and the messenger. Both play
+    random actions, so the games are comparable, but not the same.
+    """
+    report = simulation.simulate(games, seed=1, workers=1, max_actions=max_actions)
+    start = time.perf_counter()
+    for seed in range(games):
+        play_game(seed, max_actions=max_actions)
+    served = time.perf_counter() - start
+    _report(
+        "simulation",
+        games_per_s=report["games_per_s"],
+        actions_per_s=report["actions_per_s"],
+        served_games_per_s=games / served,
+        speedup=report["seconds"] and served / report["seconds"],
+    )
+
+
+def bench_montecarlo(turns: int = 2_000_000, games: int = 10, max_actions: int = 2000) -> None:
+    """
+    Compares the turns per second of the vectorized Monte Carlo with the turns of the headless simulation.
+    """
+    import montecarlo  # needs NumPy, which the server does not
+
+    report = montecarlo.simulate(turns, seed=1, workers=1)
+    games_report = simulation.simulate(games, seed=1, workers=1, max_actions=max_actions)
+    simulated_turns = sum(stats["turns"] for stats in games_report["games_stats"])
+    _report(
+        "montecarlo",
+        turns_per_s=report["turns_per_s"],
+        simulation_turns_per_s=simulated_turns / games_report["seconds"],
+        speedup=report["turns_per_s"] * games_report["seconds"] / simulated_turns,
+        jail_percent=100 * report["probability"][-1],
+    )
+
+
+def bench_markov(lookups: int = 100_000) -> None:
+    """
+    Measures solving the Markov chain of the board and looking up the cached landing probabilities.
+    """
+    markov._CACHE.clear()
+    start = time.perf_counter()
+    probabilities = markov.landing_probabilities()
+    solve = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(lookups):
+        markov.landing_probability(24)
+    lookup = (time.perf_counter() - start) / lookups
+    _report(
+        "markov",
+        solve_ms=solve * 1000,
+        lookup_us=lookup * 1e6,
+        jail_percent=100 * probabilities[-1],
+    )
+
+
+def bench_bots(decisions: int = 30, budget: float = 0.05, workers: int = 1, seed: int = 1) -> None:
+    """
+    Plays a game against a bot that took the seat of a disconnected player. The searches run in the worker processes,
+    so the longest reactor iteration stays far below the budget of a decision.
+    """
+    results: queue.SimpleQueue = queue.SimpleQueue()
+    bots = BotPool(workers, lambda function, *args: results.put((function, args)), budget=budget)
+    scheduler = TickScheduler()
+    session = GameRegistry(scheduler, seed=seed, bots=bots).create()
+    clients = [NullClient() for _ in range(2)]
+    for client in clients:
+        session.join(client)
+    for client in clients:
+        for attribute, value in (("token", f"token_{client.player_id}"), ("ready", True)):
+            session.messenger.receive({
+                "my_uuid": client.player_uuid, "action": "update_player",
+                "parameters": {"attribute": attribute, "value": value}
+            })
+    session.leave(clients[1])
+    human = clients[0]
+    rng = random.Random(seed)
+    game_data = session.controller.gd
+    longest = 0.0
+    start = time.perf_counter()
+    try:
+        while bots.stats["decisions"] < decisions and all(player.cash >= 0 for player in game_data.players.values()):
+            tick = time.perf_counter()
+            scheduler.run()
+            while not results.empty():
+                function, args = results.get()
+                function(*args)
+            actions = session.controller.turn.get_possible_actions(human.player_uuid)
+            if actions:
+                session.messenger.receive({"my_uuid": human.player_uuid, "action": rng.choice(sorted(actions)), "parameters": {}})
+            longest = max(longest, time.perf_counter() - tick)
+            if not actions and not scheduler.pending:
+                function, args = results.get()  # the bot is thinking, the reactor would serve other tables
+                results.put((function, args))
+    finally:
+        bots.close()
+    seconds = time.perf_counter() - start
+    _report(
+        "bots",
+        decisions=bots.stats["decisions"],
+        searches=bots.stats["searches"],
+        rollouts_per_search=bots.stats["rollouts"] / bots.stats["searches"] if bots.stats["searches"] else 0.0,
+        stale=bots.stats["stale"],
+        seconds=seconds,
+        longest_iteration_ms=longest * 1000,
+    )
+
+
+def bench_fork(forks: int = 10_000, seed: int = 1) -> None:
+    """
+    Compares the ways of branching a game in the middle: a deep copy of the game data alone, a snapshot restored into
+    a new controller, a fork and a checkpoint with rollback. A fork that plays one turn pays for the copy of the board
+    only if it buys something.
+    """
+    rng = Rng(seed)
+    game, _ = simulation.new_game(rng, 4)
+    simulation.play(game, [simulation.buyer_policy] * 4, rng.spawn("policy").generator(), 400)
+    timings = {}
+
+    def measure(name: str, branch: Callable[[], Any], count: int = forks) -> None:
+        start = time.perf_counter()
+        for _ in range(count):
+            branch()
+        timings[name] = count / (time.perf_counter() - start)
+
+    def restore() -> None:
+        messenger = simulation.NullMessenger()
+        controller = GameController(simulation.HeadlessGameData(), messenger)
+        messenger.set_server(simulation.HeadlessServer())
+        snapshot.loads(controller, snapshot.dumps(game))
+
+    def fork_and_write() -> None:
+        controller = game.fork(simulation.NullMessenger())
+        controller.gd.update(section="fields", item=1, attribute="owner", value=0)
+
+    messenger = simulation.NullMessenger()
+    branch = game.fork(messenger)
+    messenger.set_server(simulation.HeadlessServer())
+    policies = [simulation.buyer_policy] * 4
+    generator = random.Random(seed)
+
+    def rollback() -> None:
+        checkpoint = branch.checkpoint()
+        simulation.play(branch, policies, generator, 4)
+        branch.rollback(checkpoint)
+
+    measure("deepcopy_game_data", lambda: copy.deepcopy(game.gd), forks // 10)
+    measure("snapshot_restore", restore, forks // 10)
+    measure("fork", lambda: game.fork(simulation.NullMessenger()))
+    measure("fork_with_board_write", fork_and_write)
+    measure("checkpoint_4_actions_rollback", rollback)
+    _report(
+        "fork",
+        **{f"{name}_per_s": value for name, value in timings.items()},
+        speedup_over_snapshot=timings["fork"] / timings["snapshot_restore"],
+    )
+
+
+def bench_stages(games: int = 20, max_actions: int = 2000, builds: int = 20) -> None:
+    """
+    Measures building the stage machine of the turns and the simulated actions per second without and with the
+    per-stage counters and timings, see stages.StageStats.
+    """
+    start = time.perf_counter()
+    for _ in range(builds):
+        StageMachine(Turn, turn.STAGES, entries=("pre_game",))
+    build = (time.perf_counter() - start) / builds
+    plain = simulation.simulate(games, seed=1, workers=1, max_actions=max_actions)
+    turn.STAGE_MACHINE.stats = stats = StageStats()
+    try:
+        measured = simulation.simulate(games, seed=1, workers=1, max_actions=max_actions)
+    finally:
+        turn.STAGE_MACHINE.stats = None
+    report = stats.report()
+    slowest = max(report, key=lambda stage: report[stage]["mean_us"])
+    _report(
+        "stages",
+        build_ms=build * 1e3,
+        actions_per_s=plain["actions_per_s"],
+        measured_actions_per_s=measured["actions_per_s"],
+        measuring_overhead_percent=100 * (plain["actions_per_s"] / measured["actions_per_s"] - 1),
+        steps_per_action=sum(timing["count"] for timing in report.values()) / sum(
+            game["actions"] for game in measured["games_stats"]),
+        invalid_steps=stats.invalid,
+        slowest_stage=slowest,
+        slowest_stage_p99_us=report[slowest]["p99_us"],
+    )
+
+
+def bench_actions(seed: int = 1, checks: int = 200_000, messages: int = 1000) -> None:
+    """
+    Compares validating an action against the cached mask with building the set of possible actions on every message,
+    and counts the masks pushed to the clients against the messages of a served game.
+    """
+    scheduler = TickScheduler()
+    session, clients = play_game(seed, players=4, max_actions=0, scheduler=scheduler)
+    controller = session.controller
+    turn = controller.turn
+
+    def build_set(player_uuid: UUID) -> set[str]:
+        # what Turn.get_possible_actions did before the masks
+        if player_uuid == controller.server_uuid:
+            return {"add_player"}
+        if turn.stage in ("pre_game", "add_player"):
+            return {"update_player", "start_game"}
+        if player_uuid != turn.on_turn_player.uuid:
+            return set()
+        match turn.stage:
+            case "begin_turn":
+                return {"roll"}
+            case "buying_decision":
+                return {"buy", "auction"}
+            case "end_turn":
+                return {"end_turn"}
+
+    def pushed() -> int:
+        return sum(
+            record.get("item") == "possible_actions"
+            for client in clients for frame in client.messages for record in frame if isinstance(record, dict))
+
+    player_uuid = controller.gd.on_turn_player.uuid
+    start = time.perf_counter()
+    for _ in range(checks):
+        "roll" in build_set(player_uuid)
+    sets = checks / (time.perf_counter() - start)
+    codes = turn_actions.CODES
+    start = time.perf_counter()
+    for _ in range(checks):
+        codes["roll"] & turn.get_actions(player_uuid)
+    masks = checks / (time.perf_counter() - start)
+    before = pushed()
+    rng = random.Random(seed)
+    for _ in range(messages):
+        player_uuid = simulation.acting_player(controller).uuid
+        action = rng.choice(sorted(turn.get_possible_actions(player_uuid)))
+        session.messenger.receive({"my_uuid": player_uuid, "action": action, "parameters": {}})
+        scheduler.run()
+    _report(
+        "actions",
+        set_checks_per_s=sets,
+        mask_checks_per_s=masks,
+        speedup=masks / sets,
+        messages=messages,
+        pushed_masks=pushed() - before,
+        unchanged_masks_not_sent=messages * len(clients) - (pushed() - before),
+    )
+
+
+def bench_orders(seed: int = 1, turns: int = 400, round_trip: float = 0.15, buy_limit: int = 200) -> None:
+    """
+    Plays the same decisions once by messages and once by standing orders and counts the messages the players send
+    per turn. The players buy the properties they can afford up to the buy limit, auction the others and pass in the
+    auctions, get out of jail at once and end their turns. The time saved assumes a mobile round trip.
+    """
+    orders = turn_actions.ORDERABLE
+
+    def play(standing: bool) -> tuple[int, int]:
+        scheduler = TickScheduler()
+        session, clients = play_game(seed, players=4, max_actions=0, scheduler=scheduler)
+        controller = session.controller
+        if standing:
+            for client in clients:
+                session.messenger.receive({
+                    "my_uuid": client.player_uuid, "action": "set_orders",
+                    "parameters": {"orders": orders, "buy_limit": buy_limit}})
+        messages = completed = 0
+        on_turn = controller.gd.on_turn
+        while completed < turns:
+            player = simulation.acting_player(controller)
+            possible = controller.turn.get_possible_actions(player.uuid)
+            if "buy" in possible:
+                price = controller.turn.on_turn_player_field.price
+                action = "buy" if price <= min(buy_limit, player.cash) else "auction"
+            else:
+                action = next(
+                    action for action in ("use_card", "payout", "end_turn", "roll", "pass") if action in possible)
+            session.messenger.receive({"my_uuid": player.uuid, "action": action, "parameters": {}})
+            scheduler.run()
+            messages += 1
+            if controller.gd.on_turn != on_turn:
+                completed += 1
+                on_turn = controller.gd.on_turn
+        return messages, controller.turn.round_trips_saved
+
+    by_messages, _ = play(False)
+    by_orders, saved = play(True)
+    _report(
+        "orders",
+        messages_per_turn=by_messages / turns,
+        messages_per_turn_with_orders=by_orders / turns,
+        round_trips_saved=saved,
+        seconds_saved_per_turn=saved * round_trip / turns,
+        consistent=by_messages - by_orders == saved,
+    )
+
+
+def bench_deadlines(timers: int = 50_000, timeout: float = 60.0) -> None:
+    """
+    Compares arming, resetting and cancelling the deadlines of many games on the timer wheel with one delayed call of
+    the reactor per game, and measures the memory of the pending deadlines and the expiry on the wheel.
+    """
+    from twisted.internet import reactor  # not run, the delayed calls only wait in its queue
+
+    now = [0.0]
+    wheel = TimerWheel(clock=lambda: now[0])
+    keys = [f"{i:x}" for i in range(timers)]
+    timings = {}
+
+    def measure(name: str, operation: Callable[[str], Any]) -> None:
+        start = time.perf_counter()
+        for key in keys:
+            operation(key)
+        timings[name] = timers / (time.perf_counter() - start)
+
+    measure("wheel_arm", lambda key: wheel.arm(key, timeout, int))
+    measure("wheel_rearm", lambda key: wheel.arm(key, timeout, int))
+    measure("wheel_cancel", wheel.cancel)
+    calls = {}
+    measure("reactor_arm", lambda key: calls.__setitem__(key, reactor.callLater(timeout, int)))
+    measure("reactor_rearm", lambda key: calls[key].reset(timeout))
+    measure("reactor_cancel", lambda key: calls.pop(key).cancel())
+    tracemalloc.start()
+    for key in keys:
+        wheel.arm(key, timeout, int)
+    wheel_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    for key in keys:
+        calls[key] = reactor.callLater(timeout, int)
+    reactor_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for call in calls.values():
+        call.cancel()
+    for i, key in enumerate(keys):
+        wheel.arm(key, timeout * (1 + i / timers), int)
+    start = time.perf_counter()
+    while len(wheel):
+        now[0] += wheel.resolution
+        wheel.advance()
+    expiry = timers / (time.perf_counter() - start)
+    _report(
+        "deadlines",
+        **{f"{name}_per_s": value for name, value in timings.items()},
+        wheel_bytes_per_timer=wheel_bytes / timers,
+        reactor_bytes_per_timer=reactor_bytes / timers,
+        wheel_expired_per_s=expiry,
+    )
+
+
+def bench_auction(games: int = 100, rounds: int = 50, bids_per_tick: int = 8, seed: int = 1) -> None:
+    """
+    Storms auctions with bids from all seats: every seat bids in every round, raising the high bid it saw at the last
+    reactor iteration, so many bids tie or come too late. Counts the broadcasts of the high bid against one broadcast
+    per accepted bid, checks that the bids after the closing timer ran out are rejected and that the same storm has
+    the same outcome when it is played again.
+    """
+
+    def storm() -> tuple[list[tuple], int, int, int, int, float]:
+        outcomes = []
+        sent = accepted = announced = late = 0
+        elapsed = 0.0
+        for game in range(games):
+            scheduler = TickScheduler()
+            session, clients = play_game(seed + game, players=4, max_actions=0, scheduler=scheduler)
+            controller = session.controller
+            turn = controller.turn
+            while turn.auction is None:
+                player = simulation.acting_player(controller)
+                possible = turn.get_possible_actions(player.uuid)
+                action = next(a for a in ("auction", "roll", "end_turn", "payout", "use_card") if a in possible)
+                session.messenger.receive({"my_uuid": player.uuid, "action": action, "parameters": {}})
+                scheduler.run()
+            rng = random.Random(seed + game)
+            auction = turn.auction
+            seen = auction.high_bid
+            seats = [client.player_uuid for client in clients]
+            start = time.perf_counter()
+            for bid in range(rounds * len(seats)):
+                if bid % len(seats) == 0:
+                    rng.shuffle(seats)
+                amount = seen + auction.increment * rng.randint(1, 3)
+                session.messenger.receive({
+                    "my_uuid": seats[bid % len(seats)], "action": "bid", "parameters": {"amount": amount}})
+                if bid % bids_per_tick == bids_per_tick - 1:
+                    scheduler.run()
+                    seen = auction.high_bid
+            scheduler.run()
+            elapsed += time.perf_counter() - start
+            sent += rounds * len(seats)
+            accepted += auction.bids
+            session.deadline_passed()  # the closing timer runs out
+            scheduler.run()
+            field = controller.gd.fields.get_field(auction.field_id)
+            outcome = (auction.field_id, field.owner, auction.high_bid)
+            for player_uuid in seats:
+                session.messenger.receive({
+                    "my_uuid": player_uuid, "action": "bid", "parameters": {"amount": auction.high_bid * 2}})
+            scheduler.run()
+            late += field.owner == outcome[1] and turn.auction is None
+            outcomes.append(outcome)
+            announced += sum(
+                record.get("item") == "high_bid" for frame in clients[0].messages for record in frame
+                if isinstance(record, dict))
+        return outcomes, sent, accepted, announced, late, elapsed
+
+    outcomes, sent, accepted, announced, late, elapsed = storm()
+    again = storm()[0]
+    _report(
+        "auction",
+        games=games,
+        bids=sent,
+        bids_per_s=sent / elapsed,
+        accepted_bids=accepted,
+        rejected_bids=sent - accepted,
+        high_bid_broadcasts=announced,
+        broadcasts_per_accepted_bid=announced / accepted,
+        games_ignoring_late_bids=late,
+        deterministic=int(outcomes == again),
+    )
+
+
+BENCHMARKS: dict[str, Callable[[], None]] = {
+    "game_density": bench_game_density,
+    "framing": bench_framing,
+    "codecs": bench_codecs,
+    "broadcast": bench_broadcast,
+    "coalescing": bench_coalescing,
+    "field_access": bench_field_access,
+    "initial_state": bench_initial_state,
+    "event_log": bench_event_log,
+    "snapshot": bench_snapshot,
+    "rng": bench_rng,
+    "simulation": bench_simulation,
+    "montecarlo": bench_montecarlo,
+    "markov": bench_markov,
+    "bots": bench_bots,
+    "fork": bench_fork,
+    "stages": bench_stages,
+    "actions": bench_actions,
+    "orders": bench_orders,
+    "deadlines": bench_deadlines,
+    "auction": bench_auction,
+}
+
+
+def main(names: list[str]) -> None:
+    logging.disable(logging.CRITICAL)
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,42 +1,160 @@
 # -*- tests-case-name: tests.test_board -*-
+from array import array
 from typing import ClassVar, Optional, Any
 
-from uuid import UUID
-
-from board_description import FIELDS, FieldType, FieldRecord
+from board_description import FIELDS, FieldType, FieldRecord, StreetColor
 from interfaces import IFields, IField
 
 
+STREET_LEVELS: int = 7
+""" Rent levels of a street: 0 - 4 houses, a hotel and the double rent of an undeveloped full set. """
+DOUBLE_RENT: int = 6
+""" Rent level of an undeveloped street in a full set. """
+NO_OWNER: int = -1
+""" Value of the owner array of the board for fields that are not owned. """
+
+
+def build_rent_table(fields: list[FieldRecord]) -> tuple[tuple[int, ...] | None, ...]:
+    """
+    Precomputes the rents of all fields. For streets the rent is indexed by the rent level (number of houses, 5 for a
+    hotel, DOUBLE_RENT for an undeveloped full set). For railroads and utilities it is indexed by the number of the
+    properties in the set owned by the owner.
+    :param fields: The fields of the board.
+    :type fields: list[FieldRecord]
+    :return: The rents by the field_id, None for fields that are not properties.
+    :rtype: tuple[tuple[int, ...] | None, ...]
+    """
+    table = []
+    for field in fields:
+        if not field["type"] & FieldType.PROPERTY:
+            table.append(None)
+        elif field["type"] is FieldType.STREET:
+            table.append(tuple(field[key] for key in (
+                "rent", "house_1", "house_2", "house_3", "house_4", "hotel", "double_rent")))
+        else:
+            table.append((0, field["rent"]) + tuple(
+                field[f"rent_{count}"] for count in range(2, len(field["full_set"]) + 1)))
+    return tuple(table)
+
+
+RENTS: tuple[tuple[int, ...] | None, ...] = build_rent_table(FIELDS)
+""" The precomputed rents of the fields of the board, see build_rent_table. """
+
+
+class FieldSpec:
+    """
+    The immutable description of a field compiled from board_description.py. The specs are compiled once per process
+    and shared by all games, see COMPILED_FIELDS. Attributes not applicable to the type of the field are not set.
+    """
+    MUTABLE: ClassVar[tuple[str, ...]] = ("owner", "mortgage", "houses")
+    """ The attributes that can change during the game. They are kept by the board of each game. """
+    __slots__ = (
+        "id", "info", "rents", "keys",
+        "index", "type", "name", "color", "full_set", "price", "double_rent", "house_1", "house_2", "house_3",
+        "house_4", "hotel", "house_price", "hotel_price", "mortgage_value", "unmortgage_price", "tax", "rent_2",
+        "rent_3", "rent_4",
+    )
+    # The base rent is kept in the info and the rent table only, the attribute `rent` of a field is the actual rent.
+    index: str
+    type: FieldType
+    name: str
+    color: StreetColor
+    full_set: tuple[str, ...]
+    price: int
+    house_price: int
+    hotel_price: int
+    mortgage_value: int
+    unmortgage_price: int
+    tax: int
+
+    def __init__(self, field_id: int, info: FieldRecord):
+        self.id: int = field_id
+        """ The id of the field """
+        self.info: dict = info
+        """ The immutable data of the field """
+        self.rents: tuple[int, ...] | None = RENTS[field_id]
+        """ The rents of the field by the rent level, see build_rent_table. """
+        for key, value in info.items():
+            if key != "rent":
+                setattr(self, key, value)
+        mutable = ()
+        if self.type & FieldType.PROPERTY:
+            mutable = ("owner", "mortgage", "houses") if self.type is FieldType.STREET else ("owner", "mortgage")
+        self.keys: tuple[str, ...] = tuple(info) + mutable
+        """ The names of all attributes of the field, immutable and mutable. """
+
+
+COMPILED_FIELDS: tuple[FieldSpec, ...] = tuple(FieldSpec(i, info) for i, info in enumerate(FIELDS))
+""" The board described in board_description.py, compiled once and shared by all games. """
+
+
 class Field(IField):
     """
-    Represents a field on the board. The data of the fields are defined in board_description.py
+    Represents a field on the board of a game. The field is a lightweight view: the immutable data come from the
+    shared FieldSpec, the mutable data (owner, mortgage, houses) are stored in the arrays of the board.
     """
+    MUTABLE: ClassVar[tuple[str, ...]] = FieldSpec.MUTABLE
+    """ The attributes that can change during the game. """
+    __slots__ = ("id", "board", "spec")
 
     def __init__(self, board: "BoardData", field_id: int):
         self.id: int = field_id
         """ The id of the field """
-        self.board = board
+        self.board: BoardData = board
         """ The board this field belongs to """
-        self.info: dict = FIELDS[field_id]
+        self.spec: FieldSpec = board.specs[field_id]
         """ The immutable data of the field """
-        if self.is_property():
-            self.owner: Optional[UUID] = None
-            """ The owner of the field. None if the field is not owned """
-            self.mortgage: bool = False
-            """ True if the field is mortgaged """
-            if self.type is FieldType.STREET:
-                self.houses: int = 0
-                """ The number of houses built on the field """
 
     def __getattr__(self, item):
-        if item in self.info:
-            return self.info[item]
-        raise AttributeError(f"'{self.__class__.__name__}' has no attribute {item}")
+        return getattr(self.spec, item)
+
+    def __eq__(self, other):
+        return isinstance(other, Field) and self.board is other.board and self.id == other.id
+
+    def __hash__(self):
+        return hash((id(self.board), self.id))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.id}, {self.spec.index!r})"
 
     def __getitem__(self, item):
-        return self.full_info[item]
+        if item in self.MUTABLE:
+            try:
+                return getattr(self, item)
+            except AttributeError:
+                raise KeyError(item) from None
+        return self.spec.info[item]
+
     def __iter__(self):
-        return iter(self.full_info)
+        return iter(self.spec.keys)
+
+    @property
+    def owner(self) -> Optional[int]:
+        """
+        The player_id of the owner of the field. None if the field is not owned.
+        """
+        if self.spec.rents is None:
+            raise AttributeError(f"{self!r} is not a property and has no owner")
+        owner = self.board.owners[self.id]
+        return None if owner == NO_OWNER else owner
+
+    @property
+    def mortgage(self) -> bool:
+        """
+        True if the field is mortgaged.
+        """
+        if self.spec.rents is None:
+            raise AttributeError(f"{self!r} is not a property and cannot be mortgaged")
+        return bool(self.board.mortgages[self.id])
+
+    @property
+    def houses(self) -> int:
+        """
+        The number of houses built on the field, 5 for a hotel.
+        """
+        if self.spec.type is not FieldType.STREET:
+            raise AttributeError(f"{self!r} is not a street and has no houses")
+        return self.board.house_counts[self.id]
 
     @property
     def full_info(self) -> dict:
@@ -45,11 +163,7 @@ class Field(IField):
         :return: The full info of the field
         :rtype: dict
         """
-        info = self.info.copy()
-        for attr in ["owner", "mortgage", "houses"]:
-            if hasattr(self, attr):
-                info[attr] = getattr(self, attr)
-        return info
+        return {key: self[key] for key in self.spec.keys}
 
     @property
     def rent(self) -> int | None:
@@ -59,22 +173,14 @@ class Field(IField):
         :return: The actual rent. None if the field is not a property.
         :rtype: int | None
         """
-        if not self.is_property():
+        spec = self.spec
+        if spec.rents is None:
             return None
-        if self.is_street():
-            if 1 <= self.houses <= 4:
-                rent = f"house_{self.houses}"
-            elif self.houses == 5:
-                rent = "hotel"
-            else:
-                if self.board.has_full_set(self):
-                    rent ="double_rent"
-                else:
-                    rent = "rent"
+        if spec.type is FieldType.STREET:
+            level = self.board.house_counts[self.id] or (DOUBLE_RENT if self.board.has_full_set(self) else 0)
         else:
-            owned_count = self.board.get_properties_in_set_owned(self)
-            rent = "rent" if owned_count == 1 else f"rent_{owned_count}"
-        return self[rent]
+            level = self.board.get_properties_in_set_owned(self)
+        return spec.rents[level]
 
     def get_info(self) -> dict:
         """
@@ -94,7 +200,7 @@ class Field(IField):
         :return:
         :rtype:
         """
-        return self.type is FieldType.TAX
+        return self.spec.type is FieldType.TAX
 
     def is_chance_cc_card(self) -> bool:
         """
@@ -102,7 +208,7 @@ class Field(IField):
         :return:
         :rtype:
         """
-        return bool(self.type & FieldType.CARD)
+        return bool(self.spec.type & FieldType.CARD)
 
     def is_property(self) -> bool:
         """
@@ -110,7 +216,7 @@ class Field(IField):
         :return:
         :rtype:
         """
-        return bool(self.type & FieldType.PROPERTY)
+        return self.spec.rents is not None
 
     def is_street(self) -> bool:
         """
@@ -118,7 +224,7 @@ class Field(IField):
         :return:
         :rtype:
         """
-        return bool(self.type & FieldType.STREET)
+        return self.spec.type is FieldType.STREET
 
     def is_go_to_jail(self) -> bool:
         """
@@ -126,7 +232,7 @@ class Field(IField):
         :return:
         :rtype:
         """
-        return bool(self.type & FieldType.GO_TO_JAIL)
+        return bool(self.spec.type & FieldType.GO_TO_JAIL)
 
     def is_nonactive(self) -> bool:
         """
@@ -134,13 +240,17 @@ class Field(IField):
         :return:
         :rtype:
         """
-        return bool(self.type & FieldType.NONACTIVE)
+        return bool(self.spec.type & FieldType.NONACTIVE)
 
 
 class BoardData(IFields):
     """
-    BoardData represents the immutable data of the board and contains the fields.
+    BoardData represents the board of one game. The immutable data of the fields are shared by all games (see
+    COMPILED_FIELDS), the board keeps only the mutable state of the fields in compact parallel arrays indexed by the
+    field_id, and the ownership indexes. The fields are views created on access.
     """
+    GO: ClassVar[int] = 0
+    """ Index of the GO field. """
     LENGHT: ClassVar[int] = 40
     """ Lenght of the board. The Jail and Just Visiting fields are counted as one field. """
     JAIL: ClassVar[int] = 40
@@ -149,11 +259,18 @@ class BoardData(IFields):
     """ Index of the just visiting field. """
     GO_CASH: ClassVar[int] = 200
     """ Cash that the player recieves when they pass GO. """
+    STREET_IDS: ClassVar[tuple[int, ...]] = tuple(spec.id for spec in COMPILED_FIELDS if spec.type is FieldType.STREET)
+    """ The ids of all streets on the board. """
 
-    def __init__(self):
-        self.fields: list[Field] = list()
-        """ List of all fields on the board. """
-        self._generate_fields()
+    def __init__(self, specs: tuple[FieldSpec, ...] = COMPILED_FIELDS):
+        self.specs: tuple[FieldSpec, ...] = specs
+        """ The shared immutable data of the fields. """
+        self.owners: array = array("b", [NO_OWNER]) * len(specs)
+        """ The player_id of the owner of each field, NO_OWNER if the field is not owned. """
+        self.mortgages: array = array("B", bytes(len(specs)))
+        """ 1 for each mortgaged field. """
+        self.house_counts: array = array("B", bytes(len(specs)))
+        """ The number of houses on each field, 5 for a hotel. """
         self.lenght: int = self.LENGHT
         """ Lenght of the board. The Jail and Just Visiting fields are counted as one field. """
         self.jail: int = self.JAIL
@@ -162,47 +279,66 @@ class BoardData(IFields):
         """ Index of the just visiting field. """
         self.go_cash: int = self.GO_CASH
         """ Cash that the player recieves when they pass GO. """
+        self._owned: dict[int, set[int]] = {}
+        """ Index: player_id of the owner -> ids of the owned fields. """
+        self._set_owners: dict[tuple[str, ...], dict[int, int]] = {}
+        """ Index: full_set -> player_id of an owner -> number of fields of the set they own. """
+        self._buildings: dict[int, list[int]] = {}
+        """ Index: player_id of the owner -> [houses, hotels] on their streets. """
+        self._shared: bool = False
+        """ True if the arrays and the indexes are shared with a fork of the board. They are copied before a write. """
 
     def __len__(self):
-        return len(self.fields)
+        return len(self.specs)
 
     def __iter__(self):
-        return iter(self.fields)
+        return (Field(self, field_id) for field_id in range(len(self.specs)))
 
     def __getitem__(self, item):
-        return self.fields[item]
+        if isinstance(item, slice):
+            return [Field(self, field_id) for field_id in range(len(self.specs))[item]]
+        return Field(self, range(len(self.specs))[item])
 
     @property
-    def streets(self) -> set[Field]:
+    def fields(self) -> list[Field]:
         """
-        Returns a list of all streets on the board.
-        :return: A list of all streets on the board.
+        Returns a list of all fields on the board.
+        :return: A list of all fields on the board.
         :rtype: list[Field]
         """
-        return set(filter(
-            lambda field: field.type == FieldType.STREET, self.fields
-        ))
+        return list(self)
 
-    def count_houses(self, player_uuid: UUID) -> tuple[int, int]:
+    @property
+    def streets(self) -> frozenset[Field]:
+        """
+        Returns a set of all streets on the board.
+        :return: A set of all streets on the board.
+        :rtype: frozenset[Field]
         """
-        Returns the number of houses and hotels on the board.
+        return frozenset(Field(self, field_id) for field_id in self.STREET_IDS)
+
+    def count_houses(self, player_id: int) -> tuple[int, int]:
+        """
+        Returns the number of houses and hotels the player owns on the board.
         :return: The number of houses and hotels on the board.
         :rtype: tuple[int, int]
         """
-        houses = 0
-        hotels = 0
-        for field in self.streets:
-            if field.owner != player_uuid:
-                continue
-            if field.houses == 5:
-                hotels += 1
-            else:
-                houses += field.houses
+        houses, hotels = self._buildings.get(player_id, (0, 0))
         return houses, hotels
 
+    def get_owned(self, player_id: int) -> set[int]:
+        """
+        Returns the ids of the fields owned by the player.
+        :param player_id: The player_id of the owner.
+        :type player_id: int
+        :return: The ids of the owned fields.
+        :rtype: set[int]
+        """
+        return self._owned.get(player_id, set())
+
     def update(self, *, item: str, attribute: str, value: Any) -> None:
         """
-        Updates a field on the board.
+        Updates a field on the board and keeps the ownership indexes up to date.
         :param item: The numeric index of the field to update. Do not confuse it with the string index.
         :type item: str
         :param attribute: The name of the attribute to update
@@ -210,10 +346,20 @@ class BoardData(IFields):
         :param value: The new value
         :type value: Any
         """
-        field = self.fields[int(item)]
-        if attribute not in ("owner", "houses", "mortgage") or not hasattr(field, attribute):
+        field = self[int(item)]
+        if attribute not in field.MUTABLE or attribute not in field.spec.keys:
             raise AttributeError(f"Attribute invalid or immutable: {attribute}")
-        setattr(field, attribute, value)
+        if self._shared:
+            self._unshare()
+        if attribute == "owner":
+            self._index_owner(field, field.owner, value)
+            self.owners[field.id] = NO_OWNER if value is None else value
+        elif attribute == "houses":
+            self._index_buildings(field.owner, field.houses, -1)
+            self._index_buildings(field.owner, value, 1)
+            self.house_counts[field.id] = value
+        else:
+            self.mortgages[field.id] = bool(value)
 
     def get_properties_in_set_owned(self, field: Field) -> int:
         """
@@ -223,9 +369,12 @@ class BoardData(IFields):
         :return:
         :rtype:
         """
-        owner = field.owner
-        owned_properties = filter(lambda prop: prop.index in field.full_set and prop.owner == owner, self.fields)
-        return len(list(owned_properties))
+        full_set = field.spec.full_set
+        counts = self._set_owners.get(full_set, {})
+        owner = self.owners[field.id]
+        if owner == NO_OWNER:
+            return len(full_set) - sum(counts.values())
+        return counts.get(owner, 0)
 
     def has_full_set(self, field: Field) -> bool:
         """
@@ -235,13 +384,105 @@ class BoardData(IFields):
         :return:
         :rtype: bool
         """
-        owner = field.owner
-        streets_in_set = filter(
-            lambda street: street.index in field.full_set, self.fields)
-        if all(street.owner == owner for street in streets_in_set):
-            return True
+        return self.get_properties_in_set_owned(field) == len(field.spec.full_set)
+
+    def check_indexes(self) -> list[str]:
+        """
+        Compares the ownership indexes with a full scan of the board. Meant for tests and debugging.
+        :return: Descriptions of the inconsistencies found, empty if the indexes are consistent.
+        :rtype: list[str]
+        """
+        errors = []
+        properties = [field for field in self if field.is_property()]
+        streets = [field for field in properties if field.is_street()]
+        owners = {field.owner for field in properties} - {None}
+        for owner in owners | set(self._owned):
+            scanned = {field.id for field in properties if field.owner == owner}
+            if scanned != self.get_owned(owner):
+                errors.append(f"Owned fields of {owner}: index {self.get_owned(owner)}, scan {scanned}.")
+            houses = sum(field.houses for field in streets if field.owner == owner and field.houses < 5)
+            hotels = sum(1 for field in streets if field.owner == owner and field.houses == 5)
+            if (houses, hotels) != self.count_houses(owner):
+                errors.append(f"Buildings of {owner}: index {self.count_houses(owner)}, scan {(houses, hotels)}.")
+        for field in properties:
+            in_set = [prop for prop in properties if prop.index in field.full_set]
+            owned = sum(1 for prop in in_set if prop.owner == field.owner)
+            if owned != self.get_properties_in_set_owned(field):
+                errors.append(f"Set of {field.index}: index {self.get_properties_in_set_owned(field)}, scan {owned}.")
+            if (owned == len(in_set)) != self.has_full_set(field):
+                errors.append(f"Full set of {field.index}: index {self.has_full_set(field)}, scan {owned == len(in_set)}.")
+        return errors
+
+    def get_state(self) -> tuple[bytes, bytes, bytes]:
+        """
+        Returns the mutable state of the board.
+        :return: The raw contents of the arrays owners, mortgages and house_counts.
+        :rtype: tuple[bytes, bytes, bytes]
+        """
+        return self.owners.tobytes(), self.mortgages.tobytes(), self.house_counts.tobytes()
+
+    def set_state(self, state: tuple[bytes, bytes, bytes]) -> None:
+        """
+        Replaces the mutable state of the board and rebuilds the indexes.
+        :param state: The state as returned by get_state.
+        :type state: tuple[bytes, bytes, bytes]
+        :raises ValueError: If the state does not fit the board.
+        """
+        owners, mortgages, houses = (array(code, data) for code, data in zip("bBB", state))
+        if not len(owners) == len(mortgages) == len(houses) == len(self.specs):
+            raise ValueError(f"The state does not fit a board of {len(self.specs)} fields.")
+        self.owners, self.mortgages, self.house_counts = owners, mortgages, houses
+        self._owned, self._set_owners, self._buildings = {}, {}, {}  # new ones, the old ones may be shared
+        self._shared = False
+        for field_id, owner in enumerate(owners):
+            if owner == NO_OWNER:
+                continue
+            self._owned.setdefault(owner, set()).add(field_id)
+            counts = self._set_owners.setdefault(self.specs[field_id].full_set, {})
+            counts[owner] = counts.get(owner, 0) + 1
+            self._index_buildings(owner, houses[field_id], 1)
+
+    def fork(self) -> "BoardData":
+        """
+        Returns a copy of the board that shares the arrays and the indexes with this board until one of them is
+        changed. Then the changed board copies them first, so a fork that does not change the board costs nothing.
+        :return: The copy.
+        :rtype: BoardData
+        """
+        board = object.__new__(type(self))
+        board.__dict__.update(self.__dict__)
+        board._shared = self._shared = True
+        return board
+
+    def _unshare(self) -> None:
+        self.owners, self.mortgages, self.house_counts = self.owners[:], self.mortgages[:], self.house_counts[:]
+        self._owned = {owner: set(field_ids) for owner, field_ids in self._owned.items()}
+        self._set_owners = {full_set: dict(counts) for full_set, counts in self._set_owners.items()}
+        self._buildings = {owner: list(buildings) for owner, buildings in self._buildings.items()}
+        self._shared = False
+
+    def _index_owner(self, field: Field, old_owner: int | None, new_owner: int | None) -> None:
+        if old_owner == new_owner:
+            return
+        counts = self._set_owners.setdefault(field.spec.full_set, {})
+        if old_owner is not None:
+            self._owned[old_owner].discard(field.id)
+            counts[old_owner] -= 1
+        if new_owner is not None:
+            self._owned.setdefault(new_owner, set()).add(field.id)
+            counts[new_owner] = counts.get(new_owner, 0) + 1
+        if field.is_street():
+            self._index_buildings(old_owner, field.houses, -1)
+            self._index_buildings(new_owner, field.houses, 1)
+
+    def _index_buildings(self, owner: int | None, houses: int, sign: int) -> None:
+        if owner is None or not houses:
+            return
+        buildings = self._buildings.setdefault(owner, [0, 0])
+        if houses == 5:
+            buildings[1] += sign
         else:
-            return False
+            buildings[0] += sign * houses
 
     def get_field(self, field_id: int) -> Field:
         """
@@ -251,7 +492,7 @@ class BoardData(IFields):
         :return:
         :rtype: Field
         """
-        return self.fields[field_id]
+        return Field(self, field_id)
 
     def advance_field_id(self, original_field: int, steps: int) -> int:
         """
@@ -264,13 +505,3 @@ class BoardData(IFields):
         :rtype: int
         """
         return (original_field + steps) % self.lenght
-
-    def _generate_fields(self, fields: list[FieldRecord] = None) -> None:
-        """
-        Generates a list of all fields on the board. If no fields are given, they are taken
-        from the board_description.FIELDS constant.
-        """
-        if fields is None:
-            fields = FIELDS
-        for i in range(len(fields)):
-            self.fields.append(Field(self, i))
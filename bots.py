@@ -0,0 +1,273 @@
+"""
+Server-side bots. A bot takes a seat at a table like a connected client: it receives the frames of the table and sends
+its actions through Messenger.receive. Bots fill the empty seats of a table whose player waits too long for opponents
+(see GameSession.fill_seats) and take over the seats of players who disconnect from a running game until they rejoin.
+
+The decisions with more than one possible action are searched in a pool of processes, so the reactor serving the
+players is never blocked: a snapshot of the game is sent to a worker, which plays rollouts of every action until its
+time budget is spent and returns the action with the best mean outcome, see search.
+"""
+import logging
+import secrets
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import TYPE_CHECKING, Any, TypedDict
+from uuid import UUID
+
+import config
+import simulation
+import snapshot
+from game_controller import GameController
+from rng import Rng
+
+if TYPE_CHECKING:
+    from registry import GameSession
+
+
+class BotStats(TypedDict):
+    decisions: int
+    searches: int
+    rollouts: int
+    stale: int
+    failed: int
+
+
+def search(data: bytes, player_id: int, actions: list[str], budget: float, seed: int, horizon: int) -> tuple[str, int]:
+    """
+    Chooses the action of a bot by rollouts. Every rollout forks the game restored from the snapshot, makes one of the
+    actions and plays on with the buyer policy for all players. The dice are rolled by a new random stream and the card
+    decks are shuffled again, so the bot does not know the future rolls and cards. The actions take turns until the
+    budget is spent, the action with the best mean of the net worth of the bot minus the best net worth of the other
+    players wins.
+    :param data: The snapshot of the game, see snapshot.dumps.
+    :type data: bytes
+    :param player_id: The player_id of the bot.
+    :type player_id: int
+    :param actions: The possible actions of the bot.
+    :type actions: list[str]
+    :param budget: The time of the search in seconds. Every action gets at least one rollout.
+    :type budget: float
+    :param seed: The seed of the rollouts.
+    :type seed: int
+    :param horizon: The number of actions played in one rollout.
+    :type horizon: int
+    :return: The chosen action and the number of rollouts.
+    :rtype: tuple[str, int]
+    """
+    deadline = time.perf_counter() + budget
+    rng = Rng(seed)
+    policies = [simulation.buyer_policy] * config.max_players
+    scores = {action: 0.0 for action in actions}
+    game = _restore(data)
+    rollouts = 0
+    while rollouts < len(actions) or time.perf_counter() < deadline:
+        action = actions[rollouts % len(actions)]
+        rollout_rng = rng.spawn(rollouts)
+        controller = _branch(game, rollout_rng)
+        controller.parse({
+            "my_uuid": controller.gd.players.uuid_from_id(player_id), "action": action, "parameters": {}})
+        simulation.play(controller, policies, rollout_rng.spawn("policy").generator(), horizon)
+        player_ids = sorted(controller.gd.players)
+        worths = simulation.net_worths(controller)
+        own = worths.pop(player_ids.index(player_id))
+        scores[action] += own - max(worths, default=0)
+        rollouts += 1
+    counts = {action: rollouts // len(actions) + (i < rollouts % len(actions)) for i, action in enumerate(actions)}
+    return max(actions, key=lambda action: scores[action] / counts[action]), rollouts
+
+
+def _restore(data: bytes) -> GameController:
+    """
+    Rebuilds a headless game from a snapshot.
+    """
+    messenger = simulation.NullMessenger()
+    controller = GameController(simulation.HeadlessGameData(), messenger)
+    messenger.set_server(simulation.HeadlessServer())
+    snapshot.loads(controller, data)
+    return controller
+
+
+def _branch(game: GameController, rng: Rng) -> GameController:
+    """
+    Forks the game with a new random stream and shuffled card decks.
+    """
+    messenger = simulation.NullMessenger()
+    controller = game.fork(messenger)
+    messenger.set_server(simulation.HeadlessServer())
+    controller.set_rng(rng)
+    for deck in (controller.cc, controller.chance):
+        order = deck.get_order()
+        rng.spawn(deck.deck_type).shuffle(order)
+        deck.restore(tuple(order), 0)
+    return controller
+
+
+class BotPool:
+    """
+    Searches the decisions of all bots of the process in a pool of worker processes. The results are passed back to
+    the reactor thread by call_from_thread.
+    """
+
+    def __init__(
+            self, workers: int = config.bot_workers, call_from_thread: Callable[..., Any] | None = None,
+            budget: float = config.bot_move_budget, horizon: int = config.bot_horizon):
+        self.executor: ProcessPoolExecutor | None = None if workers < 1 else ProcessPoolExecutor(
+            workers, mp_context=get_context("spawn"), initializer=logging.disable, initargs=(logging.CRITICAL,))
+        """ The worker processes. Without them, the search runs in this process, e.g. in the benchmarks. """
+        self.call_from_thread: Callable[..., Any] | None = call_from_thread
+        """ Runs a function in the reactor thread, e.g. reactor.callFromThread. Needed with the worker processes. """
+        self.budget: float = budget
+        """ The time of the search of one decision in seconds. """
+        self.horizon: int = horizon
+        """ The number of actions played in one rollout. """
+        self.stats: BotStats = {"decisions": 0, "searches": 0, "rollouts": 0, "stale": 0, "failed": 0}
+        """ Counters of the decisions, the searches, their rollouts, the results that came too late and the failed
+        searches. """
+
+    def decide(self, bot: "BotClient", actions: set[str]) -> None:
+        """
+        Starts the search of the decision of the bot. The bot gets the result by BotClient.decided.
+        :param bot: The bot on turn.
+        :type bot: BotClient
+        :param actions: The possible actions of the bot.
+        :type actions: set[str]
+        """
+        task = (bot.session.snapshot(), bot.player_id, sorted(actions), self.budget, secrets.randbits(63), self.horizon)
+        key = bot.state_key()
+        self.stats["searches"] += 1
+        if self.executor is None:
+            self._done(bot, key, search(*task))
+            return
+        future = self.executor.submit(search, *task)
+        future.add_done_callback(lambda f: self.call_from_thread(self._finish, bot, key, task[2], f))
+
+    def close(self) -> None:
+        """
+        Stops the worker processes. Searches that are still running are dropped.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, bot: "BotClient", key: tuple, actions: list[str], future: Future) -> None:
+        try:
+            result = future.result()
+        except Exception:
+            logging.exception(f"The search of the bot {bot.player_id} failed.")
+            self.stats["failed"] += 1
+            result = (actions[0], 0)
+        self._done(bot, key, result)
+
+    def _done(self, bot: "BotClient", key: tuple, result: tuple[str, int]) -> None:
+        action, rollouts = result
+        self.stats["rollouts"] += rollouts
+        if bot.decided(key, action):
+            self.stats["decisions"] += 1
+        else:
+            self.stats["stale"] += 1
+
+
+class BotClient:
+    """
+    A bot seated at a table in place of a connected client, see GameSession.join and GameSession.rejoin. It acts
+    whenever the table sends frames to it and it has something to do.
+    """
+    is_bot: bool = True
+    """ Bots do not keep a table alive, see GameSession.leave. """
+
+    def __init__(self, pool: BotPool):
+        self.pool: BotPool = pool
+        """ The pool that searches the decisions. """
+        self.player_uuid: UUID | None = None
+        self.player_id: int | None = None
+        self.session: GameSession | None = None
+        """ The table of the bot. None when the bot has left it. """
+        self._act_scheduled: bool = False
+        self._thinking: bool = False
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.player_id})"
+
+    def write_frames(self, frames: list[bytes]) -> None:
+        """
+        Receives the frames of the table. The bot does not decode them, it looks at the game instead on the next
+        iteration of the reactor.
+        :param frames: The encoded frames.
+        :type frames: list[bytes]
+        """
+        self._schedule_act()
+
+    def act(self) -> None:
+        """
+        Makes the next action of the bot, if it has any. A decision between several actions is searched by the pool.
+        """
+        self._act_scheduled = False
+        if self.session is None or self._thinking:
+            return
+        turn = self.session.controller.turn
+        actions = turn.get_possible_actions(self.player_uuid) or set()
+        if "update_player" in actions:
+            player = self.session.controller.gd.players[self.player_uuid]
+            if not player.token:
+                self.send("update_player", {"attribute": "token", "value": f"bot_{self.player_id}"})
+            if not player.ready:
+                self.send("update_player", {"attribute": "ready", "value": True})
+        elif len(actions) == 1:
+            self.send(next(iter(actions)))
+            self.pool.stats["decisions"] += 1
+        elif actions:
+            self._thinking = True
+            self.pool.decide(self, actions)
+
+    def decided(self, key: tuple, action: str) -> bool:
+        """
+        Makes the action found by the search, unless the game has changed since the search started.
+        :param key: The state of the game when the search started, see state_key.
+        :type key: tuple
+        :param action: The chosen action.
+        :type action: str
+        :return: False if the result came too late.
+        :rtype: bool
+        """
+        self._thinking = False
+        if self.session is None:
+            return False
+        if key != self.state_key():
+            self.act()
+            return False
+        self.send(action)
+        return True
+
+    def state_key(self) -> tuple:
+        """
+        Identifies the state of the game the bot decides in.
+        :return: The stage of the turn, the sequence number of the last change of the game data and the number of
+        actions taken, which also counts the bids.
+        :rtype: tuple
+        """
+        controller = self.session.controller
+        return controller.turn.stage, controller.gd.last_change_seq, controller.turn.actions_taken
+
+    def send(self, action: str, parameters: dict | None = None) -> None:
+        """
+        Sends the action to the game like a client would.
+        :param action: The action.
+        :type action: str
+        :param parameters: The parameters of the action.
+        :type parameters: dict | None
+        """
+        logging.debug(f"Bot {self.player_id} sends {action}.")
+        self.session.messenger.receive({"my_uuid": self.player_uuid, "action": action, "parameters": parameters or {}})
+        self._schedule_act()  # e.g. a double after an auction is not broadcast, but the bot rolls again
+
+    def _schedule_act(self) -> None:
+        if self.session is not None and not self._act_scheduled:
+            self._act_scheduled = True
+            self.session.call_later(0, self.act)
+
+    def retire(self) -> None:
+        """
+        Leaves the table, e.g. when the player whose seat the bot took rejoins. A running search is ignored.
+        """
+        self.session = None
@@ -1,9 +1,9 @@
 
-import itertools
-import random
 from typing import Callable, TypedDict, Literal
 
-from interfaces import IController
+from cycler import Cycler
+from interfaces import IController, IEventLog
+from rng import Rng
 
 
 class CardDict(TypedDict):
@@ -17,8 +17,7 @@ class CardCommands:
 
     @staticmethod
     def advance_to_field(field_id: int, controller: IController):
-        player = controller.gd.on_turn_uuid
-        controller.move_to(field_id, player, check_pass_go=True)
+        controller.move_to(field_id, controller.gd.on_turn, check_pass_go=True)
 
     @staticmethod
     def advance_to_go(controller: IController):
@@ -44,7 +43,7 @@ class CardCommands:
     def advance_to_nearest_station(controller: IController):
         player = controller.gd.on_turn_player
         distance_to_nearest_station = (5 - player.field) % 10
-        controller.move_by(distance_to_nearest_station, player.uuid)
+        controller.move_by(distance_to_nearest_station, player.player_id)
         # paying double rent has to be handled after rolling dice
 
     @staticmethod
@@ -55,13 +54,13 @@ class CardCommands:
             move_to = ww
         else:
             move_to = ec
-        controller.move_to(move_to, player.uuid, check_pass_go=True)
+        controller.move_to(move_to, player.player_id, check_pass_go=True)
         # paying rent has to be handled after rolling dice
 
 
     @staticmethod
     def collect(cash: int, controller: IController):
-        controller.collect(cash, controller.gd.on_turn_uuid)
+        controller.collect(cash, controller.gd.on_turn)
 
     @staticmethod
     def collect_10(controller: IController):
@@ -94,17 +93,20 @@ class CardCommands:
     @staticmethod
     def collect_10_from_everyone(controller: IController):
         on_turn = controller.gd.on_turn_player
-        for player in controller.gd.players:
-            if player is not on_turn:
-                controller.pay(10, player.uuid, on_turn.uuid)
+        for player_id in controller.gd.players:
+            if player_id != on_turn.player_id:
+                controller.pay(10, player_id, on_turn.player_id)
 
     @staticmethod
     def get_out_of_jail(controller: IController):
-        controller.gd.on_turn_player.get_out_of_jail_cards += 1
+        player = controller.gd.on_turn_player
+        controller.gd.update(
+            section="players", item=player.player_id, attribute="get_out_of_jail_cards",
+            value=player.get_out_of_jail_cards + 1)
 
     @staticmethod
     def go_back_3_spaces(controller: IController):
-        controller.move_by(-3, controller.gd.on_turn_uuid, check_pass_go=False)
+        controller.move_by(-3, controller.gd.on_turn, check_pass_go=False)
 
     @staticmethod
     def go_to_jail(controller: IController):
@@ -113,18 +115,18 @@ class CardCommands:
     @staticmethod
     def general_repairs(controller: IController):
         house_price, hotel_price = 25, 100
-        houses, hotels = controller.gd.fields.count_houses(controller.on_turn_player.uuid)
-        controller.pay(house_price * houses + hotel_price * hotels, controller.on_turn_player.uuid)
+        houses, hotels = controller.gd.fields.count_houses(controller.on_turn_player.player_id)
+        controller.pay(house_price * houses + hotel_price * hotels, controller.on_turn_player.player_id)
 
     @staticmethod
     def street_repairs(controller: IController):
         house_price, hotel_price = 40, 115
-        houses, hotels = controller.gd.fields.count_houses(controller.on_turn_player.uuid)
-        controller.pay(house_price * houses + hotel_price * hotels, controller.on_turn_player.uuid)
+        houses, hotels = controller.gd.fields.count_houses(controller.on_turn_player.player_id)
+        controller.pay(house_price * houses + hotel_price * hotels, controller.on_turn_player.player_id)
 
     @staticmethod
     def pay(cash: int, controller: IController):
-        controller.pay(cash, controller.gd.on_turn_uuid)
+        controller.pay(cash, controller.gd.on_turn)
 
     @staticmethod
     def pay_15(controller: IController):
@@ -141,9 +143,9 @@ class CardCommands:
     @staticmethod
     def pay_50_to_everyone(controller: IController):
         on_turn = controller.gd.on_turn_player
-        for player in controller.gd.players:
-            if player is not on_turn:
-                controller.pay(50, on_turn.uuid, player.uuid)
+        for player_id in controller.gd.players:
+            if player_id != on_turn.player_id:
+                controller.pay(50, on_turn.player_id, player_id)
 
 
 class Card:
@@ -255,19 +257,88 @@ class CardDeck:
          "command": CardCommands.collect_100, "card_type": "collect"}
     ]
 
-    def __init__(self, deck_type: Literal["cc", "chance"]) -> None:
+    def __init__(self, deck_type: Literal["cc", "chance"], rng: Rng | None = None) -> None:
         self._deck_type = deck_type
-        self._deck: list[Card] = []
-        deck = self._CHANCE_CARDS if deck_type == self.CHANCE else self._CC_CARDS
-        for card in deck:
-            self._deck.append(Card(**card))
-        random.shuffle(self._deck)
-        self._deck_cycler = itertools.cycle(self._deck)
+        self._deck: list[Card] = self.get_cards(deck_type)
+        (Rng() if rng is None else rng).shuffle(self._deck)
+        self._deck_cycler: Cycler[Card] = Cycler(self._deck)
         self.last_card: Card | None = None
+        self.log: IEventLog | None = None
+        """ The write-ahead log of the game. """
+
+    @classmethod
+    def get_cards(cls, deck_type: Literal["cc", "chance"]) -> list[Card]:
+        """
+        Returns new cards of the given deck in the order in which they are printed, i.e. not shuffled.
+        :param deck_type: CardDeck.CC or CardDeck.CHANCE.
+        :type deck_type: Literal["cc", "chance"]
+        :return: The cards.
+        :rtype: list[Card]
+        """
+        return [Card(**card) for card in (cls._CHANCE_CARDS if deck_type == cls.CHANCE else cls._CC_CARDS)]
+
+    @property
+    def deck_type(self) -> str:
+        return self._deck_type
 
     def draw(self) -> Card:
         self.last_card = next(self._deck_cycler)
+        if self.log is not None:
+            self.log.draw(self._deck_type, self.last_card.id)
         return self.last_card
 
     def apply_card(self, controller: IController):
         self.last_card.apply(controller)
+
+    def get_order(self) -> list[int]:
+        """
+        Returns the ids of the cards in the order in which they are drawn from a new deck.
+        :return: The ids of the cards.
+        :rtype: list[int]
+        """
+        return [card.id for card in self._deck]
+
+    def restore(self, card_ids: tuple[int, ...], draws: int) -> None:
+        """
+        Puts the cards in the given order and draws the given number of cards.
+        :param card_ids: The ids of the cards as returned by get_order.
+        :type card_ids: tuple[int, ...]
+        :param draws: The number of cards drawn since the deck was shuffled.
+        :type draws: int
+        """
+        cards = {card.id: card for card in self._deck}
+        self._deck = [cards[card_id] for card_id in card_ids]
+        self._deck_cycler = Cycler(self._deck, draws)
+        self.last_card = self._deck[draws % len(self._deck) - 1] if draws else None
+
+    def get_state(self) -> tuple[tuple[int, ...], int, int | None]:
+        """
+        Returns the state of the deck.
+        :return: The state as (ids of the cards in order, position of the next card, id of the last drawn card).
+        :rtype: tuple[tuple[int, ...], int, int | None]
+        """
+        return tuple(self.get_order()), self._deck_cycler.position, self.last_card.id if self.last_card else None
+
+    def fork(self) -> "CardDeck":
+        """
+        Returns a copy of the deck in the same order and position. The cards are shared, the copy is not logged.
+        :return: The copy.
+        :rtype: CardDeck
+        """
+        deck = object.__new__(type(self))
+        deck.__dict__.update(self.__dict__)  # the list of cards is replaced by restore and set_state, never changed
+        deck._deck_cycler = Cycler(self._deck, self._deck_cycler.position)
+        deck.log = None
+        return deck
+
+    def set_state(self, state: tuple[tuple[int, ...], int, int | None]) -> None:
+        """
+        Restores the state returned by get_state.
+        :param state: The state.
+        :type state: tuple[tuple[int, ...], int, int | None]
+        """
+        card_ids, position, last_card = state
+        cards = {card.id: card for card in self._deck}
+        self._deck = [cards[card_id] for card_id in card_ids]
+        self._deck_cycler = Cycler(self._deck, position)
+        self.last_card = None if last_card is None else cards[last_card]
@@ -4,9 +4,44 @@ import encoders
 
 listen_port = 8123
 encoder: Type[encoders.Encoder] = encoders.PickleEncoder
+max_frame_size = 1 << 20
+max_players = 4
+workers = 1
+handshake_timeout = 10.0
+worker_stats_interval = 5.0
+wal_dir: str | None = None  # directory of the write-ahead logs of the games, None disables logging
+wal_fsync_interval = 0.05
+wal_compact_records = 200  # the log of a game is replaced by a snapshot when it grows over this number of records
+stage_stats = False  # counts and times the stages of the turns, logged on the interval worker_stats_interval
 
 # rules
 initial_cash = 1500
 initial_field = 0
 go_cash = 200
-payout_price = 50
\ No newline at end of file
+payout_price = 50
+
+# deadlines
+turn_timeout = 60.0  # seconds the player on turn has for an action before the default action is taken, 0 disables it
+turn_default_actions = {  # the actions taken when the deadline passes, by the stage the turn waits in
+    "begin_turn": "roll",
+    "buying_decision": "auction",
+    "end_turn": "end_turn",
+    "in_jail": "payout",
+    "rent_roll": "roll",
+    "bidding": "close_auction",
+}
+stage_timeouts = {  # seconds by the stage, instead of turn_timeout; every accepted bid restarts the closing timer
+    "bidding": 5.0,
+}
+deadline_resolution = 1.0  # seconds per tick of the timer wheel of the deadlines
+
+# auctions
+auction_increment = 10  # the smallest raise of the high bid
+auction_bid_window = 0.25  # seconds in which the accepted bids are announced together as one high bid
+
+# bots
+bot_workers = 0  # processes searching the decisions of the bots, 0 disables the bots
+bot_move_budget = 0.2  # seconds of search for one decision of a bot
+bot_horizon = 300  # actions played ahead in one rollout of the search
+bot_fill_delay = 15.0  # seconds a player waits for opponents before bots take the empty seats
+bot_min_players = 2  # bots fill the table up to this number of players
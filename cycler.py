@@ -0,0 +1,31 @@
+from collections.abc import Iterator, Sequence
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class Cycler(Iterator[T], Generic[T]):
+    """
+    Cycles endlessly over a sequence like itertools.cycle, but its position is visible, so that it can be saved and
+    restored, see snapshot.
+    """
+    __slots__ = ("items", "position")
+
+    def __init__(self, items: Sequence[T], position: int = 0):
+        if not items:
+            raise ValueError("Cannot cycle over an empty sequence.")
+        self.items: Sequence[T] = items
+        """ The items cycled over. """
+        self.position: int = position % len(items)
+        """ The index of the item returned by the next call of next(). """
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.items!r}, {self.position})"
+
+    def __iter__(self) -> "Cycler[T]":
+        return self
+
+    def __next__(self) -> T:
+        item = self.items[self.position]
+        self.position = (self.position + 1) % len(self.items)
+        return item
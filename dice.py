@@ -1,8 +1,7 @@
 # -*- tests-case-name: tests.test_dice -*-
 
-from random import randint
-
-from interfaces import IDice, IRoll
+from interfaces import IDice, IRoll, IEventLog
+from rng import Rng
 
 
 class Roll(IRoll):
@@ -11,8 +10,8 @@ class Roll(IRoll):
     e.g. Roll[0] returns the first dice.
     """
 
-    def __init__(self, count: int, sides: int):
-        self._roll: tuple[int, ...] = tuple(randint(1, sides) for _ in range(count))
+    def __init__(self, values: tuple[int, ...]):
+        self._roll: tuple[int, ...] = tuple(values)
 
     def __getitem__(self, item) -> int:
         return self._roll[item]
@@ -46,15 +45,19 @@ class Roll(IRoll):
 
 class Dice(IDice):
 
-    def __init__(self, count: int = 2, sides: int = 6):
+    def __init__(self, count: int = 2, sides: int = 6, rng: Rng | None = None):
         self.last_roll: Roll | None = None
         """ The last roll. None if no roll has been made yet. """
         self.count: int = count
         """ The number of dice. """
         self.sides: int = sides
         """ The number of sides of the dice. """
+        self.rng: Rng = Rng() if rng is None else rng
+        """ The random number stream of the dice. """
         self.doubles: int = 0
         """ The count of doubles in the row. """
+        self.log: IEventLog | None = None
+        """ The write-ahead log of the game. """
 
     @property
     def triple_double(self) -> bool:
@@ -65,6 +68,18 @@ class Dice(IDice):
         """
         return self.doubles >= 3
 
+    def fork(self) -> "Dice":
+        """
+        Returns a copy of the dice with a copy of their random number stream. The copy is not logged.
+        :return: The copy.
+        :rtype: Dice
+        """
+        dice = object.__new__(type(self))
+        dice.__dict__.update(self.__dict__)
+        dice.rng = self.rng.fork()
+        dice.log = None
+        return dice
+
     def reset(self) -> None:
         """
         Resets the dice.
@@ -82,8 +97,10 @@ class Dice(IDice):
         :return: Roll object
         :rtype: Roll
         """
-        roll = Roll(self.count, self.sides)
+        roll = Roll(self.rng.roll(self.count, self.sides))
         self.last_roll = roll
+        if self.log is not None:
+            self.log.roll(roll.get(), register)
         if register:
             if roll.is_double():
                 self.doubles += 1
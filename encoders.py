@@ -2,10 +2,25 @@ import logging
 import pickle
 import struct
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, ClassVar
+from uuid import UUID
+
+
+class FrameTooLarge(ValueError):
+    """
+    Raised when a peer announces a frame bigger than the allowed maximum.
+    """
+
+    def __init__(self, message: str, messages: list | None = None):
+        super().__init__(message)
+        self.messages: list = [] if messages is None else messages
+        """ The messages decoded from the same data before the frame, see FrameDecoder.feed. """
 
 
 class Encoder(ABC):
+    HEADER: ClassVar[struct.Struct] = struct.Struct("!I")
+    """ The length prefix of every frame. """
+
     @staticmethod
     @abstractmethod
     def encode(message: Any) -> bytes:
@@ -16,28 +31,439 @@ class Encoder(ABC):
     def decode(data: bytes) -> list:
         ...
 
+    @staticmethod
+    @abstractmethod
+    def loads(payload: bytes | memoryview) -> Any:
+        """
+        Deserializes the payload of one frame (without the length prefix).
+        """
+        ...
+
+    @staticmethod
+    @abstractmethod
+    def dumps_items(items: list) -> bytes:
+        """
+        Serializes the items of a list into a chunk that can be framed by encode_items together with other chunks. This
+        allows parts of a message to be encoded once and reused.
+        """
+        ...
+
+    @staticmethod
+    @abstractmethod
+    def encode_items(chunks: list[bytes], count: int) -> bytes:
+        """
+        Encodes a frame with a list made of the chunks serialized by dumps_items.
+        :param chunks: The serialized chunks.
+        :type chunks: list[bytes]
+        :param count: The total number of items in the chunks.
+        :type count: int
+        :return: The encoded frame.
+        :rtype: bytes
+        """
+        ...
+
+
+class FrameDecoder:
+    """
+    Incremental decoder of length-prefixed frames for one connection. Complete frames are decoded straight from the
+    received data, an incomplete frame at the end is kept in the buffer until the rest of it arrives.
+    """
+
+    def __init__(self, encoder: type[Encoder], max_frame_size: int = 1 << 20):
+        self.encoder: type[Encoder] = encoder
+        """ The encoder used to deserialize the frames. """
+        self.max_frame_size: int = max_frame_size
+        """ The biggest payload a peer is allowed to send. """
+        self._buffer: bytearray = bytearray()
+        self._skip: int = 0
+        """ The bytes of a frame that was too large that have not arrived yet. They are dropped when they do. """
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> list:
+        """
+        Consumes the received data and returns all messages that are complete. A frame that cannot be decoded is
+        dropped, the frames after it are decoded as usual.
+        :param data: The data received from the peer.
+        :type data: bytes
+        :return: The decoded messages.
+        :rtype: list
+        :raises FrameTooLarge: If the peer announces a frame bigger than max_frame_size. The frame is dropped, also
+        the part of it that arrives later, and the messages decoded before it are in FrameTooLarge.messages.
+        """
+        if self._skip:
+            skipped = min(self._skip, len(data))
+            self._skip -= skipped
+            data = memoryview(data)[skipped:]
+        if self._buffer:
+            self._buffer += data
+            source = self._buffer
+        else:
+            source = data
+        messages, consumed, error = self._decode_frames(source)
+        if source is self._buffer:
+            del self._buffer[:consumed]
+        elif consumed < len(data):
+            self._buffer += memoryview(data)[consumed:]
+        if error is not None:
+            raise error
+        return messages
+
+    def _decode_frames(self, source: bytes | bytearray | memoryview) -> tuple[list, int, FrameTooLarge | None]:
+        header = self.encoder.HEADER
+        loads = self.encoder.loads
+        messages = []
+        offset = 0
+        end = len(source)
+        with memoryview(source) as view:
+            while end - offset >= header.size:
+                size = header.unpack_from(source, offset)[0]
+                start = offset + header.size
+                if size > self.max_frame_size:
+                    self._skip = max(size - (end - start), 0)
+                    error = FrameTooLarge(
+                        f"Frame of {size} bytes exceeds the limit of {self.max_frame_size} bytes.", messages)
+                    return messages, min(start + size, end), error
+                if end - start < size:
+                    break
+                offset = start + size
+                try:
+                    messages.append(loads(view[start:offset]))
+                except Exception as e:  # whatever the payload makes the decoder raise, only the frame is dropped
+                    logging.error(f"Error decoding frame: {e!r}")
+        return messages, offset, None
+
+
 class PickleEncoder(Encoder):
     @staticmethod
     def encode(message: Any) -> bytes:
         pickled_data = pickle.dumps(message)
-        return struct.pack("!I", len(pickled_data)) + pickled_data
+        return PickleEncoder.HEADER.pack(len(pickled_data)) + pickled_data
 
     @staticmethod
     def decode(data: bytes) -> list:
         try:
-            size = struct.unpack("!I", data[:4])[0]
-            pickled_data = data[4:4 + size]
-            messages = [pickle.loads(pickled_data)]
-            remaining_data = b"" if len(data) <= 4 + size else data[4 + size:]
-            if remaining_data:
-                message = PickleEncoder.decode(remaining_data)
-                if len(message) == 1:
-                    messages.append(message[0])
-                elif len(message) == 0:
-                    pass
-                else:
-                    messages.extend(message)
-            return messages
-        except (struct.error, pickle.UnpicklingError, EOFError) as e:
+            return FrameDecoder(PickleEncoder).feed(data)
+        except FrameTooLarge as e:
             logging.error(f"Error extracting pickled object: {e}")
-            return []
\ No newline at end of file
+            return e.messages
+
+    @staticmethod
+    def loads(payload: bytes | memoryview) -> Any:
+        return pickle.loads(payload)
+
+    @staticmethod
+    def dumps_items(items: list) -> bytes:
+        # A protocol 3 pickle of a list is the empty list followed by batches of appends, no framing. The batches can be
+        # appended to any list on the stack. The memo indices restart in every chunk, but a chunk only reads the entries
+        # it has written itself.
+        pickled_data = pickle.dumps(items, protocol=3)
+        return pickled_data[len(_PICKLED_LIST_START):-len(pickle.STOP)]
+
+    @staticmethod
+    def encode_items(chunks: list[bytes], count: int) -> bytes:
+        size = len(_PICKLED_LIST_START) + sum(len(chunk) for chunk in chunks) + len(pickle.STOP)
+        return b"".join([PickleEncoder.HEADER.pack(size), _PICKLED_LIST_START, *chunks, pickle.STOP])
+
+
+_PICKLED_LIST_START = pickle.dumps([], protocol=3)[:-len(pickle.STOP)]
+""" Protocol 3 pickle opcodes that push an empty list on the stack. """
+
+
+def _build_string_table() -> tuple[str, ...]:
+    """
+    Collects the strings that are sent as one-byte codes by the BinaryEncoder. The order of the strings is a part of
+    the wire format, new strings have to be appended to the end and BinaryEncoder.VERSION increased.
+    """
+    from board_description import FIELDS, FieldType, StreetColor
+
+    strings = [
+        # sections and record keys
+        "fields", "players", "misc", "events", "section", "item", "attribute", "value", "to",
+        # client messages
+        "my_uuid", "action", "parameters", "game_id", "player_uuid", "player_id",
+        "join", "add_player", "update_player", "start_game", "roll", "payout", "use_card", "buy", "auction",
+        "end_turn",
+        # players
+        "name", "token", "cash", "field", "ready", "in_jail", "jail_turns", "get_out_of_jail_cards",
+        "possible_actions",
+        # fields
+        "owner", "mortgage", "houses", "lenght",
+        # misc
+        "my_id", "on_turn", "player_order", "last_roll", "state",
+        # events
+        "pass_go", "card", "triple_double", "game_started", "initialize", "player_connected", "player_updated",
+    ]
+    strings.extend(str(field_type) for field_type in FieldType if field_type.name)
+    strings.extend(str(color) for color in StreetColor)
+    for field in FIELDS:
+        strings.extend(field.keys())
+        strings.append(field["index"])
+        strings.append(field["name"])
+    return tuple(dict.fromkeys(strings))
+
+
+class BinaryEncoder(Encoder):
+    """
+    Compact tagged binary format. Known strings (sections, attributes, actions, field names...) are sent as one-byte
+    codes, ints and tuples of small ints are packed with struct and the records of the messenger
+    ({"section", "item", "attribute", "value"}) have a dedicated layout. Decoding creates only plain values (None,
+    bool, int, float, str, bytes, UUID, tuple, list, set, dict), so it is safe to accept from clients.
+    """
+    VERSION: ClassVar[int] = 1
+    """ Version of the wire format. """
+    STRINGS: ClassVar[tuple[str, ...]] = _build_string_table()
+    """ The interned strings, the code of a string is its index. """
+    MAX_DEPTH: ClassVar[int] = 16
+    """ The deepest nesting of containers accepted by the decoder. """
+
+    @staticmethod
+    def encode(message: Any) -> bytes:
+        out = bytearray(BinaryEncoder.HEADER.size)
+        _write(out, message, 0)
+        BinaryEncoder.HEADER.pack_into(out, 0, len(out) - BinaryEncoder.HEADER.size)
+        return bytes(out)
+
+    @staticmethod
+    def decode(data: bytes) -> list:
+        try:
+            return FrameDecoder(BinaryEncoder).feed(data)
+        except FrameTooLarge as e:
+            logging.error(f"Error extracting binary object: {e}")
+            return e.messages
+
+    @staticmethod
+    def loads(payload: bytes | memoryview) -> Any:
+        try:
+            value, offset = _read(payload, 0, 0)
+        except (struct.error, IndexError, KeyError, TypeError) as e:
+            raise ValueError(f"Malformed payload: {e!r}") from e
+        if offset != len(payload):
+            raise ValueError(f"{len(payload) - offset} bytes of trailing data.")
+        return value
+
+    @staticmethod
+    def dumps(message: Any) -> bytes:
+        """
+        Serializes the message without the length prefix.
+        """
+        out = bytearray()
+        _write(out, message, 0)
+        return bytes(out)
+
+    @staticmethod
+    def dumps_items(items: list) -> bytes:
+        out = bytearray()
+        for item in items:
+            _write(out, item, 1)
+        return bytes(out)
+
+    @staticmethod
+    def encode_items(chunks: list[bytes], count: int) -> bytes:
+        head = _TAG_SIZE.pack(_LIST, count)
+        size = len(head) + sum(len(chunk) for chunk in chunks)
+        return b"".join([BinaryEncoder.HEADER.pack(size), head, *chunks])
+
+
+# Tags of the BinaryEncoder
+(_NONE, _TRUE, _FALSE, _INT8, _INT16, _INT32, _INT64, _FLOAT, _STRING, _STR8, _STR32, _BYTES, _UUID,
+ _TUPLE, _LIST, _SET, _DICT, _INT8_TUPLE, _RECORD) = range(19)
+
+_RECORD_ATTRIBUTE = 1
+_RECORD_TO = 2
+_RECORD_KEYS = frozenset(("section", "item", "attribute", "value", "to"))
+
+_CODES: dict[str, int] = {string: code for code, string in enumerate(BinaryEncoder.STRINGS)}
+_STRINGS = BinaryEncoder.STRINGS
+assert len(_STRINGS) <= 256
+
+_TAG_BYTE = struct.Struct("!BB")
+_TAG_INT8 = struct.Struct("!Bb")
+_TAG_INT16 = struct.Struct("!Bh")
+_TAG_INT32 = struct.Struct("!Bi")
+_TAG_INT64 = struct.Struct("!Bq")
+_TAG_FLOAT = struct.Struct("!Bd")
+_TAG_SIZE = struct.Struct("!BI")
+_RECORD_HEAD = struct.Struct("!BBB")
+_PACK_INT16 = struct.Struct("!h")
+_PACK_INT32 = struct.Struct("!i")
+_PACK_INT64 = struct.Struct("!q")
+_PACK_FLOAT = struct.Struct("!d")
+_PACK_SIZE = struct.Struct("!I")
+
+
+def _write_int(out: bytearray, value: int) -> None:
+    if -0x80 <= value < 0x80:
+        out += _TAG_INT8.pack(_INT8, value)
+    elif -0x8000 <= value < 0x8000:
+        out += _TAG_INT16.pack(_INT16, value)
+    elif -0x80000000 <= value < 0x80000000:
+        out += _TAG_INT32.pack(_INT32, value)
+    else:
+        out += _TAG_INT64.pack(_INT64, value)
+
+
+def _write_str(out: bytearray, value: str) -> None:
+    code = _CODES.get(value)
+    if code is not None:
+        out += _TAG_BYTE.pack(_STRING, code)
+        return
+    raw = value.encode()
+    if len(raw) < 0x100:
+        out += _TAG_BYTE.pack(_STR8, len(raw))
+    else:
+        out += _TAG_SIZE.pack(_STR32, len(raw))
+    out += raw
+
+
+def _write_record(out: bytearray, record: dict, depth: int) -> bool:
+    """
+    Writes a record of the messenger in the compact layout. Returns False if the dict is not a record.
+    """
+    if "item" not in record or "value" not in record or not _RECORD_KEYS.issuperset(record):
+        return False
+    section = _CODES.get(record.get("section"))
+    if section is None:
+        return False
+    flags = 0
+    attribute = 0
+    if "attribute" in record:
+        attribute = _CODES.get(record["attribute"])
+        if attribute is None:
+            return False
+        flags |= _RECORD_ATTRIBUTE
+    if "to" in record:
+        flags |= _RECORD_TO
+    out += _RECORD_HEAD.pack(_RECORD, flags, section)
+    if flags & _RECORD_ATTRIBUTE:
+        out.append(attribute)
+    _write(out, record["item"], depth)
+    _write(out, record["value"], depth)
+    if flags & _RECORD_TO:
+        _write(out, record["to"], depth)
+    return True
+
+
+def _write(out: bytearray, value: Any, depth: int) -> None:
+    kind = type(value)
+    if value is None:
+        out.append(_NONE)
+    elif kind is bool:
+        out.append(_TRUE if value else _FALSE)
+    elif kind is int:
+        _write_int(out, value)
+    elif kind is str:
+        _write_str(out, value)
+    elif kind is dict:
+        if depth >= BinaryEncoder.MAX_DEPTH:
+            raise ValueError("Message is nested too deeply.")
+        if not _write_record(out, value, depth + 1):
+            out += _TAG_SIZE.pack(_DICT, len(value))
+            for key, item in value.items():
+                _write(out, key, depth + 1)
+                _write(out, item, depth + 1)
+    elif kind is tuple and value and len(value) < 0x100 and all(
+            type(item) is int and -0x80 <= item < 0x80 for item in value):
+        out += _TAG_BYTE.pack(_INT8_TUPLE, len(value))
+        out += struct.pack(f"!{len(value)}b", *value)
+    elif kind in (tuple, list, set, frozenset):
+        if depth >= BinaryEncoder.MAX_DEPTH:
+            raise ValueError("Message is nested too deeply.")
+        tag = _TUPLE if kind is tuple else _LIST if kind is list else _SET
+        out += _TAG_SIZE.pack(tag, len(value))
+        for item in value:
+            _write(out, item, depth + 1)
+    elif kind is UUID:
+        out.append(_UUID)
+        out += value.bytes
+    elif kind is float:
+        out += _TAG_FLOAT.pack(_FLOAT, value)
+    elif kind in (bytes, bytearray, memoryview):
+        out += _TAG_SIZE.pack(_BYTES, len(value))
+        out += value
+    elif isinstance(value, int):
+        _write_int(out, int(value))
+    elif isinstance(value, str):
+        _write_str(out, str(value))
+    else:
+        raise TypeError(f"BinaryEncoder cannot encode {kind.__name__}.")
+
+
+def _read(data: bytes | memoryview, offset: int, depth: int) -> tuple[Any, int]:
+    tag = data[offset]
+    offset += 1
+    if tag == _STRING:
+        return _STRINGS[data[offset]], offset + 1
+    if tag == _INT8:
+        value = data[offset]
+        return (value - 0x100 if value >= 0x80 else value), offset + 1
+    if tag == _RECORD:
+        if depth >= BinaryEncoder.MAX_DEPTH:
+            raise ValueError("Message is nested too deeply.")
+        flags = data[offset]
+        record = {"section": _STRINGS[data[offset + 1]]}
+        offset += 2
+        if flags & _RECORD_ATTRIBUTE:
+            attribute = _STRINGS[data[offset]]
+            offset += 1
+        record["item"], offset = _read(data, offset, depth + 1)
+        if flags & _RECORD_ATTRIBUTE:
+            record["attribute"] = attribute
+        record["value"], offset = _read(data, offset, depth + 1)
+        if flags & _RECORD_TO:
+            record["to"], offset = _read(data, offset, depth + 1)
+        return record, offset
+    if tag == _NONE:
+        return None, offset
+    if tag == _TRUE:
+        return True, offset
+    if tag == _FALSE:
+        return False, offset
+    if tag == _INT16:
+        return _PACK_INT16.unpack_from(data, offset)[0], offset + 2
+    if tag == _INT32:
+        return _PACK_INT32.unpack_from(data, offset)[0], offset + 4
+    if tag == _INT64:
+        return _PACK_INT64.unpack_from(data, offset)[0], offset + 8
+    if tag == _FLOAT:
+        return _PACK_FLOAT.unpack_from(data, offset)[0], offset + 8
+    if tag == _INT8_TUPLE:
+        size = data[offset]
+        return struct.unpack_from(f"!{size}b", data, offset + 1), offset + 1 + size
+    if tag == _STR8:
+        size = data[offset]
+        offset += 1
+        return str(data[offset:offset + size], "utf-8"), offset + size
+    if tag == _UUID:
+        if offset + 16 > len(data):
+            raise IndexError("Truncated UUID.")
+        return UUID(bytes=bytes(data[offset:offset + 16])), offset + 16
+    size = _PACK_SIZE.unpack_from(data, offset)[0]
+    offset += _PACK_SIZE.size
+    if tag == _STR32 or tag == _BYTES:
+        if offset + size > len(data):
+            raise IndexError("Truncated string.")
+        raw = data[offset:offset + size]
+        return (str(raw, "utf-8") if tag == _STR32 else bytes(raw)), offset + size
+    if tag not in (_TUPLE, _LIST, _SET, _DICT):
+        raise KeyError(f"Unknown tag {tag}.")
+    if depth >= BinaryEncoder.MAX_DEPTH:
+        raise ValueError("Message is nested too deeply.")
+    if size > len(data) - offset:
+        raise IndexError("Container is longer than the payload.")
+    if tag == _DICT:
+        result = {}
+        for _ in range(size):
+            key, offset = _read(data, offset, depth + 1)
+            result[key], offset = _read(data, offset, depth + 1)
+        return result, offset
+    items = []
+    for _ in range(size):
+        item, offset = _read(data, offset, depth + 1)
+        items.append(item)
+    if tag == _TUPLE:
+        return tuple(items), offset
+    if tag == _SET:
+        return set(items), offset
+    return items, offset
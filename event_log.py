@@ -0,0 +1,267 @@
+"""
+Write-ahead log of a game. The seed of the game, every change of the game data, every roll and every card draw is
+appended to the log of the game, and the state of the turn is checkpointed after every handled message. If the server
+dies, the games are rebuilt by replaying their logs, see GameRegistry.recover. Long logs are compacted: the log is
+replaced by a snapshot of the game (see snapshot), so that the recovery replays only the records written after the
+snapshot.
+
+The log is a binary file: a header (MAGIC, VERSION and the version of the BinaryEncoder) followed by records. Every
+record is prefixed by its kind, size and CRC32 and contains the tuple of its arguments serialized by
+BinaryEncoder.dumps. The kind is kept out of the payload, so that the replay decodes only the records it needs.
+"""
+import logging
+import os
+import struct
+import zlib
+from collections.abc import Iterator
+from typing import Any, ClassVar
+from uuid import UUID
+
+import snapshot
+from encoders import BinaryEncoder
+from interfaces import IController, IEventLog
+from rng import Rng
+
+# Kinds of the records
+UPDATE, ADD_PLAYER, ROLL, DECK, DRAW, CHECKPOINT, SNAPSHOT, SEED, REMOVE_PLAYER = range(9)
+
+
+class EventLog(IEventLog):
+    """
+    The log of one game. Records are collected in memory and written with fsync by sync(), which the server calls on
+    the interval config.wal_fsync_interval, so the log costs one write and one fsync per active game and interval.
+    """
+    MAGIC: ClassVar[bytes] = b"MWAL"
+    """ The first bytes of every log. """
+    VERSION: ClassVar[int] = 4
+    """ Version of the log format. 2 added the SEED records and the random number stream of the dice to the
+    checkpoints, 3 widened the size of the records to 32 bits, 4 added the REMOVE_PLAYER records. """
+    HEADER: ClassVar[struct.Struct] = struct.Struct("!4sBB")
+    """ MAGIC, VERSION, BinaryEncoder.VERSION """
+    RECORD: ClassVar[struct.Struct] = struct.Struct("!BII")
+    """ The kind of a record, the size and the CRC32 of its payload. A value in a record can be as large as a client
+    frame, see config.max_frame_size. """
+    SUFFIX: ClassVar[str] = ".wal"
+    """ The extension of the log files. """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        """ The path of the log file. """
+        self.is_new: bool = not os.path.exists(path)
+        """ True if the log did not exist when it was opened. """
+        self._buffer: bytearray = bytearray()
+        if self.is_new:
+            self._buffer += self.HEADER.pack(self.MAGIC, self.VERSION, BinaryEncoder.VERSION)
+        self.records: int = 0
+        """ The number of records appended since the log was opened or compacted. """
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r})"
+
+    @classmethod
+    def path_for(cls, log_dir: str, game_id: str) -> str:
+        """
+        Returns the path of the log of the given game. The game_id comes from the clients, so it is hex encoded.
+        :param log_dir: The directory of the logs.
+        :type log_dir: str
+        :param game_id: The identifier of the game.
+        :type game_id: str
+        :return: The path of the log.
+        :rtype: str
+        """
+        return os.path.join(log_dir, game_id.encode().hex() + cls.SUFFIX)
+
+    @classmethod
+    def game_id_of(cls, path: str) -> str:
+        """
+        Returns the game_id of the game logged in the given file.
+        :param path: The path of the log.
+        :type path: str
+        :return: The identifier of the game.
+        :rtype: str
+        """
+        return bytes.fromhex(os.path.basename(path).removesuffix(cls.SUFFIX)).decode()
+
+    def update(self, section: str, item: Any, attribute: str | None, value: Any) -> None:
+        self._append(UPDATE, (section, item, attribute, value))
+
+    def add_player(self, player_uuid: UUID, player_id: int) -> None:
+        self._append(ADD_PLAYER, (player_uuid, player_id))
+
+    def remove_player(self, player_id: int) -> None:
+        self._append(REMOVE_PLAYER, (player_id,))
+
+    def roll(self, roll: tuple[int, ...], register: bool) -> None:
+        self._append(ROLL, (roll, register))
+
+    def deck(self, deck_type: str, card_ids: list[int]) -> None:
+        self._append(DECK, (deck_type, tuple(card_ids)))
+
+    def draw(self, deck_type: str, card_id: int) -> None:
+        self._append(DRAW, (deck_type, card_id))
+
+    def checkpoint(self, state: tuple) -> None:
+        self._append(CHECKPOINT, state)
+
+    def seed(self, seed: int, key: tuple) -> None:
+        self._append(SEED, (seed, key))
+
+    def sync(self) -> int:
+        """
+        Writes the collected records to the file and waits until they are on the disk.
+        :return: The number of bytes written.
+        :rtype: int
+        """
+        if not self._buffer:
+            return 0
+        data, self._buffer = self._buffer, bytearray()
+        with open(self.path, "ab") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        return len(data)
+
+    def compact(self, data: bytes) -> int:
+        """
+        Replaces the log by a log that contains only the given snapshot. The snapshot has to be taken after the last
+        appended record, the records not written yet are dropped. The new log is written aside and renamed over the old
+        one, so a crash leaves either of them.
+        :param data: The snapshot of the game, see snapshot.dumps.
+        :type data: bytes
+        :return: The size of the new log.
+        :rtype: int
+        """
+        self._buffer.clear()
+        data = self.HEADER.pack(self.MAGIC, self.VERSION, BinaryEncoder.VERSION) + self._record(SNAPSHOT, data)
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+        self.is_new = False
+        self.records = 0
+        return len(data)
+
+    def close(self, delete: bool = False) -> None:
+        """
+        Writes the remaining records, or deletes the log when the game is over.
+        :param delete: If True, the log is deleted.
+        :type delete: bool
+        """
+        if delete:
+            self._buffer.clear()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        else:
+            self.sync()
+
+    def _append(self, kind: int, arguments: tuple) -> None:
+        self._buffer += self._record(kind, BinaryEncoder.dumps(arguments))
+        self.records += 1
+
+    def _record(self, kind: int, payload: bytes) -> bytes:
+        return self.RECORD.pack(kind, len(payload), zlib.crc32(payload)) + payload
+
+    @classmethod
+    def read(cls, path: str) -> Iterator[tuple[int, memoryview, int]]:
+        """
+        Reads the records of a log. The payloads are not decoded, see BinaryEncoder.loads. Reading stops at the first
+        incomplete or damaged record, which is what a crash in the middle of a write leaves behind.
+        :param path: The path of the log.
+        :type path: str
+        :return: Tuples (kind, payload, offset of the end of the record).
+        :rtype: Iterator[tuple[int, memoryview, int]]
+        :raises ValueError: If the file is not a log or the version of the log is not supported.
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < cls.HEADER.size:
+            raise ValueError(f"{path} is not a game log.")
+        magic, version, encoder_version = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a game log.")
+        if version != cls.VERSION or encoder_version != BinaryEncoder.VERSION:
+            raise ValueError(f"{path} has unsupported version {version}.{encoder_version}.")
+        offset = cls.HEADER.size
+        end = len(data)
+        view = memoryview(data)
+        while end - offset >= cls.RECORD.size:
+            kind, size, crc = cls.RECORD.unpack_from(data, offset)
+            start = offset + cls.RECORD.size
+            payload = view[start:start + size]
+            if len(payload) < size or zlib.crc32(payload) != crc:
+                logging.warning(f"{path} is damaged at offset {offset}, the rest of the log is ignored.")
+                return
+            offset = start + size
+            yield kind, payload, offset
+
+
+def restore(controller: IController, records: Iterator[tuple[int, memoryview, int]]) -> int:
+    """
+    Replays the records of a log into a newly created game. The replay starts from the last snapshot, if there is one.
+    Only the records up to the last checkpoint are applied, the records after it belong to a message whose handling
+    was not finished.
+    :param controller: The controller of the new game.
+    :type controller: IController
+    :param records: The records as returned by EventLog.read.
+    :type records: Iterator[tuple[int, memoryview, int]]
+    :return: The offset of the end of the last checkpoint in the log, 0 if there is no checkpoint.
+    :rtype: int
+    :raises ValueError: If a record cannot be decoded.
+    """
+    records = list(records)
+    last = max((i for i, (kind, _, _) in enumerate(records) if kind in (CHECKPOINT, SNAPSHOT)), default=-1)
+    if last < 0:
+        return 0
+    first = max((i for i, (kind, _, _) in enumerate(records[:last + 1]) if kind == SNAPSHOT), default=-1)
+    game_data = controller.gd
+    decks = {deck.deck_type: deck for deck in (controller.cc, controller.chance)}
+    orders: dict[str, tuple[int, ...]] = {}
+    draws = dict.fromkeys(decks, 0)
+    if first >= 0:
+        snapshot.loads(controller, records[first][1])
+        for deck_type, deck in decks.items():
+            orders[deck_type], draws[deck_type], _ = deck.get_state()
+    touched = set()
+    loads = BinaryEncoder.loads
+    # Only the last write of every item is applied, in the order of the last writes, so that a write of a whole item
+    # does not hide a later write of one of its attributes. They are applied before a player is added or removed.
+    updates: dict[tuple, tuple] = {}
+    for kind, payload, _ in records[first + 1:last]:
+        if kind == UPDATE:
+            update = loads(payload)
+            updates.pop(update[:3], None)
+            updates[update[:3]] = update
+        elif kind == ADD_PLAYER:
+            game_data.replay(updates.values())
+            updates.clear()
+            game_data.add_player(*loads(payload))
+        elif kind == REMOVE_PLAYER:
+            game_data.replay(updates.values())
+            updates.clear()
+            game_data.remove_player(*loads(payload))
+        elif kind == DRAW:
+            deck_type = loads(payload)[0]
+            draws[deck_type] += 1
+            touched.add(deck_type)
+        elif kind == DECK:
+            deck_type, order = loads(payload)
+            orders[deck_type] = order
+            draws[deck_type] = 0
+            touched.add(deck_type)
+        elif kind == SEED:
+            controller.set_rng(Rng(*loads(payload)))
+        # The rolls are kept for auditing, the state of the dice is a part of the checkpoints.
+    game_data.replay(updates.values())
+    for deck_type in touched:
+        decks[deck_type].restore(orders[deck_type], draws[deck_type])
+    kind, payload, end = records[last]
+    if kind == CHECKPOINT:
+        game_data.restore_player_order()
+        controller.turn.set_state(loads(payload))
+    for _ in game_data.get_changes():  # the changes were sent to the clients before the crash
+        pass
+    return end
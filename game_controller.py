@@ -4,21 +4,28 @@ from uuid import UUID
 import config
 from chance_cc_cards import CardDeck
 from dice import Dice
-from interfaces import ClientMessage, IController, IMessenger, IData, IDice, IRoll, IField, IPlayer
+from interfaces import ClientMessage, IController, IMessenger, IData, IDice, IRoll, IField, IPlayer, IEventLog
+from rng import Rng
 from turn import Turn
 
 
 class GameController(IController):
-    def __init__(self, data: IData, messenger: IMessenger):
+    def __init__(self, data: IData, messenger: IMessenger, rng: Rng | None = None):
         super().__init__(data)
         self.gd: IData = data
         self.message: IMessenger | None = messenger
         self.message.controller = self
         self.server_uuid: UUID | None = None
+        self.rng: Rng = Rng() if rng is None else rng
+        """ The random number stream of the game. The dice, the card decks and the player order use streams spawned
+        from it. """
         self.turn: Turn = Turn(self)
-        self.dice: IDice = Dice(2, 6)
-        self.cc: CardDeck = CardDeck("cc")
-        self.chance: CardDeck = CardDeck("chance")
+        self.dice: IDice = Dice(2, 6, self.rng.spawn("dice"))
+        self.cc: CardDeck = CardDeck("cc", self.rng.spawn("cc"))
+        self.chance: CardDeck = CardDeck("chance", self.rng.spawn("chance"))
+        self.gd.rng = self.rng.spawn("players")
+        self.log: IEventLog | None = None
+        """ The write-ahead log of the game. """
 
     def __getattr__(self, item):
         return getattr(self.turn, item)
@@ -31,81 +38,181 @@ class GameController(IController):
         self.gd.update(section="events", item="roll", value=roll.get())
         return roll
 
-    def pay(self, payment: int, payer_uuid: UUID, payee_uuid: UUID | None = None) -> None:
+    def pay(self, payment: int, payer_id: int, payee_id: int | None = None) -> None:
         """
         Pay the given amount of cash from the given payer to the given payee. If the payment is meant to the bank,
-        the payee_uuid should be None.
+        the payee_id should be None.
         :param payment:
         :type payment: int
-        :param payer_uuid:
-        :type payer_uuid:
-        :param payee_uuid:
-        :type payee_uuid:
+        :param payer_id: The player_id of the payer.
+        :type payer_id: int
+        :param payee_id: The player_id of the payee.
+        :type payee_id: int | None
         :return:
         :rtype:
         """
-        payer_cash = self.gd.players[payer_uuid].cash
-        self.gd.update(section="players", item=payer_uuid, attribute="cash", value=payer_cash - payment)
-        if payee_uuid is not None:
-            payee_cash = self.gd.players[payee_uuid].cash
-            self.gd.update(section="players", item=payee_uuid, attribute="cash", value=payee_cash + payment)
+        payer_cash = self.gd.players[payer_id].cash
+        self.gd.update(section="players", item=payer_id, attribute="cash", value=payer_cash - payment)
+        if payee_id is not None:
+            payee_cash = self.gd.players[payee_id].cash
+            self.gd.update(section="players", item=payee_id, attribute="cash", value=payee_cash + payment)
 
-    def collect(self, payment: int, player_uuid: UUID) -> None:
+    def collect(self, payment: int, player_id: int) -> None:
         """
         Collect the given amount of cash for the given player.
         :param payment:
         :type payment:
-        :param player_uuid:
-        :type player_uuid:
+        :param player_id:
+        :type player_id: int
         :return:
         :rtype:
         """
-        player_cash = self.gd.players[player_uuid].cash
-        self.gd.update(section="players", item=player_uuid, attribute="cash", value=player_cash + payment)
+        player_cash = self.gd.players[player_id].cash
+        self.gd.update(section="players", item=player_id, attribute="cash", value=player_cash + payment)
 
-    def move_to(self, field_id: int, player_uuid: UUID | None = None, check_pass_go: bool = False) -> None:
+    def move_to(self, field_id: int, player_id: int | None = None, check_pass_go: bool = False) -> None:
         """
-        Moves a player to a new field. If player_uuid is None, the player on turn is moved. If check_pass_go is True,
+        Moves a player to a new field. If player_id is None, the player on turn is moved. If check_pass_go is True,
         the player will be checked if they pass Go and paid off.
         :param field_id:
         :type field_id:
-        :param player_uuid: The UUID of the player.
-        :type player_uuid: UUID | None
+        :param player_id: The player_id of the player.
+        :type player_id: int | None
         :param check_pass_go: Whether to check if the player passes Go.
         :type check_pass_go: bool
         """
-        if player_uuid is None:
-            player_uuid = self.gd.on_turn_uuid
-        original_field = self.gd.players[player_uuid].field
-        self.gd.update(section="players", item=player_uuid, attribute="field", value=field_id)
+        if player_id is None:
+            player_id = self.gd.on_turn
+        original_field = self.gd.players[player_id].field
+        self.gd.update(section="players", item=player_id, attribute="field", value=field_id)
         if field_id == self.gd.fields.JAIL:
-            self.gd.update(section="players", item=player_uuid, attribute="in_jail", value=True)
+            self.gd.update(section="players", item=player_id, attribute="in_jail", value=True)
         elif original_field == self.gd.fields.JAIL:
-            self.gd.update(section="players", item=player_uuid, attribute="in_jail", value=False)
+            self.gd.update(section="players", item=player_id, attribute="in_jail", value=False)
         elif check_pass_go and original_field > field_id:
             self.gd.update(section="events", item="pass_go", value=True)
-            self.collect(config.go_cash, player_uuid)
+            self.collect(config.go_cash, player_id)
 
 
-    def move_by(self, fields: int, player_uuid: UUID | None = None, check_pass_go: bool = True) -> None:
+    def move_by(self, fields: int, player_id: int | None = None, check_pass_go: bool = True) -> None:
         """
-        Moves a player by the given number of fields. If player_uuid is None, the player on turn is moved. If
+        Moves a player by the given number of fields. If player_id is None, the player on turn is moved. If
         check_pass_go is True, the player will be checked if they pass Go and paid off.
         :param fields: How many fields to move.
         :type fields: int
-        :param player_uuid: Player UUID.
-        :type player_uuid: UUID
+        :param player_id: The player_id of the player.
+        :type player_id: int | None
         :param check_pass_go: Whether to check if the player passes Go.
         :type check_pass_go: bool
         """
-        if player_uuid is None:
-            player_uuid = self.gd.on_turn_uuid
-        original_field = self.gd.players[player_uuid].field
+        if player_id is None:
+            player_id = self.gd.on_turn
+        original_field = self.gd.players[player_id].field
         new_field = self.gd.fields.advance_field_id(original_field, fields)
-        self.move_to(new_field, player_uuid, check_pass_go)
+        self.move_to(new_field, player_id, check_pass_go)
 
     def buy_property(self, field: IField, player: IPlayer, price: int = -1) -> None:
         if price == -1:
             price = field.price
-        self.pay(price, player.uuid, field.owner)
-        self.gd.update(section="fields", item=field.id, attribute="owner", value=player.uuid)
+        self.pay(price, player.player_id, field.owner)
+        self.gd.update(section="fields", item=field.id, attribute="owner", value=player.player_id)
+
+    def attach_log(self, log: IEventLog, new: bool) -> None:
+        """
+        Starts logging the game to the given log.
+        :param log: The write-ahead log.
+        :type log: IEventLog
+        :param new: True if the log is empty. The seed of the game and the order of the shuffled card decks are logged
+        first.
+        :type new: bool
+        """
+        if new:
+            log.seed(self.rng.seed, self.rng.key)
+            for deck in (self.cc, self.chance):
+                log.deck(deck.deck_type, deck.get_order())
+        self.log = log
+        self.gd.log = log
+        self.dice.log = log
+        self.cc.log = log
+        self.chance.log = log
+
+    def get_state(self) -> tuple:
+        """
+        Returns the complete state of the game, see snapshot.
+        :return: The state as (game data, cc deck, chance deck, turn, (seed, key) of the random number stream).
+        :rtype: tuple
+        """
+        return (
+            self.gd.get_state(), self.cc.get_state(), self.chance.get_state(), self.turn.get_state(),
+            (self.rng.seed, self.rng.key),
+        )
+
+    def set_state(self, state: tuple) -> None:
+        """
+        Restores the state returned by get_state.
+        :param state: The state.
+        :type state: tuple
+        """
+        game_data, cc, chance, turn, (seed, key) = state
+        self.set_rng(Rng(seed, key))
+        self.gd.set_state(game_data)
+        self.cc.set_state(cc)
+        self.chance.set_state(chance)
+        self.turn.set_state(turn)
+
+    def fork(self, messenger: IMessenger) -> "GameController":
+        """
+        Returns a copy of the game that can be played on independently, e.g. to search hypothetical futures. The copy
+        shares everything that does not change during the game and the parts that did not change since the fork (see
+        GameData.fork), so a fork costs a small fraction of a snapshot. The copy is not logged and plays with the same
+        dice and cards as the game would, unless set_rng is called.
+        :param messenger: The messenger of the copy, e.g. one that drops all messages.
+        :type messenger: IMessenger
+        :return: The copy.
+        :rtype: GameController
+        """
+        controller = object.__new__(type(self))  # copy.copy would recurse in __getattr__ on the empty instance
+        controller.__dict__.update(self.__dict__)
+        controller.gd = self.gd.fork()
+        controller.message = messenger
+        messenger.controller = controller
+        controller.rng = self.rng.fork()
+        controller.dice = self.dice.fork()
+        controller.cc = self.cc.fork()
+        controller.chance = self.chance.fork()
+        controller.log = None
+        controller.turn = self.turn.fork(controller)
+        return controller
+
+    def checkpoint(self) -> tuple:
+        """
+        Marks the current state of the game, so that it can be rolled back to it, e.g. to try several actions in turn.
+        See GameData.checkpoint.
+        :return: The checkpoint for rollback.
+        :rtype: tuple
+        :raises RuntimeError: If the game is logged.
+        """
+        return self.gd.checkpoint(), self.cc.get_state(), self.chance.get_state(), self.turn.get_state()
+
+    def rollback(self, checkpoint: tuple) -> None:
+        """
+        Restores the state of the game at the checkpoint.
+        :param checkpoint: The checkpoint returned by checkpoint.
+        :type checkpoint: tuple
+        """
+        game_data, cc, chance, turn = checkpoint
+        self.gd.rollback(game_data)
+        self.cc.set_state(cc)
+        self.chance.set_state(chance)
+        self.turn.set_state(turn)
+
+    def set_rng(self, rng: Rng) -> None:
+        """
+        Replaces the random number stream of the game, e.g. by the stream of a game restored from its log. The card
+        decks are not shuffled again.
+        :param rng: The new stream.
+        :type rng: Rng
+        """
+        self.rng = rng
+        self.dice.rng = rng.spawn("dice")
+        self.gd.rng = rng.spawn("players")
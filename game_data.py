@@ -1,14 +1,17 @@
-import itertools
-from collections.abc import Iterator
-from itertools import cycle
-import random
+from collections.abc import Hashable, Iterable, Iterator
 from uuid import UUID
 from typing import TypedDict, Any
 
 import config
 from board import BoardData
-from interfaces import IData
+from cycler import Cycler
+from interfaces import IData, IEventLog
 from players import Players, Player
+from rng import Rng
+
+
+_MISSING = object()
+""" Marks an item of misc that did not exist before it was updated, see GameData.rollback. """
 
 
 class Misc(TypedDict, total=False):
@@ -20,12 +23,22 @@ class Misc(TypedDict, total=False):
 
 class GameData(IData):
 
-    def __init__(self):
+    def __init__(self, rng: Rng | None = None):
         self.fields: BoardData = BoardData()
         self.players: Players = Players()
         self.misc: Misc = {}
-        self._changes: list[tuple] = []
-        self.player_order_cycler: cycle | None = None
+        self._changes: dict[tuple, tuple[int, tuple]] = {}
+        """ The change journal. Maps (section, item, attribute) to (sequence number of the latest write, change) in
+        first-touch order, so the sequence numbers of the entries are not ordered. """
+        self._change_seq: int = 0
+        self.player_order_cycler: Cycler[int] | None = None
+        self.log: IEventLog | None = None
+        """ The write-ahead log of the game. All changes except events are logged. """
+        self.rng: Rng = Rng() if rng is None else rng
+        """ The random number stream used to shuffle the player order. """
+        self._undo: list[tuple] | None = None
+        """ The previous values of the updated items since the first checkpoint, see checkpoint. None if there is no
+        checkpoint. """
 
     def __getitem__(self, item):
         return getattr(self, item)
@@ -62,8 +75,8 @@ class GameData(IData):
         Updates the value of a specific item.
         :param section:
         :type section: str
-        :param item:
-        :type item: str | UUID
+        :param item: The item. Players can be given by their player_id or UUID.
+        :type item: int | str | UUID
         :param attribute:
         :type attribute: str | None
         :param value:
@@ -71,8 +84,17 @@ class GameData(IData):
         :return:
         :rtype: None
         """
-        if self.get_value(section,item, attribute) == value:  # No changes, necessary due to recursion
+        if section == "players":
+            item = self.players.handle(item)  # players are journaled by their player_id
+        previous = self.get_value(section, item, attribute)
+        if previous == value:  # No changes, necessary due to recursion
             return
+        if self._undo is not None and section != "events":
+            if section == "misc" and attribute is None and item not in self.misc:
+                previous = _MISSING
+            self._undo.append((section, item, attribute, previous))
+        if self.log is not None and section != "events":
+            self.log.update(section, item, attribute, value)
         if section == "fields":
             self.fields.update(item=item, attribute=attribute, value=value)
             self.add_change(section, item, attribute, value)
@@ -88,6 +110,24 @@ class GameData(IData):
             self[section][item] = value
             self.add_change(section, item, value)
 
+    def replay(self, updates: Iterable[tuple[str, int | str, str | None, Any]]) -> None:
+        """
+        Applies updates read from the write-ahead log, see event_log.restore. They are not journaled, undone or logged
+        again: the clients receive the whole state after a recovery anyway.
+        :param updates: The updates as (section, item, attribute, value), players by their player_id.
+        :type updates: Iterable[tuple[str, int | str, str | None, Any]]
+        """
+        for section, item, attribute, value in updates:
+            if section == "fields":
+                self.fields.update(item=item, attribute=attribute, value=value)
+            elif section == "players":
+                self.players.update(item, attribute, value)
+            elif attribute is not None:
+                self[section][item][attribute] = value
+            else:
+                self[section][item] = value
+        self._change_seq += 1  # the state is not the one cached for the last sequence number any more
+
     def add_change(self, *args, **kwargs) -> None:
         if args and kwargs:
             raise AttributeError("Cannot mix positional and keyword arguments")
@@ -100,9 +140,14 @@ class GameData(IData):
                 args = tuple([kwargs[key] for key in sorted_keys])
             except ValueError:
                 raise AttributeError("Unknown keyword argument")
-        if args in self._changes or not 3 <= len(args) <= 4:
+        if not 3 <= len(args) <= 4:
             return
-        self._changes.append(args)
+        self._change_seq += 1
+        if args[0] == "events":
+            key = (args[0], self._change_seq)  # events are occurrences, not state, so they are never coalesced
+        else:
+            key = args[:-1]
+        self._changes[key] = (self._change_seq, args)  # a repeated write keeps its first-touch position
 
     def get_value(self, section: str, item: str | int | UUID, attribute: str | None = None) -> Any:
         """
@@ -148,25 +193,36 @@ class GameData(IData):
     def get_changes(self, for_client: bool = True) -> Iterator[dict]:
         """
         Retrieves data for all recently altered items in a format that can be used by the messenger. Method
-        returns an iterator that can be used in a for loop.
-        :param for_client: When changes are meant to be sent to a client, uuid has to be replaced with id.
+        returns an iterator that can be used in a for loop. The changes come in the order in which the items were first
+        altered, each with its latest value. The journal is emptied.
+        :param for_client: When False, the records contain the sequence number of the latest write of the item as
+        "seq". An item written again after other items keeps its position but takes the newer number, so the numbers
+        within one batch are not ordered; last_change_seq is the highest of them. Players are always referred to by
+        their ids, so no uuids are sent to the clients.
         Default: True.
         :type for_client: bool
         :return:
         :rtype: Iterator[tuple[str, str | UUID, str | None]]
         """
-        while self._changes:
-            change = self.get(*self._changes.pop())
-            if change["section"] == "players" and change["attribute"] == "possible_actions":
-                change["to"] = change["item"]
-            if for_client:
-                if change["section"] == "players":
-                    change["item"] = self.players.id_from_uuid(change["item"])
+        changes, self._changes = self._changes, {}
+        for seq, args in changes.values():
+            change = self.get(*args)
+            if change["section"] == "players" and change["attribute"] in Player.PRIVATE:
+                change["to"] = self.players.uuid_from_id(change["item"])
+            if not for_client:
+                change["seq"] = seq
             yield change
 
     def is_changes_pending(self) -> bool:
         return bool(self._changes)
 
+    @property
+    def last_change_seq(self) -> int:
+        """
+        The sequence number of the latest change. Sequence numbers increase monotonically with every change.
+        """
+        return self._change_seq
+
     def get_all_for_player(self, player_uuid: UUID) -> list[dict]:
         """
         Retrieves all data for a specific player in a format that can be used by the message factory. This method is
@@ -176,42 +232,208 @@ class GameData(IData):
         :return: A list of dictionaries containing the retrieved data for the player.
         :rtype: list[dict]
         """
-        data = list()
+        return self.get_player_records(player_uuid) + self.get_static_records() + self.get_dynamic_records()
+
+    def get_player_records(self, player_uuid: UUID) -> list[dict]:
+        """
+        Retrieves the part of the initial data that is specific to the receiving player.
+        :param player_uuid: The UUID of the player.
+        :type player_uuid: UUID
+        :return: A list of dictionaries containing the retrieved data for the player.
+        :rtype: list[dict]
+        """
         # Following data is stored in a different location on the player's side, so it has to be reformatted.
-        data.append({"section": "misc", "item": "my_uuid", "value": player_uuid})
-        player_id = self.players.id_from_uuid(player_uuid)
-        data.append({"section": "misc", "item": "my_id", "value": player_id})
-        # Retrieve data from "fields" section
+        player = self.players[player_uuid]
+        return [
+            {"section": "misc", "item": "my_uuid", "value": player_uuid},
+            {"section": "misc", "item": "my_id", "value": player.player_id},
+            {"section": "players", "item": player.player_id, "attribute": "orders", "value": player.orders},
+            {"section": "players", "item": player.player_id, "attribute": "buy_limit", "value": player.buy_limit},
+        ]
+
+    def get_static_records(self) -> list[dict]:
+        """
+        Retrieves the part of the initial data that never changes: the immutable data of the board. It is the same for
+        all games on the same board, see get_static_key.
+        :return: A list of dictionaries containing the retrieved data.
+        :rtype: list[dict]
+        """
         # General board data are sent as "fields" with item == -1
-        data.append({"section": "fields", "item": -1, "attribute": "lenght", "value": len(self.fields)})
-        for i, field in enumerate(self.fields):
-            for attribute in field:
-                data.append(self.get("fields", i, attribute, getattr(field, attribute)))
-        # Retrieve data from section "players". It is done separately because
-        # we don't want to send uuids of other players so we have to replace them with their ids.
-        for item in self["players"]:
-            player_id = self.get_value("players", item, "player_id")
-            for attribute, value in self.players[item].attr_dict.items():
-                date = self.get("players", item, attribute, value)
-                date["item"] = player_id
-                data.append(date)
+        data = [{"section": "fields", "item": -1, "attribute": "lenght", "value": len(self.fields)}]
+        for spec in self.fields.specs:
+            for attribute in spec.info:
+                if attribute != "rent":  # the rent is the actual rent, which depends on the game
+                    data.append(self.get("fields", spec.id, attribute, spec.info[attribute]))
+        return data
+
+    def get_static_key(self) -> Hashable:
+        """
+        Returns a key identifying the static records, games with the same key share them.
+        """
+        return self.fields.specs
+
+    def get_dynamic_records(self) -> list[dict]:
+        """
+        Retrieves the part of the initial data that changes during the game: the state of the properties and the
+        players. Players are referred to by their ids, the uuids of other players are never sent. The records are valid
+        until last_change_seq changes.
+        :return: A list of dictionaries containing the retrieved data.
+        :rtype: list[dict]
+        """
+        data = list()
+        for field in self.fields:
+            if field.is_property():
+                data.append(self.get("fields", field.id, "rent", field.rent))
+                for attribute in field.MUTABLE:
+                    if attribute in field.spec.keys:
+                        data.append(self.get("fields", field.id, attribute, getattr(field, attribute)))
+        for player in self.players.values():
+            for attribute, value in player.attr_dict.items():
+                data.append(self.get("players", player.player_id, attribute, value))
         return data
 
     def set_initial_values(self):
         for player in self.players:
             self.update(section="players", item=player, attribute="cash", value=config.initial_cash)
             self.update(section="players", item=player, attribute="field", value=config.initial_field)
-        player_order = list(range(len(self.players)))
-        random.shuffle(player_order)
+        player_order = list(self.players)
+        self.rng.shuffle(player_order)
         self.update(section="misc", item="player_order", value=player_order)
-        self.player_order_cycler = itertools.cycle(player_order)
+        self.player_order_cycler = Cycler(player_order)
         self.update(section="misc", item="on_turn", value=next(self.player_order_cycler))
 
-    def is_player_on_turn(self, player_uuid: UUID) -> bool:
-        return player_uuid == self.players.uuid_from_id(self.get_value("misc", "on_turn"))
+    def restore_player_order(self) -> None:
+        """
+        Sets the player order cycler so that the player after the one on turn comes next. Used when the game data were
+        rebuilt from the log.
+        """
+        player_order = self.get_value("misc", "player_order")
+        if not player_order:
+            return
+        self.player_order_cycler = Cycler(player_order, list(player_order).index(self.on_turn) + 1)
+
+    def get_state(self) -> tuple:
+        """
+        Returns the complete state of the game data as plain values, see snapshot. The change journal is not a part of
+        the state, only its sequence number is.
+        :return: The state as (players, fields, misc, position of the player_order_cycler, last_change_seq).
+        :rtype: tuple
+        """
+        cycler = self.player_order_cycler
+        return (
+            self.players.get_state(), self.fields.get_state(), dict(self.misc),
+            -1 if cycler is None else cycler.position, self._change_seq,
+        )
+
+    def set_state(self, state: tuple) -> None:
+        """
+        Replaces the game data by the given state. The change journal is emptied, the clients are expected to receive
+        the whole state, see get_all_for_player.
+        :param state: The state as returned by get_state.
+        :type state: tuple
+        """
+        players, fields, misc, position, self._change_seq = state
+        self.players.set_state(players)
+        self.fields.set_state(fields)
+        self.misc = misc
+        self._changes = {}
+        player_order = misc.get("player_order")
+        self.player_order_cycler = Cycler(player_order, position) if player_order and position >= 0 else None
+
+    def fork(self) -> "GameData":
+        """
+        Returns a copy of the game data for a hypothetical future of the game, e.g. for a search. The board is shared
+        until it is changed, see BoardData.fork. The copy has no log, no change journal and no checkpoints.
+        :return: The copy.
+        :rtype: GameData
+        """
+        game_data = object.__new__(type(self))
+        game_data.__dict__.update(self.__dict__)
+        game_data.fields = self.fields.fork()
+        game_data.players = self.players.fork()
+        game_data.misc = dict(self.misc)  # the values are replaced, never changed in place
+        game_data._changes = {}
+        cycler = self.player_order_cycler
+        game_data.player_order_cycler = None if cycler is None else Cycler(cycler.items, cycler.position)
+        game_data.log = None
+        game_data.rng = self.rng.fork()
+        game_data._undo = None
+        return game_data
+
+    def checkpoint(self) -> tuple[int, int, tuple[int, int, int]]:
+        """
+        Marks the current state, so that the game data can be rolled back to it. From the first checkpoint on, every
+        update keeps the previous value until drop_checkpoints is called. Adding players is not undone.
+        :return: The checkpoint for rollback.
+        :rtype: tuple[int, int, tuple[int, int, int]]
+        :raises RuntimeError: If the game is logged, the log cannot be rolled back.
+        """
+        if self.log is not None:
+            raise RuntimeError("A logged game cannot be rolled back.")
+        if self._undo is None:
+            self._undo = []
+        cycler = self.player_order_cycler
+        return len(self._undo), -1 if cycler is None else cycler.position, self.rng.get_state()
+
+    def rollback(self, checkpoint: tuple[int, int, tuple[int, int, int]]) -> None:
+        """
+        Restores the state of the checkpoint by undoing the updates made since, in the reverse order. Later checkpoints
+        become invalid. The change journal is emptied and last_change_seq increases, like after set_state.
+        :param checkpoint: The checkpoint returned by checkpoint.
+        :type checkpoint: tuple[int, int, tuple[int, int, int]]
+        """
+        length, position, rng_state = checkpoint
+        undo = self._undo
+        while len(undo) > length:
+            section, item, attribute, value = undo.pop()
+            if section == "fields":
+                self.fields.update(item=item, attribute=attribute, value=value)
+            elif section == "players":
+                self.players.update(item=item, attribute=attribute, value=value)
+            elif value is _MISSING:
+                del self[section][item]
+            elif attribute is not None:
+                self[section][item][attribute] = value
+            else:
+                self[section][item] = value
+        player_order = self.misc.get("player_order")
+        self.player_order_cycler = Cycler(player_order, position) if player_order and position >= 0 else None
+        self.rng.set_state(rng_state)
+        self._changes = {}
+        self._change_seq += 1  # the state differs from any state the clients were sent
+
+    def drop_checkpoints(self) -> None:
+        """
+        Stops keeping the previous values of the updates. All checkpoints become invalid.
+        """
+        self._undo = None
+
+    def is_player_on_turn(self, player: UUID | int) -> bool:
+        try:
+            return self.players.handle(player) == self.get_value("misc", "on_turn")
+        except KeyError:
+            return False
 
     def add_player(self, player_uuid: UUID, player_id: int):
         player = self.players.add(player_uuid, player_id)
+        if self.log is not None:
+            self.log.add_player(player_uuid, player_id)
         for attribute in player:
-            self.add_change(section="players", item=player.uuid, attribute=attribute, value=player[attribute])
+            self.add_change(section="players", item=player.player_id, attribute=attribute, value=player[attribute])
+        return player
+
+    def remove_player(self, player_id: int) -> Player:
+        """
+        Removes a player who left before the game started, so that the player_id can be given to the next player who
+        joins. The changes of the player that were not sent yet are dropped.
+        :param player_id: The player_id of the player.
+        :type player_id: int
+        :return: The removed player.
+        :rtype: Player
+        """
+        player = self.players.remove(player_id)
+        if self.log is not None:
+            self.log.remove_player(player_id)
+        for key in [key for key in self._changes if key[0] == "players" and key[1] == player_id]:
+            del self._changes[key]
         return player
\ No newline at end of file
@@ -1,9 +1,10 @@
 from abc import ABC, abstractmethod
-from collections.abc import Sized, Iterable, Iterator
+from collections.abc import Callable, Hashable, Sized, Iterable, Iterator
 from typing import Self, TypedDict, Any, ClassVar, Optional
 from uuid import UUID
 
 from board_description import FieldType
+from rng import Rng
 
 
 class ClientMessage(TypedDict):
@@ -15,6 +16,22 @@ class ClientMessage(TypedDict):
 class IServer(ABC):
     server_uuid: UUID
 
+    @abstractmethod
+    def send_frames(self, player_uuid: UUID, frames: list[bytes]) -> None:
+        ...
+
+    @abstractmethod
+    def broadcast_frames(self, frames: list[bytes]) -> None:
+        ...
+
+    @abstractmethod
+    def call_later(self, delay: float, function: Callable[[], Any]) -> None:
+        ...
+
+    @abstractmethod
+    def message_parsed(self) -> None:
+        ...
+
 
 class IMessenger(ABC):
     server: IServer
@@ -28,6 +45,10 @@ class IMessenger(ABC):
     def send(self, player_uuid: UUID, message: Any | None = None) -> None:
         ...
 
+    @abstractmethod
+    def send_initial_state(self, player_uuid: UUID, tail: list[dict]) -> None:
+        ...
+
     @abstractmethod
     def broadcast(self) -> None:
         ...
@@ -45,6 +66,44 @@ class IDataUnit(ABC):
     ...
 
 
+class IEventLog(ABC):
+    """
+    Receives everything that is needed to rebuild a game after a crash.
+    """
+
+    @abstractmethod
+    def update(self, section: str, item: Any, attribute: str | None, value: Any) -> None:
+        ...
+
+    @abstractmethod
+    def add_player(self, player_uuid: UUID, player_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def remove_player(self, player_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def roll(self, roll: tuple[int, ...], register: bool) -> None:
+        ...
+
+    @abstractmethod
+    def deck(self, deck_type: str, card_ids: list[int]) -> None:
+        ...
+
+    @abstractmethod
+    def draw(self, deck_type: str, card_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def checkpoint(self, state: tuple) -> None:
+        ...
+
+    @abstractmethod
+    def seed(self, seed: int, key: tuple) -> None:
+        ...
+
+
 class IPlayer(ABC):
     uuid: UUID
     player_id: int
@@ -69,16 +128,33 @@ class IPlayers(IDataUnit, Sized, Iterable):
     def add(self, player_uuid: UUID, player_id: int) -> IPlayer:
         ...
 
+    @abstractmethod
+    def remove(self, player_id: int) -> IPlayer:
+        ...
+
     @abstractmethod
     def is_all_ready(self) -> bool:
         ...
 
+    @abstractmethod
+    def get_state(self) -> tuple:
+        ...
+
+    @abstractmethod
+    def set_state(self, state: tuple) -> None:
+        ...
+
+    @abstractmethod
+    def fork(self) -> Self:
+        ...
+
 
 class IField(ABC):
+    __slots__ = ()
     name: str
     id: int
     type: FieldType
-    owner: Optional[UUID]
+    owner: Optional[int]
     price: int
     rent: int
     tax: int
@@ -94,17 +170,30 @@ class IFields(IDataUnit):
         ...
 
     @abstractmethod
-    def count_houses(self, player_uuid: UUID) -> int:
+    def count_houses(self, player_id: int) -> tuple[int, int]:
         ...
 
     @abstractmethod
     def advance_field_id(self, original_field: int, steps: int) -> int:
         ...
 
+    @abstractmethod
+    def get_state(self) -> tuple[bytes, bytes, bytes]:
+        ...
+
+    @abstractmethod
+    def set_state(self, state: tuple[bytes, bytes, bytes]) -> None:
+        ...
+
+    @abstractmethod
+    def fork(self) -> Self:
+        ...
+
 class IData(ABC):
     players: IPlayers
     fields: IFields
     player_order_cycler: Iterator
+    log: IEventLog | None
 
     @property
     @abstractmethod
@@ -124,10 +213,30 @@ class IData(ABC):
     def add_player(self, player_uuid: UUID, player_id: int) -> IPlayer:
         ...
 
+    @abstractmethod
+    def remove_player(self, player_id: int) -> IPlayer:
+        ...
+
     @abstractmethod
     def get_all_for_player(self, player_uuid: UUID) -> list[dict]:
         ...
 
+    @abstractmethod
+    def get_player_records(self, player_uuid: UUID) -> list[dict]:
+        ...
+
+    @abstractmethod
+    def get_static_records(self) -> list[dict]:
+        ...
+
+    @abstractmethod
+    def get_static_key(self) -> Hashable:
+        ...
+
+    @abstractmethod
+    def get_dynamic_records(self) -> list[dict]:
+        ...
+
     @abstractmethod
     def get_changes(self) -> Iterator[dict]:
         ...
@@ -136,10 +245,43 @@ class IData(ABC):
     def is_changes_pending(self) -> bool:
         ...
 
+    @property
+    @abstractmethod
+    def last_change_seq(self) -> int:
+        ...
+
     @abstractmethod
     def get_value(self, section: str, item: str | UUID, attribute: str | None = None) -> Any:
         ...
 
+    @abstractmethod
+    def restore_player_order(self) -> None:
+        ...
+
+    @abstractmethod
+    def get_state(self) -> tuple:
+        ...
+
+    @abstractmethod
+    def set_state(self, state: tuple) -> None:
+        ...
+
+    @abstractmethod
+    def fork(self) -> Self:
+        ...
+
+    @abstractmethod
+    def checkpoint(self) -> tuple:
+        ...
+
+    @abstractmethod
+    def rollback(self, checkpoint: tuple) -> None:
+        ...
+
+    @abstractmethod
+    def drop_checkpoints(self) -> None:
+        ...
+
     @abstractmethod
     def set_initial_values(self) -> None:
         ...
@@ -149,7 +291,11 @@ class IData(ABC):
         ...
 
     @abstractmethod
-    def is_player_on_turn(self, player_uuid: UUID) -> bool:
+    def replay(self, updates: Iterable[tuple[str, int | str, str | None, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    def is_player_on_turn(self, player: UUID | int) -> bool:
         ...
 
 
@@ -168,6 +314,8 @@ class IRoll(ABC):
 
 class IDice(ABC):
     last_roll: IRoll | None
+    doubles: int
+    log: IEventLog | None
 
     @property
     @abstractmethod
@@ -182,6 +330,10 @@ class IDice(ABC):
     def reset(self) -> None:
         ...
 
+    @abstractmethod
+    def fork(self) -> Self:
+        ...
+
 
 class ICard(ABC):
     id: int
@@ -195,11 +347,33 @@ class ICard(ABC):
         ...
 
 class ICardDeck(ABC):
+    deck_type: str
+    log: IEventLog | None
 
     @abstractmethod
     def draw(self) -> ICard:
         ...
 
+    @abstractmethod
+    def get_order(self) -> list[int]:
+        ...
+
+    @abstractmethod
+    def restore(self, card_ids: tuple[int, ...], draws: int) -> None:
+        ...
+
+    @abstractmethod
+    def get_state(self) -> tuple:
+        ...
+
+    @abstractmethod
+    def set_state(self, state: tuple) -> None:
+        ...
+
+    @abstractmethod
+    def fork(self) -> Self:
+        ...
+
 
 class IController(ABC):
     dice: IDice
@@ -209,6 +383,7 @@ class IController(ABC):
     cc: ICardDeck
     chance: ICardDeck
     on_turn_player: IPlayer
+    log: IEventLog | None
 
     @abstractmethod
     def __init__(self, game_data: IData) -> None:
@@ -223,21 +398,49 @@ class IController(ABC):
         ...
 
     @abstractmethod
-    def pay(self, rent: int, payer_uuid: UUID, payee_uuid: UUID | None = None) -> None:
+    def pay(self, rent: int, payer_id: int, payee_id: int | None = None) -> None:
         ...
 
     @abstractmethod
-    def collect(self, payment: int, player_uuid: UUID) -> None:
+    def collect(self, payment: int, player_id: int) -> None:
         ...
 
     @abstractmethod
-    def move_to(self, field_id: int, player_uuid: UUID | None = None, check_pass_go: bool = False) -> None:
+    def move_to(self, field_id: int, player_id: int | None = None, check_pass_go: bool = False) -> None:
         ...
 
     @abstractmethod
-    def move_by(self, fields: int, player_uuid: UUID | None = None, check_pass_go: bool = True) -> None:
+    def move_by(self, fields: int, player_id: int | None = None, check_pass_go: bool = True) -> None:
         ...
 
     @abstractmethod
     def buy_property(self, field: IField, player: IPlayer, price: int = -1) -> None:
         ...
+
+    @abstractmethod
+    def attach_log(self, log: IEventLog, new: bool) -> None:
+        ...
+
+    @abstractmethod
+    def get_state(self) -> tuple:
+        ...
+
+    @abstractmethod
+    def set_state(self, state: tuple) -> None:
+        ...
+
+    @abstractmethod
+    def set_rng(self, rng: Rng) -> None:
+        ...
+
+    @abstractmethod
+    def fork(self, messenger: IMessenger) -> Self:
+        ...
+
+    @abstractmethod
+    def checkpoint(self) -> tuple:
+        ...
+
+    @abstractmethod
+    def rollback(self, checkpoint: tuple) -> None:
+        ...
@@ -1,19 +1,56 @@
-from twisted.internet import reactor
+import argparse
+import logging
 
 import config
-import messenger
-from game_data import GameData
-from game_controller import GameController
-from server import ServerFactory
 
 
 def start_server():
-    message = messenger.Messenger()
-    gcontroller = GameController(GameData(), message)
-    factory = ServerFactory(message)
-    reactor.listenTCP(config.listen_port, factory)
+    from twisted.internet import reactor
+    from twisted.internet.task import LoopingCall
+    from bots import BotPool
+    from registry import GameRegistry
+    from server import ServerFactory
+    from stages import StageStats
+    from turn import STAGE_MACHINE
+
+    if config.stage_stats:
+        STAGE_MACHINE.stats = StageStats()
+        LoopingCall(STAGE_MACHINE.log_stats).start(config.worker_stats_interval, now=False)
+    bots = BotPool(config.bot_workers, reactor.callFromThread) if config.bot_workers > 0 else None
+    registry = GameRegistry(scheduler=reactor.callLater, log_dir=config.wal_dir, bots=bots)
+    if bots is not None:
+        reactor.addSystemEventTrigger("before", "shutdown", bots.close)
+    if registry.log_dir is not None:
+        registry.recover()
+        LoopingCall(registry.sync_logs).start(config.wal_fsync_interval, now=False)
+        reactor.addSystemEventTrigger("before", "shutdown", registry.sync_logs)
+    reactor.listenTCP(config.listen_port, ServerFactory(registry))
     reactor.run()
 
 
+def start_supervisor(workers: int):
+    # The reactor must not be imported before the workers are forked.
+    from supervisor import Supervisor
+
+    Supervisor(workers).run()
+
+
 if __name__ == '__main__':
-    start_server()
+    parser = argparse.ArgumentParser(description="Monopoly server")
+    parser.add_argument("--workers", type=int, default=config.workers,
+                        help="number of worker processes, each game is pinned to one of them")
+    parser.add_argument("--wal-dir", default=config.wal_dir,
+                        help="directory of the write-ahead logs, the games in it are recovered on start")
+    parser.add_argument("--bot-workers", type=int, default=config.bot_workers,
+                        help="processes searching the decisions of the bots, 0 disables the bots")
+    parser.add_argument("--stage-stats", action="store_true", default=config.stage_stats,
+                        help="count and time the stages of the turns and log them periodically")
+    args = parser.parse_args()
+    config.wal_dir = args.wal_dir
+    config.bot_workers = args.bot_workers
+    config.stage_stats = args.stage_stats
+    logging.basicConfig(level=logging.INFO)
+    if args.workers > 1:
+        start_supervisor(args.workers)
+    else:
+        start_server()
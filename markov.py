@@ -0,0 +1,259 @@
+"""
+Exact landing probabilities of the board from the stationary distribution of the Markov chain of a token. The state
+of the token is its field, the number of doubles rolled in the turn so far and the number of turns spent in jail. The
+chain follows the same rules as the Monte Carlo in montecarlo.py, but a card is drawn from the full deck with equal
+probability, which is what a shuffled deck converges to over many rounds.
+
+The distribution is solved once per process for each board and rules, so `landing_probability` is a lookup::
+
+    markov.landing_probability(24)  # expected landings on Trafalgar Square in one turn
+"""
+import hashlib
+import sys
+from typing import Literal
+
+from board import COMPILED_FIELDS, BoardData
+from board_description import FIELDS, FieldType
+from chance_cc_cards import CardCommands, CardDeck
+
+JailPolicy = Literal["roll", "pay"]
+""" "roll" stays in jail until a double is rolled or the fine has to be paid, "pay" pays the fine at once. """
+MAX_JAIL_TURNS = 3
+""" The number of failed rolls after which the fine has to be paid. """
+DOUBLES_TO_JAIL = 3
+""" The number of doubles in a row that send the token to jail. """
+
+# Movement effects of the cards
+NONE, TO_FIELD, NEAREST_STATION, NEAREST_UTILITY, BACK, TO_JAIL = range(6)
+
+_TARGETS = {
+    CardCommands.advance_to_go: BoardData.GO,
+    CardCommands.advance_to_field_5: 5,
+    CardCommands.advance_to_field_11: 11,
+    CardCommands.advance_to_field_24: 24,
+    CardCommands.advance_to_field_39: 39,
+}
+""" The fields the cards with the fixed destination move to. """
+
+_ROLLS: tuple[tuple[int, bool, float], ...] = tuple(
+    (first + second, first == second, 1 / 36) for first in range(1, 7) for second in range(1, 7)
+)
+""" The sum, the double and the probability of every roll of two dice. """
+
+_CACHE: dict[str, tuple[float, ...]] = {}
+""" The landing probabilities by the hash of the board and the rules, see rules_hash. """
+_HASHES: dict[str, str] = {}
+""" The hashes by the jail policy. The board and the cards do not change while the server runs. """
+
+
+def card_moves(deck_type: Literal["cc", "chance"]) -> list[tuple[int, int]]:
+    """
+    Translates the cards of a deck to their movement effects.
+    :param deck_type: CardDeck.CC or CardDeck.CHANCE.
+    :type deck_type: Literal["cc", "chance"]
+    :return: The effect and the argument (the destination or the number of fields back) of every card.
+    :rtype: list[tuple[int, int]]
+    :raises ValueError: If the deck contains a movement card whose movement is not known.
+    """
+    moves = []
+    for card in CardDeck.get_cards(deck_type):
+        command = card.command
+        if command in _TARGETS:
+            moves.append((TO_FIELD, _TARGETS[command]))
+        elif command is CardCommands.advance_to_nearest_station:
+            moves.append((NEAREST_STATION, 0))
+        elif command is CardCommands.advance_to_nearest_utility:
+            moves.append((NEAREST_UTILITY, 0))
+        elif command is CardCommands.go_back_3_spaces:
+            moves.append((BACK, 3))
+        elif command is CardCommands.go_to_jail:
+            moves.append((TO_JAIL, 0))
+        elif card.type in ("move", "go_to_jail"):
+            raise ValueError(f"The movement of the card {card.id} is not known.")
+        else:
+            moves.append((NONE, 0))
+    return moves
+
+
+def move(field_id: int, effect: int, argument: int) -> int:
+    """
+    Returns the field a card moves the token to.
+    :param field_id: The field of the token.
+    :type field_id: int
+    :param effect: The effect of the card, see card_moves.
+    :type effect: int
+    :param argument: The argument of the effect.
+    :type argument: int
+    :return: The new field of the token, BoardData.JAIL if it goes to jail.
+    :rtype: int
+    """
+    lenght = BoardData.LENGHT
+    if effect == TO_FIELD:
+        return argument
+    if effect == NEAREST_STATION:
+        return (field_id + (5 - field_id) % 10) % lenght
+    if effect == NEAREST_UTILITY:
+        return 28 if 12 < field_id <= 28 else 12
+    if effect == BACK:
+        return (field_id - argument) % lenght
+    if effect == TO_JAIL:
+        return BoardData.JAIL
+    return field_id
+
+
+def rules_hash(jail_policy: JailPolicy = "roll") -> str:
+    """
+    Returns the hash of everything the landing probabilities depend on: the board, the cards and the rules.
+    :param jail_policy: How the token leaves jail.
+    :type jail_policy: JailPolicy
+    :rtype: str
+    """
+    digest = _HASHES.get(jail_policy)
+    if digest is None:
+        key = (FIELDS, card_moves(CardDeck.CC), card_moves(CardDeck.CHANCE), jail_policy, MAX_JAIL_TURNS, DOUBLES_TO_JAIL)
+        digest = _HASHES[jail_policy] = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+    return digest
+
+
+def _landings(field_id: int, decks: list[tuple[FieldType, list[tuple[int, int]]]]) -> dict[int, float]:
+    """
+    Returns where the token ends when it lands on the field, after the cards and the go to jail field.
+    """
+    spec_type = COMPILED_FIELDS[field_id].type
+    if spec_type & FieldType.GO_TO_JAIL:
+        return {BoardData.JAIL: 1.0}
+    for deck_type, moves in decks:
+        if spec_type & deck_type:
+            landings: dict[int, float] = {}
+            for effect, argument in moves:
+                new_field = move(field_id, effect, argument)
+                if new_field == field_id or new_field == BoardData.JAIL:
+                    landings[new_field] = landings.get(new_field, 0.0) + 1 / len(moves)
+                    continue
+                for end, probability in _landings(new_field, decks).items():
+                    landings[end] = landings.get(end, 0.0) + probability / len(moves)
+            return landings
+    return {field_id: 1.0}
+
+
+def transition_matrix(jail_policy: JailPolicy = "roll") -> tuple[list[tuple[int, int, int]], list[dict[int, float]]]:
+    """
+    Builds the transition matrix of a token. A transition is one landing: a roll with the cards it draws, a failed roll
+    in jail or going to jail.
+    :param jail_policy: How the token leaves jail.
+    :type jail_policy: JailPolicy
+    :return: The states as (field, doubles, jail turns) and the sparse rows of the matrix as {state index: probability}.
+    The field of the states in jail is BoardData.JAIL and their doubles are 0.
+    :rtype: tuple[list[tuple[int, int, int]], list[dict[int, float]]]
+    """
+    if jail_policy not in ("roll", "pay"):
+        raise ValueError(f"Unknown jail policy {jail_policy}.")
+    jail = BoardData.JAIL
+    states = [(field_id, doubles, 0) for field_id in range(BoardData.LENGHT) for doubles in range(DOUBLES_TO_JAIL)]
+    states += [(jail, 0, jail_turns) for jail_turns in range(MAX_JAIL_TURNS + 1)]
+    index = {state: i for i, state in enumerate(states)}
+    decks = [(FieldType.CC, card_moves(CardDeck.CC)), (FieldType.CHANCE, card_moves(CardDeck.CHANCE))]
+    landings = [_landings(field_id, decks) for field_id in range(BoardData.LENGHT)]
+
+    def roll_from(field_id: int, doubles: int) -> dict[int, float]:
+        row: dict[int, float] = {}
+        for steps, double, probability in _ROLLS:
+            if double and doubles + 1 == DOUBLES_TO_JAIL:
+                ends = {jail: 1.0}
+            else:
+                ends = landings[(field_id + steps) % BoardData.LENGHT]
+            for end, end_probability in ends.items():
+                state = (jail, 0, 0) if end == jail else (end, doubles + 1 if double else 0, 0)
+                row[index[state]] = row.get(index[state], 0.0) + probability * end_probability
+        return row
+
+    # a new turn starts in the states without a double, the others roll again
+    rows = [roll_from(field_id, doubles) for field_id, doubles, _ in states[:-MAX_JAIL_TURNS - 1]]
+    leave = roll_from(BoardData.JUST_VISITING, 0)
+    for _, _, jail_turns in states[-MAX_JAIL_TURNS - 1:]:
+        if jail_policy == "pay" or jail_turns == MAX_JAIL_TURNS:
+            rows.append(leave)
+            continue
+        # a double leaves the jail and the token rolls again from just visiting, otherwise it stays
+        row = {state: probability / 6 for state, probability in leave.items()}
+        stay = index[(jail, 0, jail_turns + 1)]
+        row[stay] = row.get(stay, 0.0) + 5 / 6
+        rows.append(row)
+    return states, rows
+
+
+def stationary(rows: list[dict[int, float]]) -> list[float]:
+    """
+    Solves the stationary distribution of the chain by Gaussian elimination.
+    :param rows: The sparse rows of the transition matrix.
+    :type rows: list[dict[int, float]]
+    :return: The probability of every state.
+    :rtype: list[float]
+    """
+    size = len(rows)
+    # pi (P - I) = 0 and sum(pi) = 1 as the system (P - I)^T pi = e, whose last equation is replaced by the sum
+    matrix = [[0.0] * size + [0.0] for _ in range(size)]
+    for i, row in enumerate(rows):
+        for j, probability in row.items():
+            matrix[j][i] += probability
+        matrix[i][i] -= 1.0
+    matrix[-1] = [1.0] * size + [1.0]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda r: abs(matrix[r][column]))
+        matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+        pivot_row = matrix[column]
+        scale = pivot_row[column]
+        for c in range(column, size + 1):
+            pivot_row[c] /= scale
+        for r in range(size):
+            factor = matrix[r][column]
+            if r != column and factor:
+                target = matrix[r]
+                for c in range(column, size + 1):
+                    target[c] -= factor * pivot_row[c]
+    return [matrix[i][size] for i in range(size)]
+
+
+def landing_probabilities(jail_policy: JailPolicy = "roll") -> tuple[float, ...]:
+    """
+    Returns the expected number of landings on each field in one turn, including the jail, whose entry counts the
+    turns that end in jail. The result is cached, see rules_hash.
+    :param jail_policy: How the token leaves jail.
+    :type jail_policy: JailPolicy
+    :return: The expected landings per turn by the field id.
+    :rtype: tuple[float, ...]
+    """
+    key = rules_hash(jail_policy)
+    probabilities = _CACHE.get(key)
+    if probabilities is None:
+        states, rows = transition_matrix(jail_policy)
+        distribution = stationary(rows)
+        # a turn ends in every state without a pending double
+        turns = sum(p for (_, doubles, _), p in zip(states, distribution) if not doubles)
+        landings = [0.0] * len(COMPILED_FIELDS)
+        for (field_id, _, _), p in zip(states, distribution):
+            landings[field_id] += p / turns
+        probabilities = _CACHE[key] = tuple(landings)
+    return probabilities
+
+
+def landing_probability(field_id: int, jail_policy: JailPolicy = "roll") -> float:
+    """
+    Returns the expected number of landings on the field in one turn, see landing_probabilities.
+    :param field_id: The id of the field, BoardData.JAIL for the jail.
+    :type field_id: int
+    :param jail_policy: How the token leaves jail.
+    :type jail_policy: JailPolicy
+    :rtype: float
+    """
+    return landing_probabilities(jail_policy)[field_id]
+
+
+def main(argv: list[str]) -> None:
+    jail_policy = argv[0] if argv else "roll"
+    for spec, probability in zip(COMPILED_FIELDS, landing_probabilities(jail_policy)):
+        print(f"{spec.name:<28} {probability * 100:7.3f}%")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,12 +1,24 @@
 import logging
-import pickle
-from typing import Self, TYPE_CHECKING, Any
+from collections.abc import Hashable
+from typing import Self, TYPE_CHECKING, Any, TypedDict
 from uuid import UUID
 
+import config
 from interfaces import ClientMessage, IController, IServer, IMessenger
 
 if TYPE_CHECKING:
-    from server import ServerFactory
+    from registry import GameSession
+
+
+class OutboxStats(TypedDict):
+    flushes: int
+    writes: int
+    frames: int
+
+
+_static_chunks: dict[tuple[type, Hashable], tuple[bytes, int]] = {}
+""" The static records of the initial state encoded by dumps_items, by the encoder and the static key of the game data.
+Built once per process. """
 
 
 class Messenger(IMessenger):
@@ -17,16 +29,23 @@ class Messenger(IMessenger):
     def __init__(self):
         self.controller: IController | None = None
         """ The controller. """
-        self.server: ServerFactory | None = None
+        self.server: GameSession | None = None
         """ The server. Due to cross-referencing is initially None. Has to be set by the set_server() method. """
         self._messages = []
         self._private_messages = {}
+        self._outbox: dict[UUID, list[bytes]] = {}
+        """ Encoded frames waiting for the next flush, by player. """
+        self._flush_scheduled: bool = False
+        self.stats: OutboxStats = {"flushes": 0, "writes": 0, "frames": 0}
+        """ Counters of the flushes, the writes to the transports and the frames written. """
+        self._dynamic_chunk: tuple[int, bytes, int] | None = None
+        """ The encoded dynamic records of the initial state as (last_change_seq, chunk, number of records). """
 
     def set_server(self, server: IServer) -> None:
         """
         Sets the server. Sets also the server_uuid in the controller.
         :param server: The server.
-        :type server: ServerFactory
+        :type server: GameSession
         """
         self.server = server
         self.controller.server_uuid = self.server.server_uuid
@@ -41,6 +60,7 @@ class Messenger(IMessenger):
         """
         if message:
             self.controller.parse(message)
+            self.server.message_parsed()
 
     def add(self, to: str | UUID = "all", **kwargs: Any) -> Self:
         """
@@ -83,27 +103,95 @@ class Messenger(IMessenger):
         :param player_uuid: The UUID of the player.
         :type player_uuid: UUID
         :param message: The data to be sent.
-        :type message: bytes | None
+        :type message: Any | None
         """
         if message is None:
             message = self.get(player_uuid)
         if message:
-            logging.debug(f"Sending to {player_uuid}: {message}")
-            self.server.send(player_uuid, message)
+            logging.debug("Sending to %s: %s", player_uuid, message)
+            self._queue(player_uuid, [config.encoder.encode(message)])
+            self._schedule_flush()
+
+    def send_initial_state(self, player_uuid: UUID, tail: list[dict]) -> None:
+        """
+        Sends all data of the game to a newly connected player in one frame: the queued messages of the player, the
+        data from GameData.get_all_for_player and the given tail. The static part of the data is encoded once per
+        process, the dynamic part is encoded again only when the game data have changed since it was last encoded.
+        :param player_uuid: The UUID of the player.
+        :type player_uuid: UUID
+        :param tail: Records to be sent after the data of the game.
+        :type tail: list[dict]
+        """
+        game_data = self.controller.gd
+        encoder = config.encoder
+        head = self.get(player_uuid) + game_data.get_player_records(player_uuid)
+        static_key = (encoder, game_data.get_static_key())
+        if static_key not in _static_chunks:
+            records = game_data.get_static_records()
+            _static_chunks[static_key] = (encoder.dumps_items(records), len(records))
+        static, static_count = _static_chunks[static_key]
+        if self._dynamic_chunk is None or self._dynamic_chunk[0] != game_data.last_change_seq:
+            records = game_data.get_dynamic_records()
+            self._dynamic_chunk = (game_data.last_change_seq, encoder.dumps_items(records), len(records))
+        _, dynamic, dynamic_count = self._dynamic_chunk
+        frame = encoder.encode_items(
+            [encoder.dumps_items(head), static, dynamic, encoder.dumps_items(tail)],
+            len(head) + static_count + dynamic_count + len(tail))
+        logging.debug("Sending the initial state to %s.", player_uuid)
+        self._queue(player_uuid, [frame])
+        self._schedule_flush()
 
     def broadcast(self, data: bytes | None = None) -> None:
         """
         Sends the given data to all players. If no data is given, the current message queue is sent. The queue is
-        emptied.
-        :param data: The data to be sent.
+        emptied. The shared part of the queue is encoded only once and the same frame is written to every player,
+        private messages follow in a separate frame.
+        :param data: An already encoded frame to be sent.
         :type data: bytes | None
         """
         if data is None:
+            shared = [config.encoder.encode(self._messages)] if self._messages else []
             for player_uuid in self.server.connected_clients:
-                data = self.get(player_uuid)
-                if data:
-                    self.send(player_uuid, data)
+                private = self._private_messages.pop(player_uuid, None)
+                frames = shared + [config.encoder.encode(private)] if private else shared
+                if frames:
+                    self._queue(player_uuid, frames)
             self._messages.clear()
         else:
-            logging.debug(f"Broadcasting: {pickle.loads(data)}")
-            self.server.broadcast(data)
+            for player_uuid in self.server.connected_clients:
+                self._queue(player_uuid, [data])
+        self._schedule_flush()
+
+    def flush(self) -> None:
+        """
+        Writes all queued frames. Every player gets all their frames in one write. The flush is scheduled by the
+        server to run once per reactor iteration.
+        """
+        self._flush_scheduled = False
+        if not self._outbox:
+            return
+        outbox, self._outbox = self._outbox, {}
+        connected_clients = self.server.connected_clients
+        writes = frames_written = 0
+        for player_uuid, frames in outbox.items():
+            if player_uuid in connected_clients:
+                self.server.send_frames(player_uuid, frames)
+                writes += 1
+                frames_written += len(frames)
+        self.stats["flushes"] += 1
+        self.stats["writes"] += writes
+        self.stats["frames"] += frames_written
+
+    def _queue(self, player_uuid: UUID, frames: list[bytes]) -> None:
+        """
+        Queues the encoded frames for the given player.
+        """
+        if player_uuid in self._outbox:
+            self._outbox[player_uuid].extend(frames)
+        else:
+            self._outbox[player_uuid] = list(frames)
+
+    def _schedule_flush(self) -> None:
+        if self._outbox and not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.server.call_later(0, self.flush)
@@ -0,0 +1,267 @@
+"""
+Monte Carlo estimate of how often the tokens land on the fields of the board and of the expected rent per turn. Large
+arrays of independent tokens are moved at once with NumPy, following the rules of Turn: doubles, three doubles in a row,
+jail, the go to jail field and the movement cards of the card decks. Run `python montecarlo.py --turns 100000000` for
+the table of all fields, see `python montecarlo.py --help`.
+
+The rent is independent of the other players, so every token plays alone. A token spends `turns_per_token` turns on the
+board after `burn_in` turns that are not counted. The tokens are split into groups and the confidence intervals are
+computed from the spread of the estimates of the groups.
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import sys
+import time
+from typing import Literal, TypedDict
+
+import numpy as np
+
+import config
+from board import COMPILED_FIELDS, RENTS, BoardData
+from board_description import FieldType
+from chance_cc_cards import CardDeck
+from markov import BACK, NEAREST_STATION, NEAREST_UTILITY, TO_FIELD, TO_JAIL, card_moves
+from rng import Rng
+
+FIELDS = len(COMPILED_FIELDS)
+""" The number of fields including the jail. """
+GROUPS = 64
+""" The number of groups of tokens whose estimates give the confidence intervals. """
+Z_95 = 1.959964
+""" The quantile of the normal distribution for the 95% confidence intervals. """
+
+
+class LandingReport(TypedDict):
+    turns: int
+    tokens: int
+    seconds: float
+    turns_per_s: float
+    probability: list[float]
+    probability_ci95: list[float]
+    expected_rent: list[tuple[float, ...] | None]
+    expected_rent_ci95: list[tuple[float, ...] | None]
+
+
+def card_effects(deck_type: Literal["cc", "chance"]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the movement effects of the cards of a deck as arrays, see markov.card_moves.
+    :param deck_type: CardDeck.CC or CardDeck.CHANCE.
+    :type deck_type: Literal["cc", "chance"]
+    :return: The effect and the argument (the destination or the number of fields back) of every card.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    :raises ValueError: If the deck contains a movement card whose movement is not known.
+    """
+    effects, arguments = zip(*card_moves(deck_type))
+    return np.array(effects, dtype=np.int8), np.array(arguments, dtype=np.int16)
+
+
+def _field_mask(field_type: FieldType) -> np.ndarray:
+    return np.array([bool(spec.type & field_type) for spec in COMPILED_FIELDS])
+
+
+class _Deck:
+    """
+    One deck of cards for each token, every token draws from its own shuffled deck.
+    """
+
+    def __init__(self, deck_type: Literal["cc", "chance"], tokens: int, generator: np.random.Generator):
+        effects, arguments = card_effects(deck_type)
+        order = np.argsort(generator.random((tokens, len(effects)), dtype=np.float32), axis=1)
+        self.effects: np.ndarray = effects[order]
+        self.arguments: np.ndarray = arguments[order]
+        self.next: np.ndarray = np.zeros(tokens, dtype=np.int16)
+
+    def draw(self, tokens: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        position = self.next[tokens]
+        self.next[tokens] = (position + 1) % self.effects.shape[1]
+        return self.effects[tokens, position], self.arguments[tokens, position]
+
+
+def _simulate_block(task: tuple[int, int, int, int, int, int, str]) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Moves one block of tokens.
+    :return: The landings, the rent units and the fixed rents by group and field, and the number of counted turns.
+    """
+    seed, block, first_token, tokens, turns, burn_in, jail_policy = task
+    generator = np.random.default_rng(Rng(seed).spawn("montecarlo", block).generator().getrandbits(128))
+    lenght, jail, just_visiting = BoardData.LENGHT, BoardData.JAIL, BoardData.JUST_VISITING
+    is_cc, is_chance = _field_mask(FieldType.CC), _field_mask(FieldType.CHANCE)
+    is_card, is_go_to_jail = is_cc | is_chance, _field_mask(FieldType.GO_TO_JAIL)
+    is_utility = _field_mask(FieldType.UTILITY)
+    decks = ((_Deck(CardDeck.CC, tokens, generator), is_cc), (_Deck(CardDeck.CHANCE, tokens, generator), is_chance))
+    position = np.full(tokens, config.initial_field, dtype=np.int16)
+    in_jail = np.zeros(tokens, dtype=bool)
+    jail_turns = np.zeros(tokens, dtype=np.int8)
+    group_offset = ((first_token + np.arange(tokens)) % GROUPS) * FIELDS
+    landings = np.zeros(GROUPS * FIELDS)
+    units = np.zeros(GROUPS * FIELDS)
+    fixed = np.zeros(GROUPS * FIELDS)
+
+    def roll(count: int) -> tuple[np.ndarray, np.ndarray]:
+        dice = generator.integers(1, 7, size=(2, count), dtype=np.int16)
+        return dice[0] + dice[1], dice[0] == dice[1]
+
+    for turn in range(burn_in + turns):
+        counted = turn >= burn_in
+        rolling = ~in_jail
+        if in_jail.any():
+            jailed = np.flatnonzero(in_jail)
+            if jail_policy == "roll":
+                may_roll = jail_turns[jailed] < 3
+                _, double = roll(len(jailed))
+                leaving = ~may_roll | double
+                staying = jailed[~leaving]
+                jail_turns[staying] += 1
+                if counted:
+                    landings += np.bincount(group_offset[staying] + jail, minlength=len(landings))
+                jailed = jailed[leaving]
+            position[jailed] = just_visiting
+            in_jail[jailed] = False
+            jail_turns[jailed] = 0
+            rolling[jailed] = True
+        for doubles in range(3):
+            moving = np.flatnonzero(rolling)
+            if not len(moving):
+                break
+            steps, double = roll(len(moving))
+            if doubles == 2:  # the third double in a row sends the token to jail
+                to_jail = moving[double]
+                position[to_jail] = jail
+                in_jail[to_jail] = True
+                if counted:
+                    landings += np.bincount(group_offset[to_jail] + jail, minlength=len(landings))
+                moving, steps, double = moving[~double], steps[~double], double[~double]
+            field = (position[moving] + steps) % lenght
+            weight = np.where(is_utility[field], steps, 1).astype(np.float64)
+            rent = np.zeros(len(moving))
+            drawing = is_card[field]
+            while drawing.any():
+                before = field.copy()
+                for deck, is_deck in decks:
+                    drawn = np.flatnonzero(drawing & is_deck[before])
+                    if not len(drawn):
+                        continue
+                    effect, argument = deck.draw(moving[drawn])
+                    old = field[drawn]
+                    new = old.copy()
+                    new = np.where(effect == TO_FIELD, argument, new)
+                    new = np.where(effect == NEAREST_STATION, (old + (5 - old) % 10) % lenght, new)
+                    new = np.where(effect == NEAREST_UTILITY, np.where((12 < old) & (old <= 28), 28, 12), new)
+                    new = np.where(effect == BACK, (old - argument) % lenght, new)
+                    new = np.where(effect == TO_JAIL, jail, new)
+                    field[drawn] = new
+                    weight[drawn] = np.where(effect == NEAREST_STATION, 2.0, np.where(is_utility[new], weight[drawn], 1.0))
+                    utility = effect == NEAREST_UTILITY
+                    if utility.any():  # the rent is ten times a new roll
+                        weight[drawn[utility]] = 0.0
+                        rent[drawn[utility]] = 10 * roll(int(utility.sum()))[0]
+                drawing = drawing & (field != before) & is_card[field]  # e.g. back 3 fields to community chest
+            sent_to_jail = (field == jail) | is_go_to_jail[field]
+            field[sent_to_jail] = jail
+            position[moving] = field
+            in_jail[moving[sent_to_jail]] = True
+            if counted:
+                index = group_offset[moving] + field
+                landings += np.bincount(index, minlength=len(landings))
+                units += np.bincount(index, weights=weight, minlength=len(units))
+                fixed += np.bincount(index, weights=rent, minlength=len(fixed))
+            rolling = np.zeros(tokens, dtype=bool)
+            rolling[moving[double & ~sent_to_jail]] = True
+    shape = (GROUPS, FIELDS)
+    return landings.reshape(shape), units.reshape(shape), fixed.reshape(shape), tokens * turns
+
+
+
+def simulate(
+        turns: int = 10 ** 7, seed: int = 0, turns_per_token: int = 200, burn_in: int = 20,
+        jail_policy: Literal["roll", "pay"] = "roll", block: int = 1 << 16, workers: int | None = None
+) -> LandingReport:
+    """
+    Estimates the landing probabilities and the expected rents. The result does not depend on the number of workers.
+    :param turns: The number of simulated turns, without the burn-in.
+    :type turns: int
+    :param seed: The seed of the simulation.
+    :type seed: int
+    :param turns_per_token: The number of counted turns of every token.
+    :type turns_per_token: int
+    :param burn_in: The number of turns of every token that are not counted.
+    :type burn_in: int
+    :param jail_policy: "roll" to stay in jail until a double is rolled or the fine has to be paid, "pay" to pay the
+    fine at once.
+    :type jail_policy: Literal["roll", "pay"]
+    :param block: The number of tokens moved at once.
+    :type block: int
+    :param workers: The number of processes. All cores by default.
+    :type workers: int | None
+    :return: The probabilities of landing on each field in one turn and the expected rent per turn of an opponent for
+    each rent level (see RENTS), with the halfwidths of their 95% confidence intervals.
+    :rtype: LandingReport
+    """
+    if jail_policy not in ("roll", "pay"):
+        raise ValueError(f"Unknown jail policy {jail_policy}.")
+    tokens = max(math.ceil(turns / turns_per_token), GROUPS)
+    tasks = [
+        (seed, index, first, min(block, tokens - first), turns_per_token, burn_in, jail_policy)
+        for index, first in enumerate(range(0, tokens, block))
+    ]
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    start = time.perf_counter()
+    if workers <= 1 or len(tasks) == 1:
+        results = [_simulate_block(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+            results = pool.map(_simulate_block, tasks)
+    seconds = time.perf_counter() - start
+    landings = sum(result[0] for result in results)
+    units = sum(result[1] for result in results)
+    fixed = sum(result[2] for result in results)
+    counted = sum(result[3] for result in results)
+    group_turns = counted / GROUPS
+    probability = landings / group_turns
+
+    def estimate(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return values.mean(axis=0), Z_95 * values.std(axis=0, ddof=1) / math.sqrt(len(values))
+
+    mean, ci = estimate(probability)
+    rents, rents_ci = [], []
+    for field_id, table in enumerate(RENTS):
+        if table is None:
+            rents.append(None)
+            rents_ci.append(None)
+            continue
+        levels = [estimate((units[:, field_id] * rent + (fixed[:, field_id] if rent else 0)) / group_turns)
+                  for rent in table]
+        rents.append(tuple(float(level[0]) for level in levels))
+        rents_ci.append(tuple(float(level[1]) for level in levels))
+    return {
+        "turns": counted,
+        "tokens": tokens,
+        "seconds": seconds,
+        "turns_per_s": (tokens * (turns_per_token + burn_in)) / seconds if seconds else 0.0,
+        "probability": mean.tolist(),
+        "probability_ci95": ci.tolist(),
+        "expected_rent": rents,
+        "expected_rent_ci95": rents_ci,
+    }
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(description="Estimates the landing probabilities and the expected rents.")
+    parser.add_argument("--turns", type=int, default=10 ** 7, help="the number of simulated turns")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the simulation")
+    parser.add_argument("--jail", choices=("roll", "pay"), default="roll", help="how the tokens leave the jail")
+    parser.add_argument("--workers", type=int, default=None, help="the number of processes, all cores by default")
+    args = parser.parse_args(argv)
+    report = simulate(args.turns, args.seed, jail_policy=args.jail, workers=args.workers)
+    print(f"{report['turns']:,} turns in {report['seconds']:.1f} s ({report['turns_per_s']:,.0f} turns/s)")
+    print(f"{'field':<28} {'p per turn':>10} {'± 95%':>8}   expected rent per turn by level")
+    for spec, p, ci, rents in zip(
+            COMPILED_FIELDS, report["probability"], report["probability_ci95"], report["expected_rent"]):
+        rent = " ".join(f"{value:7.2f}" for value in rents) if rents else ""
+        print(f"{spec.name:<28} {p * 100:9.3f}% {ci * 100:7.3f}%   {rent}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -5,6 +5,13 @@ from interfaces import IPlayers, IPlayer
 
 
 class Player(IPlayer):
+    STATE: tuple[str, ...] = (
+        "uuid", "player_id", "name", "token", "cash", "field", "ready", "in_jail", "jail_turns", "get_out_of_jail_cards",
+        "orders", "buy_limit")
+    """ The attributes that make up the state of a player, see Players.get_state. """
+    PRIVATE: tuple[str, ...] = ("possible_actions", "orders", "buy_limit")
+    """ The attributes whose changes are sent only to the player, see GameData.get_changes. """
+
     def __init__(
             self, player_uuid: UUID,  player_id: int, name: str = None,
             token: str = "", cash: int = 0, field: int = -1, ready: bool = False):
@@ -18,6 +25,10 @@ class Player(IPlayer):
         self.in_jail: bool = False
         self.jail_turns: int = 0
         self.get_out_of_jail_cards: int = 0
+        self.orders: int = 0
+        """ The standing orders: the mask of actions.Action the server takes for the player, see Turn.set_orders. """
+        self.buy_limit: int = 0
+        """ The highest price the standing order to buy pays. """
 
     def __getitem__(self, item):
         return getattr(self, item)
@@ -36,47 +47,131 @@ class Player(IPlayer):
 
 
 class Players(IPlayers):
+    """
+    The players of a game. The game logic refers to the players by their player_id, a small integer handle; the UUIDs
+    are used only at the network edge. Both are indexed, so a lookup by either of them is constant time.
+    """
     def __init__(self):
-        self._players: dict[UUID, Player] = {}
+        self._players: dict[int, Player] = {}
+        """ The players by their player_id. """
+        self._by_uuid: dict[UUID, Player] = {}
+        """ The players by their UUID. """
 
     def __getitem__(self, item: UUID | int) -> Player:
-        if type(item) is UUID:
-            if item in self._players:
-                return self._players[item]
-            raise KeyError(f"Player with uuid {item} was not found.")
         if type(item) is int:
-            matching = filter(lambda player: player.player_id == item, self._players.values())
             try:
-                return next(matching)
-            except StopIteration:
-                raise KeyError(f"Player with id {item} was not found.")
+                return self._players[item]
+            except KeyError:
+                raise KeyError(f"Player with id {item} was not found.") from None
+        if type(item) is UUID:
+            try:
+                return self._by_uuid[item]
+            except KeyError:
+                raise KeyError(f"Player with uuid {item} was not found.") from None
         raise AttributeError(f"{item} has to be of type UUID or int.")
 
     def __len__(self):
         return len(self._players)
 
     def __iter__(self):
+        """
+        Iterates over the player_ids.
+        """
         return iter(self._players)
 
-    def update(self, item: UUID, attribute: str, value: Any) -> None:
-        if not hasattr(self._players[item], attribute):
+    def values(self):
+        return self._players.values()
+
+    def update(self, item: UUID | int, attribute: str, value: Any) -> None:
+        player = self[item]
+        if not hasattr(player, attribute):
             raise AttributeError(f"Player object has no attribute {attribute}.")
-        player = self._players[item]
         setattr(player, attribute, value)
 
     def add(self, player_uuid: UUID, player_id: int) -> Player:
+        """
+        Adds a new player.
+        :param player_uuid: The UUID of the player.
+        :type player_uuid: UUID
+        :param player_id: The player_id of the player.
+        :type player_id: int
+        :return: The new player.
+        :rtype: Player
+        :raises ValueError: If the player_id or the UUID belongs to another player, see remove.
+        """
+        if player_id in self._players or player_uuid in self._by_uuid:
+            raise ValueError(f"Player with id {player_id} or uuid {player_uuid} already exists.")
         new_player = Player(player_uuid, player_id)
-        self._players[new_player.uuid] = new_player
+        self._players[new_player.player_id] = new_player
+        self._by_uuid[new_player.uuid] = new_player
         return new_player
 
+    def remove(self, player_id: int) -> Player:
+        """
+        Removes the player from both indexes, so that the player_id can be given to another player.
+        :param player_id: The player_id of the player.
+        :type player_id: int
+        :return: The removed player.
+        :rtype: Player
+        """
+        try:
+            player = self._players.pop(player_id)
+        except KeyError:
+            raise KeyError(f"Player with id {player_id} was not found.") from None
+        del self._by_uuid[player.uuid]
+        return player
+
     def is_all_ready(self):
         return all(player.ready and player.token for player in self._players.values())
 
     def uuid_from_id(self, player_id: int) -> UUID:
-        for player in self._players.values():
-            if player.player_id == player_id:
-                return player.uuid
-        raise KeyError(f"Player with id {player_id} was not found.")
+        try:
+            return self._players[player_id].uuid
+        except KeyError:
+            raise KeyError(f"Player with id {player_id} was not found.") from None
 
     def id_from_uuid(self, uuid: UUID) -> int:
-        return self._players[uuid].player_id
\ No newline at end of file
+        return self._by_uuid[uuid].player_id
+
+    def handle(self, item: UUID | int) -> int:
+        """
+        Returns the player_id of the player given by either the UUID or the player_id.
+        :param item: The UUID or the player_id.
+        :type item: UUID | int
+        :return: The player_id.
+        :rtype: int
+        """
+        return item if type(item) is int else self._by_uuid[item].player_id
+
+    def get_state(self) -> tuple[tuple, ...]:
+        """
+        Returns the state of all players as plain values, see Player.STATE.
+        :return: A tuple of the values of Player.STATE for every player.
+        :rtype: tuple[tuple, ...]
+        """
+        return tuple(tuple(getattr(player, attribute) for attribute in Player.STATE) for player in self._players.values())
+
+    def fork(self) -> "Players":
+        """
+        Returns a copy of the players. A game has only a few players, so they are copied at once.
+        :return: The copy.
+        :rtype: Players
+        """
+        players = Players()
+        for player_id, player in self._players.items():
+            copied = players._players[player_id] = players._by_uuid[player.uuid] = object.__new__(Player)
+            copied.__dict__.update(player.__dict__)
+        return players
+
+    def set_state(self, state: tuple[tuple, ...]) -> None:
+        """
+        Replaces all players by the players of the given state.
+        :param state: The state as returned by get_state.
+        :type state: tuple[tuple, ...]
+        """
+        self._players.clear()
+        self._by_uuid.clear()
+        for values in state:
+            player = self.add(values[0], values[1])
+            for attribute, value in zip(Player.STATE[2:], values[2:]):
+                setattr(player, attribute, value)
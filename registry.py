@@ -0,0 +1,586 @@
+import itertools
+import logging
+import os
+import resource
+import time
+import uuid
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, TypedDict
+from uuid import UUID
+
+import config
+import snapshot
+from bots import BotClient, BotPool
+from event_log import EventLog, restore
+from game_controller import GameController
+from game_data import GameData
+from interfaces import IServer
+from messenger import Messenger
+from rng import Rng
+from timer_wheel import TimerWheel
+
+if TYPE_CHECKING:
+    from server import Server
+
+
+class RegistryStats(TypedDict):
+    games: int
+    players: int
+    games_created: int
+    rss_bytes: int
+    cpu_seconds: float
+    wall_seconds: float
+    games_per_gb: float
+    games_per_core: float
+    round_trips_saved: int
+    deadlines: int
+    deadlines_passed: int
+
+
+class GameSession(IServer):
+    """
+    One table hosted by the server. The session owns the game objects (data, controller and messenger) and the
+    connections of the players sitting at the table. The messenger of the game uses the session as its server.
+    """
+
+    def __init__(self, game_id: str, registry: "GameRegistry", rng: Rng | None = None):
+        self.game_id: str = game_id
+        """ The identifier used by clients to join this table. """
+        self.registry: GameRegistry = registry
+        """ The registry the session belongs to. """
+        self.server_uuid: UUID = uuid.uuid4()
+        """ The UUID the server uses when it sends messages to the game on its own behalf. """
+        self.messenger: Messenger = Messenger()
+        self.controller: GameController = GameController(GameData(), self.messenger, rng)
+        self.messenger.set_server(self)
+        self.connected_clients: dict[UUID, "Server"] = dict()
+        self.available_ids: set[int] = set(range(config.max_players))
+        self.log: EventLog | None = None
+        """ The write-ahead log of the game. None if the games are not logged. """
+        self._locked: bool = False
+        self._actions_seen: int = 0
+        """ The number of actions of the turn when the deadline was set last, see message_parsed. """
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.game_id!r}, players={len(self.connected_clients)})"
+
+    @property
+    def locked(self) -> bool:
+        """
+        True if the game has already started and no other players can join.
+        """
+        return self._locked
+
+    @locked.setter
+    def locked(self, value: bool) -> None:
+        self._locked = value
+        self.registry.update_open(self)
+
+    @property
+    def has_players(self) -> bool:
+        """
+        True if a player, not a bot, is connected to the table.
+        """
+        return any(not client.is_bot for client in self.connected_clients.values())
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Returns True if a new player can join the table.
+        :return: True if a new player can join the table.
+        :rtype: bool
+        """
+        return not self._locked and bool(self.available_ids)
+
+    def get_id(self) -> int:
+        """
+        Gets an available player ID.
+        :return: The player ID.
+        :rtype: int
+        """
+        player_id = min(self.available_ids)
+        self.available_ids.remove(player_id)
+        return player_id
+
+    def retrieve_id(self, player_id: int) -> None:
+        """
+        Retrieves a disconnected player ID.
+        :param player_id: The player ID.
+        :type player_id: int
+        """
+        self.available_ids.add(player_id)
+
+    def join(self, client: "Server") -> bool:
+        """
+        Seats the connected client at the table and lets the controller add the new player.
+        :param client: The connection of the player.
+        :type client: Server
+        :return: False if the table is full or the game has already started.
+        :rtype: bool
+        """
+        if not self.is_open:
+            return False
+        client.player_id = self.get_id()
+        client.player_uuid = uuid.uuid4()
+        client.session = self
+        self.connected_clients[client.player_uuid] = client
+        self.registry.update_open(self)
+        self.messenger.add(to=client.player_uuid, section="misc", item="game_id", value=self.game_id)
+        self.messenger.receive({
+            "my_uuid": self.server_uuid, "action": "add_player",
+            "parameters": {"player_uuid": client.player_uuid, "player_id": client.player_id}
+        })
+        if self.registry.bots is not None and not client.is_bot:
+            self.call_later(config.bot_fill_delay, self.fill_seats)
+        return True
+
+    def fill_seats(self) -> int:
+        """
+        Seats bots at the table until it has config.bot_min_players players, so that a player does not wait for
+        opponents forever. Nothing happens if the game has started or no player is connected.
+        :return: The number of seated bots.
+        :rtype: int
+        """
+        if self.registry.bots is None or self._locked or self.registry.games.get(self.game_id) is not self:
+            return 0
+        seated = 0
+        while self.has_players and self.is_open and len(self.connected_clients) < config.bot_min_players:
+            self.join(BotClient(self.registry.bots))
+            seated += 1
+        return seated
+
+    def rejoin(self, client: "Server", player_uuid: UUID) -> bool:
+        """
+        Seats the connected client in place of a player of the game whose connection is gone, e.g. after the game was
+        recovered from its log.
+        :param client: The connection of the player.
+        :type client: Server
+        :param player_uuid: The UUID the player got when they joined the game.
+        :type player_uuid: UUID
+        :return: False if there is no such player or the player is still connected.
+        :rtype: bool
+        """
+        seated = self.connected_clients.get(player_uuid)
+        if seated is not None and not seated.is_bot:
+            return False
+        try:
+            player_id = self.controller.gd.players.id_from_uuid(player_uuid)
+        except KeyError:
+            return False
+        if seated is not None:  # the bot that played for the player leaves
+            seated.retire()
+        client.player_id = player_id
+        client.player_uuid = player_uuid
+        client.session = self
+        self.connected_clients[player_uuid] = client
+        self.available_ids.discard(player_id)
+        self.registry.update_open(self)
+        self.messenger.add(to=player_uuid, section="misc", item="game_id", value=self.game_id)
+        self.controller.turn.send_initial_state(player_uuid)
+        deadlines = self.registry.deadlines
+        if not client.is_bot and deadlines is not None and self.game_id not in deadlines:  # see GameRegistry._install
+            self._actions_seen = self.controller.turn.actions_taken
+            self.set_deadline()
+        return True
+
+    def message_parsed(self) -> None:
+        """
+        Sets the deadline of the player on turn when the game has moved on, see GameRegistry.deadlines. A message that
+        took no action, e.g. one that was not possible, leaves the deadline as it was.
+        """
+        turn = self.controller.turn
+        if self.registry.deadlines is None or turn.actions_taken == self._actions_seen:
+            return
+        self._actions_seen = turn.actions_taken
+        self.set_deadline()
+
+    def set_deadline(self) -> None:
+        """
+        Arms the deadline of the stage the turn waits in, or cancels it if the stage has none, see
+        config.turn_default_actions and config.stage_timeouts.
+        """
+        if self.registry.deadlines is None:
+            return
+        stage = self.controller.turn.stage
+        timeout = config.stage_timeouts.get(stage, config.turn_timeout)
+        if stage in config.turn_default_actions and timeout > 0:
+            self.registry.deadlines.arm(self.game_id, timeout, self.deadline_passed)
+        else:
+            self.registry.deadlines.cancel(self.game_id)
+
+    def deadline_passed(self) -> None:
+        """
+        Takes the default action of the stage for the idle player on turn, see config.turn_default_actions. The
+        action is parsed like a message of the player, or of the server if only the server can take it, e.g. the
+        closing of an auction. Nothing happens while no player, not counting the bots, is connected, the deadline is set
+        again when one rejoins.
+        """
+        if self.registry.games.get(self.game_id) is not self or not self.has_players:
+            return
+        turn = self.controller.turn
+        player = self.controller.gd.on_turn_player
+        action = config.turn_default_actions.get(turn.stage)
+        if player is not None and action in turn.get_possible_actions(player.uuid):
+            sender = player.uuid
+            logging.info(
+                f"Player {player.name} missed the deadline in the game {self.game_id}, the server takes {action}.")
+        elif action in turn.get_possible_actions(self.server_uuid):
+            sender = self.server_uuid
+            logging.info(f"The deadline in the game {self.game_id} passed, the server takes {action}.")
+        else:
+            logging.warning(f"The deadline in the game {self.game_id} passed, but {action} is not possible.")
+            return
+        self.registry.deadlines_passed += 1
+        self.messenger.receive({"my_uuid": sender, "action": action, "parameters": {}})
+
+    def attach_log(self, log: EventLog) -> None:
+        """
+        Starts logging the game.
+        :param log: The write-ahead log of the game.
+        :type log: EventLog
+        """
+        self.log = log
+        self.controller.attach_log(log, log.is_new)
+
+    def snapshot(self) -> bytes:
+        """
+        Takes a snapshot of the game, e.g. to move it to another process, see GameRegistry.adopt.
+        :return: The snapshot.
+        :rtype: bytes
+        """
+        return snapshot.dumps(self.controller)
+
+    def leave(self, client: "Server") -> None:
+        """
+        Removes the disconnected client from the table. Before the game starts, the player is removed from the game and
+        their player_id is given to the next player who joins. In a running game, a bot takes the seat until the player
+        rejoins. The session is torn down when the last player, not counting the bots, leaves.
+        :param client: The connection of the player.
+        :type client: Server
+        """
+        # TODO broadcast new info to other players when one of them leaves
+        if self.connected_clients.get(client.player_uuid) is client:
+            del self.connected_clients[client.player_uuid]
+            if self._locked and self.registry.bots is not None and self.has_players:
+                self.rejoin(BotClient(self.registry.bots), client.player_uuid)
+            elif not self._locked:  # the seat goes to the next player who joins, so the player is removed first
+                self.messenger.receive({
+                    "my_uuid": self.server_uuid, "action": "remove_player",
+                    "parameters": {"player_id": client.player_id}
+                })
+                self.retrieve_id(client.player_id)
+        if not self.has_players:
+            for bot in self.connected_clients.values():
+                bot.retire()
+            self.registry.remove(self.game_id)
+        else:
+            self.registry.update_open(self)
+
+    def broadcast(self, message: Any) -> None:
+        """
+        Broadcasts the given data to all clients connected to the table. The data is encoded only once.
+        :param message: The data to be sent.
+        :type message: Any
+        """
+        self.broadcast_frames([config.encoder.encode(message)])
+
+    def send(self, player_uuid: UUID, data: Any) -> None:
+        """
+        Sends the given data to the given player.
+        :param player_uuid: The UUID of the player.
+        :type player_uuid: UUID
+        :param data: The data to be sent.
+        :type data: Any
+        """
+        self.send_frames(player_uuid, [config.encoder.encode(data)])
+
+    def broadcast_frames(self, frames: list[bytes]) -> None:
+        """
+        Writes the given encoded frames to all clients connected to the table.
+        :param frames: The encoded frames.
+        :type frames: list[bytes]
+        """
+        for client in self.connected_clients.values():
+            client.write_frames(frames)
+
+    def send_frames(self, player_uuid: UUID, frames: list[bytes]) -> None:
+        """
+        Writes the given encoded frames to the given player.
+        :param player_uuid: The UUID of the player.
+        :type player_uuid: UUID
+        :param frames: The encoded frames.
+        :type frames: list[bytes]
+        """
+        self.connected_clients[player_uuid].write_frames(frames)
+
+    def call_later(self, delay: float, function: Callable[[], Any]) -> None:
+        """
+        Runs the function after the given delay using the scheduler of the registry. Without a scheduler the function
+        is run immediately.
+        :param delay: The delay in seconds.
+        :type delay: float
+        :param function: The function to be run.
+        :type function: Callable[[], Any]
+        """
+        if self.registry.scheduler is None:
+            function()
+        else:
+            self.registry.scheduler(delay, function)
+
+
+class GameRegistry:
+    """
+    The registry keeps all the games hosted by one server process. Clients are routed to their game by the game_id
+    sent in the join handshake, or to any table with a free seat if they do not ask for a specific one.
+    """
+
+    def __init__(
+            self, scheduler: Callable[[float, Callable[[], Any]], Any] | None = None,
+            id_filter: Callable[[str], bool] | None = None, log_dir: str | None = None, seed: int | None = None,
+            bots: BotPool | None = None):
+        self.scheduler: Callable[[float, Callable[[], Any]], Any] | None = scheduler
+        """ Schedules delayed calls, e.g. reactor.callLater. Without it, delayed calls are run immediately. """
+        self.id_filter: Callable[[str], bool] | None = id_filter
+        """ Generated game_ids have to pass the filter, so that a worker generates only ids routed to itself. """
+        self.log_dir: str | None = log_dir
+        """ The directory of the write-ahead logs of the games. The games are not logged when it is None. """
+        self.seed: int | None = seed
+        """ The seed of the games. A game created with the same seed and game_id is played with the same dice and cards.
+        When it is None, every game is seeded randomly. """
+        self.bots: BotPool | None = bots
+        """ Searches the decisions of the bots. Without it, no bots are seated. """
+        self.games: dict[str, GameSession] = dict()
+        """ All hosted games by their game_id. """
+        self._open: dict[str, GameSession] = dict()
+        """ Games that can be joined, in the order they were opened. """
+        self._id_counter = itertools.count()
+        self.games_created: int = 0
+        """ The number of games created since the registry was started. """
+        self.round_trips_saved: int = 0
+        """ The round trips the standing orders saved in the games that were torn down, see Turn.set_orders. """
+        timeouts = (config.turn_timeout, *config.stage_timeouts.values())
+        self.deadlines: TimerWheel | None = None if max(timeouts) <= 0 else TimerWheel(
+            scheduler, config.deadline_resolution)
+        """ The deadlines of the players on turn and the closing timers of the auctions in all games, by the game_id.
+        None disables them. """
+        self.deadlines_passed: int = 0
+        """ The number of default actions taken for idle players. """
+        self._started_wall: float = time.perf_counter()
+        self._started_cpu: float = time.process_time()
+
+    def __len__(self):
+        return len(self.games)
+
+    def __contains__(self, game_id: str) -> bool:
+        return game_id in self.games
+
+    def __getitem__(self, game_id: str) -> GameSession:
+        return self.games[game_id]
+
+    def new_game_id(self) -> str:
+        """
+        Returns a game_id that is not used by any hosted game.
+        :return: The new game_id.
+        :rtype: str
+        """
+        game_id = str(next(self._id_counter))
+        while game_id in self.games or (self.id_filter is not None and not self.id_filter(game_id)):
+            game_id = str(next(self._id_counter))
+        return game_id
+
+    def create(self, game_id: str | None = None) -> GameSession:
+        """
+        Creates a new game. If no game_id is given, a new one is generated.
+        :param game_id: The identifier of the new game.
+        :type game_id: str | None
+        :return: The new game.
+        :rtype: GameSession
+        """
+        if game_id is None:
+            game_id = self.new_game_id()
+        if game_id in self.games:
+            raise KeyError(f"Game {game_id} already exists.")
+        session = GameSession(game_id, self, None if self.seed is None else Rng(self.seed).spawn(game_id))
+        if self.log_dir is not None:
+            session.attach_log(EventLog(EventLog.path_for(self.log_dir, game_id)))
+        self.games[game_id] = session
+        self._open[game_id] = session
+        self.games_created += 1
+        return session
+
+    def remove(self, game_id: str) -> None:
+        """
+        Tears down the game with the given game_id. Unknown game_ids are ignored.
+        :param game_id: The identifier of the game.
+        :type game_id: str
+        """
+        session = self.games.pop(game_id, None)
+        self._open.pop(game_id, None)
+        if session is not None:
+            self.round_trips_saved += session.controller.turn.round_trips_saved
+        if self.deadlines is not None:
+            self.deadlines.cancel(game_id)
+        if session is not None and session.log is not None:
+            session.log.close(delete=True)
+
+    def update_open(self, session: GameSession) -> None:
+        """
+        Keeps the set of joinable games up to date. Called by the session whenever its seats or lock change.
+        :param session: The changed game.
+        :type session: GameSession
+        """
+        if session.is_open and session.game_id in self.games:
+            self._open.setdefault(session.game_id, session)
+        else:
+            self._open.pop(session.game_id, None)
+
+    def find(self, game_id: str | None = None) -> GameSession | None:
+        """
+        Finds the game a joining client should be routed to. If game_id is given, the game is created when it does not
+        exist yet. Otherwise, the oldest game with a free seat is returned, or a new game if there is none.
+        :param game_id: The game requested by the client.
+        :type game_id: str | None
+        :return: The game or None if the requested game cannot be joined.
+        :rtype: GameSession | None
+        """
+        if game_id is None:
+            for session in self._open.values():
+                return session
+            return self.create()
+        if game_id not in self.games:
+            return self.create(game_id)
+        session = self.games[game_id]
+        return session if session.is_open else None
+
+    def recover(self) -> int:
+        """
+        Rebuilds the games from the logs found in log_dir. Only the games that pass id_filter are recovered. Logs that
+        cannot be replayed are renamed with the suffix ".broken".
+        :return: The number of recovered games.
+        :rtype: int
+        """
+        if self.log_dir is None:
+            return 0
+        os.makedirs(self.log_dir, exist_ok=True)
+        recovered = 0
+        for name in sorted(os.listdir(self.log_dir)):
+            path = os.path.join(self.log_dir, name)
+            if name.endswith(EventLog.SUFFIX + ".tmp"):  # an unfinished compaction, the old log is still in place
+                os.remove(path)
+                continue
+            if not name.endswith(EventLog.SUFFIX):
+                continue
+            try:
+                game_id = EventLog.game_id_of(path)
+            except ValueError:
+                continue
+            if game_id in self.games or (self.id_filter is not None and not self.id_filter(game_id)):
+                continue
+            session = GameSession(game_id, self)
+            try:
+                end = restore(session.controller, EventLog.read(path))
+            except Exception:
+                logging.exception(f"Cannot recover game {game_id} from {path}.")
+                os.replace(path, path + ".broken")
+                continue
+            if not end:  # nothing happened in the game
+                os.remove(path)
+                continue
+            os.truncate(path, end)
+            session.attach_log(EventLog(path))
+            self._install(session)
+            recovered += 1
+        logging.info(f"Recovered {recovered} games from {self.log_dir}.")
+        return recovered
+
+    def adopt(self, game_id: str, data: bytes) -> GameSession:
+        """
+        Rebuilds a game from its snapshot, e.g. a game moved here from another process. The players get their seats
+        back by rejoining, see GameSession.rejoin.
+        :param game_id: The identifier of the game.
+        :type game_id: str
+        :param data: The snapshot of the game, see GameSession.snapshot.
+        :type data: bytes
+        :return: The adopted game.
+        :rtype: GameSession
+        :raises KeyError: If a game with the game_id already exists.
+        :raises ValueError: If the data are not a valid snapshot.
+        """
+        if game_id in self.games:
+            raise KeyError(f"Game {game_id} already exists.")
+        session = GameSession(game_id, self)
+        snapshot.loads(session.controller, data)
+        if self.log_dir is not None:
+            log = EventLog(EventLog.path_for(self.log_dir, game_id))
+            log.compact(data)
+            session.attach_log(log)
+        self._install(session)
+        self.games_created += 1
+        return session
+
+    def sync_logs(self) -> int:
+        """
+        Writes the logs of all games to the disk. Called on the interval config.wal_fsync_interval. The logs that grew
+        over config.wal_compact_records records are compacted.
+        :return: The number of bytes written.
+        :rtype: int
+        """
+        written = 0
+        for session in self.games.values():
+            if session.log is None:
+                continue
+            if session.log.records >= config.wal_compact_records:
+                written += session.log.compact(session.snapshot())
+            else:
+                written += session.log.sync()
+        return written
+
+    def _install(self, session: GameSession) -> None:
+        """
+        Adds a game rebuilt from a log or a snapshot. None of its players is connected, so the deadline of the stage the
+        game waits in starts only when a player rejoins, see GameSession.rejoin. A game nobody comes back to does not
+        play itself.
+        """
+        game_data = session.controller.gd
+        session.available_ids -= set(game_data.players)
+        session._locked = game_data.get_value("misc", "on_turn") is not None
+        self.games[session.game_id] = session
+        self.update_open(session)
+
+    def stats(self) -> RegistryStats:
+        """
+        Returns the density figures of the process: how many games it hosts and what they cost in memory and CPU time,
+        how many round trips the standing orders of the players saved and how many deadlines are pending and passed.
+        :return: The statistics.
+        :rtype: RegistryStats
+        """
+        games = len(self.games)
+        rss = _current_rss()
+        cpu = time.process_time() - self._started_cpu
+        wall = time.perf_counter() - self._started_wall
+        cores_used = cpu / wall if wall > 0 else 0.0
+        return {
+            "games": games,
+            "players": sum(len(session.connected_clients) for session in self.games.values()),
+            "games_created": self.games_created,
+            "rss_bytes": rss,
+            "cpu_seconds": cpu,
+            "wall_seconds": wall,
+            "games_per_gb": games / (rss / 2**30) if rss else 0.0,
+            "games_per_core": games / cores_used if cores_used else 0.0,
+            "round_trips_saved": self.round_trips_saved + sum(
+                session.controller.turn.round_trips_saved for session in self.games.values()),
+            "deadlines": 0 if self.deadlines is None else len(self.deadlines),
+            "deadlines_passed": self.deadlines_passed,
+        }
+
+
+def _current_rss() -> int:
+    """
+    Returns the resident set size of the process in bytes. Falls back to the peak RSS where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
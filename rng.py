@@ -0,0 +1,127 @@
+"""
+Random number streams of the games. Every game owns its streams, so a game is reproducible from its seed and the tables
+do not share the generator of the interpreter.
+
+The streams are counter based: the n-th block of values of a stream is generated by a generator seeded by a hash of the
+seed, the key of the stream and n. The position of a stream is therefore just a few small numbers, which is cheap to
+checkpoint (see Turn.get_state), and independent streams are split off by extending the key (see Rng.spawn), so that
+e.g. parallel simulations get streams that do not overlap and do not depend on the order in which they are created.
+"""
+import hashlib
+import random
+import secrets
+from collections.abc import Hashable, MutableSequence
+from typing import ClassVar
+
+
+class Rng:
+    """
+    A seedable stream of random numbers. Rolls of dice are generated in blocks of BLOCK dice.
+    """
+    BLOCK: ClassVar[int] = 1024
+    """ The number of dice generated at once. """
+
+    def __init__(self, seed: int | None = None, key: tuple[Hashable, ...] = ()):
+        self.seed: int = secrets.randbits(63) if seed is None else seed
+        """ The seed of the stream and of all the streams spawned from it. It has to fit into a signed 64-bit integer. """
+        self.key: tuple[Hashable, ...] = tuple(key)
+        """ Distinguishes the streams spawned from the same seed. """
+        self.block: int = 0
+        """ The index of the current block of dice. """
+        self.offset: int = 0
+        """ The number of dice used from the current block. """
+        self.shuffles: int = 0
+        """ The number of shuffles done so far. """
+        self._dice: list[int] = []
+        self._sides: int = 0
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.seed}, {self.key!r})"
+
+    def spawn(self, *key: Hashable) -> "Rng":
+        """
+        Returns an independent stream. The same seed and key always give the same stream.
+        :param key: Distinguishes the new stream from the other streams spawned from this one, e.g. "dice" or the
+        index of a simulated game.
+        :type key: Hashable
+        :return: The new stream.
+        :rtype: Rng
+        """
+        return Rng(self.seed, self.key + key)
+
+    def fork(self) -> "Rng":
+        """
+        Returns a copy of the stream at its current position. The copy goes on independently, but it returns the same
+        numbers as this stream would, see GameController.fork.
+        :return: The copy.
+        :rtype: Rng
+        """
+        rng = object.__new__(Rng)
+        rng.__dict__.update(self.__dict__)  # the block of dice is replaced, never changed
+        return rng
+
+    def roll(self, count: int, sides: int) -> tuple[int, ...]:
+        """
+        Rolls the given number of dice.
+        :param count: The number of dice.
+        :type count: int
+        :param sides: The number of sides of the dice.
+        :type sides: int
+        :return: The values of the dice.
+        :rtype: tuple[int, ...]
+        """
+        start = self.offset
+        if sides != self._sides or start + count > self.BLOCK:
+            if count > self.BLOCK:
+                raise ValueError(f"Cannot roll more than {self.BLOCK} dice at once.")
+            if start + count > self.BLOCK:  # the rest of the current block is skipped
+                self.block += 1
+                start = 0
+            self._fill(sides)
+        self.offset = start + count
+        return tuple(self._dice[start:self.offset])
+
+    def shuffle(self, items: MutableSequence) -> None:
+        """
+        Shuffles the items in place.
+        :param items: The items to shuffle.
+        :type items: MutableSequence
+        """
+        random.Random(self._derive("shuffle", self.shuffles)).shuffle(items)
+        self.shuffles += 1
+
+    def generator(self) -> random.Random:
+        """
+        Returns a generator with the full API of random.Random seeded from this stream, e.g. for the decision policies
+        of simulated players. The same stream always gives the same generator, its position is not a part of the state
+        of the stream.
+        :return: The generator.
+        :rtype: random.Random
+        """
+        return random.Random(self._derive("generator"))
+
+    def get_state(self) -> tuple[int, int, int]:
+        """
+        Returns the position of the stream. The seed and the key are not a part of it.
+        :return: The position as (block, offset, shuffles).
+        :rtype: tuple[int, int, int]
+        """
+        return self.block, self.offset, self.shuffles
+
+    def set_state(self, state: tuple[int, int, int]) -> None:
+        """
+        Moves the stream to the position returned by get_state.
+        :param state: The position.
+        :type state: tuple[int, int, int]
+        """
+        self.block, self.offset, self.shuffles = state
+        self._dice = []
+        self._sides = 0
+
+    def _fill(self, sides: int) -> None:
+        self._sides = sides
+        self._dice = random.Random(self._derive("dice", sides, self.block)).choices(range(1, sides + 1), k=self.BLOCK)
+
+    def _derive(self, *key: Hashable) -> int:
+        digest = hashlib.blake2b(repr((self.seed,) + self.key + key).encode(), digest_size=16).digest()
+        return int.from_bytes(digest, "big")
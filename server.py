@@ -9,7 +9,8 @@ from twisted.internet.protocol import Protocol, Factory, connectionDone
 from twisted.python import failure
 
 import config
-from interfaces import IServer, IMessenger
+from encoders import FrameDecoder, FrameTooLarge
+from registry import GameRegistry, GameSession
 
 
 def encode(message: Any) -> bytes:
@@ -29,40 +30,36 @@ def decode(data: bytes) -> tuple[Any, bytes]:
 
 class Server(Protocol):
     factory: "ServerFactory"
+    is_bot: bool = False
+    """ Connections are players, see bots.BotClient. """
 
     def __init__(self):
         self.player_uuid: uuid.UUID | None = None
         self.player_id: int | None = None
-
-    def connectionMade(self) -> None:
-        if not self.factory.available_ids:
-            self.transport.loseConnection()
-            return
-        elif self.factory.locked:
-            self.transport.loseConnection()
-            return
-        else:
-            self.player_id = self.factory.get_id()
-        self.player_uuid = uuid.uuid4()
-        self.factory.connected_clients[self.player_uuid] = self
-        dic = {
-            "my_uuid": self.factory.server_uuid, "action": "add_player",
-            "parameters": {"player_uuid": self.player_uuid, "player_id": self.player_id}
-        }
-        self.factory.messenger.receive(dic)
+        self.session: GameSession | None = None
+        """ The game the client is seated at. None until the join handshake is done. """
+        self.decoder: FrameDecoder = FrameDecoder(config.encoder, config.max_frame_size)
+        """ Keeps incomplete frames between reads. """
 
     def connectionLost(self, reason: failure.Failure = connectionDone):
-        # TODO exit when no player connected
-        # TODO broadcast new info to other players when one of them leaves
-        if self.player_uuid in self.factory.connected_clients:
-            del self.factory.connected_clients[self.player_uuid]
-            self.factory.retrieve_id(self.player_id)
+        if self.session is not None:
+            self.session.leave(self)
+            self.session = None
 
     def dataReceived(self, data: bytes):
-        messages = config.encoder.decode(data)
+        try:
+            messages, error = self.decoder.feed(data), None
+        except FrameTooLarge as e:  # the messages sent before the frame are handled first
+            messages, error = e.messages, e
         for message in messages:
-            print("Data received: ", message)
-            self.factory.messenger.receive(message)
+            logging.debug(f"Data received: {message}")
+            if self.session is None:
+                self._join(message)
+            else:
+                self.session.messenger.receive(message)
+        if error is not None:
+            logging.warning(f"Dropping client {self.player_uuid}: {error}")
+            self.transport.loseConnection()
 
     def send(self, message: Any) -> None:
         """
@@ -73,54 +70,49 @@ class Server(Protocol):
         logging.debug(f"Sending data: {message}")
         self.transport.write(config.encoder.encode(message))
 
-
-class ServerFactory(Factory, IServer):
-
-    protocol = Server
-
-    def __init__(self, messenger: IMessenger):
-        self.server_uuid = uuid.uuid4()
-        self.messenger: IMessenger = messenger
-        self.messenger.set_server(self)
-        self.connected_clients: dict[uuid.UUID, Server] = dict()
-        self.available_ids: set[int] = set(range(4))
-        self.locked = False
-
-    def get_id(self) -> int:
+    def write_frames(self, frames: list[bytes]) -> None:
         """
-        Gets an available player ID.
-        :return: The player ID.
-        :rtype: int
+        Writes already encoded frames to the client.
+        :param frames: The encoded frames.
+        :type frames: list[bytes]
         """
-        player_id = min(self.available_ids)
-        self.available_ids.remove(player_id)
-        return player_id
+        self.transport.writeSequence(frames)
 
-    def retrieve_id(self, player_id: int) -> None:
+    def _join(self, message: Any) -> None:
         """
-        Retrieves a disconnected player ID.
-        :param player_id: The player ID.
-        :type player_id: int
-        :return: None
-        :rtype: None
+        Handles the join handshake. The first message of the client has to be {"action": "join", "parameters":
+        {"game_id": ...}}. The game_id may be None, in which case the client is seated at any table with a free seat.
+        A player who lost the connection (or whose game was recovered after a restart) sends also the "player_uuid"
+        they got and takes their seat again.
+        :param message: The first message of the client.
+        :type message: Any
         """
-        self.available_ids.add(player_id)
+        try:
+            if message["action"] != "join":
+                raise KeyError("action")
+            parameters = message.get("parameters", {})
+            game_id = parameters.get("game_id")
+            player_uuid = parameters.get("player_uuid")
+            if player_uuid is not None:
+                player_uuid = uuid.UUID(str(player_uuid))
+        except (KeyError, TypeError, AttributeError, ValueError):
+            logging.warning(f"Invalid join handshake: {message}")
+            self.transport.loseConnection()
+            return
+        if player_uuid is not None:
+            session = self.factory.registry.games.get(str(game_id))
+            joined = session is not None and session.rejoin(self, player_uuid)
+        else:
+            session = self.factory.registry.find(None if game_id is None else str(game_id))
+            joined = session is not None and session.join(self)
+        if not joined:
+            logging.info(f"Game {game_id} cannot be joined.")
+            self.transport.loseConnection()
 
-    def broadcast(self, message: Any) -> None:
-        """
-        Broadcasts the given data to all connected clients.
-        :param message: The data to be sent.
-        :type message: bytes
-        """
-        for client in self.connected_clients.values():
-            client.send(message)
 
-    def send(self, player_uuid: uuid.UUID, data: Any) -> None:
-        """
-        Sends the given data to the given player.
-        :param player_uuid: The UUID of the player.
-        :type player_uuid: UUID
-        :param data: The data to be sent.
-        :type data: bytes
-        """
-        self.connected_clients[player_uuid].send(data)
+class ServerFactory(Factory):
+
+    protocol = Server
+
+    def __init__(self, registry: GameRegistry):
+        self.registry: GameRegistry = registry
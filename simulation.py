@@ -0,0 +1,399 @@
+"""
+Headless simulation of complete games. The games are played by decision policies instead of clients, without the
+network, the messenger queues and the write-ahead log, e.g. to tune the house rules or to test bots. Run
+`python simulation.py --games 10000` to simulate games on all cores, see `python simulation.py --help`.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from collections.abc import Callable, Iterator
+from typing import Any, Self, TypedDict
+from uuid import UUID
+
+import config
+from game_controller import GameController
+from game_data import GameData
+from interfaces import ClientMessage, IController, IMessenger, IPlayer, IServer
+from rng import Rng
+
+RULES: tuple[str, ...] = ("initial_cash", "initial_field", "go_cash", "payout_price")
+""" The settings of config that can be changed for a simulation. """
+
+Policy = Callable[[IController, set[str], random.Random], str]
+""" Chooses one of the possible actions of the acting player, see acting_player. """
+
+
+class GameStats(TypedDict):
+    seed: int
+    game: int
+    actions: int
+    turns: int
+    rolls: int
+    finished: bool
+    bankrupt: int | None
+    winner: int
+    cash: list[int]
+    properties: list[int]
+    net_worth: list[int]
+
+
+class SimulationReport(TypedDict):
+    games: int
+    workers: int
+    seconds: float
+    games_per_s: float
+    actions_per_s: float
+    finished_percent: float
+    mean_turns: float
+    wins: list[int]
+    games_stats: list[GameStats]
+
+
+def random_policy(controller: IController, actions: set[str], rng: random.Random) -> str:
+    """
+    Chooses any of the possible actions. It puts half of the properties it lands on up for auction and bids only the
+    minimum, so few properties are owned and the rents rarely ruin anybody: a game of four random players practically
+    never ends with a bankruptcy (none of 40 games within 10000 actions) and stops at max_actions, see simulate_game.
+    The winner of such a game is the player with the highest net worth.
+    """
+    return rng.choice(sorted(actions))
+
+
+def buyer_policy(controller: IController, actions: set[str], rng: random.Random) -> str:
+    """
+    Buys every property it lands on when it can afford it, leaves jail as soon as possible and bids in auctions up to
+    the price of the property.
+    """
+    if "pass" in actions:
+        auction = controller.turn.auction
+        price = controller.gd.fields.get_field(auction.field_id).price
+        return "bid" if "bid" in actions and auction.minimum <= price else "pass"
+    if "buy" in actions:
+        player = controller.gd.on_turn_player
+        field = controller.gd.fields.get_field(player.field)
+        return "buy" if player.cash >= field.price else "auction"
+    for action in ("use_card", "roll", "payout", "end_turn"):
+        if action in actions:
+            return action
+    return rng.choice(sorted(actions))
+
+
+def cautious_policy(controller: IController, actions: set[str], rng: random.Random) -> str:
+    """
+    Buys a property only if it keeps a reserve of the initial cash / 3, bids in auctions up to the price if it keeps
+    the reserve and waits in jail as long as it can.
+    """
+    player = acting_player(controller)
+    if "pass" in actions:
+        auction = controller.turn.auction
+        price = controller.gd.fields.get_field(auction.field_id).price
+        affordable = player.cash - auction.minimum >= config.initial_cash // 3
+        return "bid" if "bid" in actions and auction.minimum <= price and affordable else "pass"
+    if "buy" in actions:
+        field = controller.gd.fields.get_field(player.field)
+        return "buy" if player.cash - field.price >= config.initial_cash // 3 else "auction"
+    for action in ("roll", "use_card", "payout", "end_turn"):
+        if action in actions:
+            return action
+    return rng.choice(sorted(actions))
+
+
+def acting_player(controller: IController) -> IPlayer:
+    """
+    Returns the player whose decision the game waits for: the player on turn or, in an auction, the next bidder. The
+    bidders take turns here, while the clients of a server bid whenever they want, see Auction.next_bidder.
+    :param controller: The controller of the game.
+    :type controller: IController
+    :rtype: IPlayer
+    """
+    auction = controller.turn.auction
+    if auction is not None:
+        return controller.gd.players[auction.next_bidder()]
+    return controller.gd.on_turn_player
+
+
+POLICIES: dict[str, Policy] = {
+    "random": random_policy,
+    "buyer": buyer_policy,
+    "cautious": cautious_policy,
+}
+""" The policies by their names. The workers get the names, so the policies do not have to be picklable. """
+
+
+class HeadlessServer(IServer):
+    """
+    Stands in for the game session. There are no connections, so nothing is ever sent.
+    """
+
+    def __init__(self):
+        self.server_uuid: UUID = uuid.uuid4()
+        self.connected_clients: dict[UUID, Any] = {}
+        self.locked: bool = False
+
+    def send_frames(self, player_uuid: UUID, frames: list[bytes]) -> None:
+        pass
+
+    def broadcast_frames(self, frames: list[bytes]) -> None:
+        pass
+
+    def call_later(self, delay: float, function: Callable[[], Any]) -> None:
+        function()
+
+    def message_parsed(self) -> None:
+        pass
+
+
+class NullMessenger(IMessenger):
+    """
+    A messenger that drops all messages.
+    """
+
+    def __init__(self):
+        self.controller: IController | None = None
+        self.server: HeadlessServer | None = None
+
+    def add(self, **kwargs) -> Self:
+        return self
+
+    def send(self, player_uuid: UUID, message: Any | None = None) -> None:
+        pass
+
+    def send_initial_state(self, player_uuid: UUID, tail: list[dict]) -> None:
+        pass
+
+    def broadcast(self) -> None:
+        pass
+
+    def receive(self, message: ClientMessage) -> None:
+        self.controller.parse(message)
+
+    def set_server(self, server: IServer) -> None:
+        self.server = server
+        self.controller.server_uuid = server.server_uuid
+
+
+class HeadlessGameData(GameData):
+    """
+    Game data whose changes are never turned into records for the clients.
+    """
+
+    def get_changes(self, for_client: bool = True) -> Iterator[dict]:
+        self._changes = {}
+        return iter(())
+
+
+def new_game(rng: Rng, players: int) -> tuple[GameController, list[UUID]]:
+    """
+    Creates a headless game and starts it.
+    :param rng: The random number stream of the game.
+    :type rng: Rng
+    :param players: The number of players.
+    :type players: int
+    :return: The controller of the game and the UUIDs of the players by their player_id.
+    :rtype: tuple[GameController, list[UUID]]
+    """
+    messenger = NullMessenger()
+    controller = GameController(HeadlessGameData(), messenger, rng)
+    messenger.set_server(HeadlessServer())
+    player_uuids = [UUID(int=player_id + 1) for player_id in range(players)]
+    for player_id, player_uuid in enumerate(player_uuids):
+        controller.parse({
+            "my_uuid": controller.server_uuid, "action": "add_player",
+            "parameters": {"player_uuid": player_uuid, "player_id": player_id}
+        })
+    for player_id, player_uuid in enumerate(player_uuids):
+        for attribute, value in (("token", f"token_{player_id}"), ("ready", True)):
+            controller.parse({
+                "my_uuid": player_uuid, "action": "update_player",
+                "parameters": {"attribute": attribute, "value": value}
+            })
+    if controller.turn.stage == "pre_game":
+        controller.parse({"my_uuid": player_uuids[0], "action": "start_game", "parameters": {}})
+    return controller, player_uuids
+
+
+def play(controller: IController, policies: list[Policy], rng: random.Random, max_actions: int) -> tuple[int, int, int]:
+    """
+    Plays the game until a player goes bankrupt or max_actions actions are made.
+    :return: The number of actions, turns and rolls.
+    :rtype: tuple[int, int, int]
+    """
+    game_data = controller.gd
+    players = game_data.players
+    turn = controller.turn
+    actions = turns = rolls = 0
+    while actions < max_actions:
+        player = acting_player(controller)
+        if any(p.cash < 0 for p in players.values()):
+            break
+        possible_actions = turn.get_possible_actions(player.uuid)
+        if not possible_actions:
+            raise RuntimeError(f"Player {player.player_id} has no possible actions in the stage {turn.stage}.")
+        action = policies[player.player_id](controller, possible_actions, rng)
+        controller.parse({"my_uuid": player.uuid, "action": action, "parameters": {}})
+        actions += 1
+        if action == "roll":
+            rolls += 1
+        elif action == "end_turn":
+            turns += 1
+    return actions, turns, rolls
+
+
+def net_worths(controller: IController) -> list[int]:
+    """
+    Returns the cash plus the prices of the owned properties of every player.
+    :param controller: The controller of the game.
+    :type controller: IController
+    :return: The net worths by the order of the player_ids.
+    :rtype: list[int]
+    """
+    fields = controller.gd.fields
+    players = sorted(controller.gd.players.values(), key=lambda p: p.player_id)
+    return [
+        player.cash + sum(fields.specs[field_id].price for field_id in fields.get_owned(player.player_id))
+        for player in players
+    ]
+
+
+def simulate_game(seed: int, game: int, policies: list[str], max_actions: int = 10000) -> GameStats:
+    """
+    Plays one game. The game is given by the seed and its index, so it is the same in any process.
+    :param seed: The seed of the simulation.
+    :type seed: int
+    :param game: The index of the game in the simulation.
+    :type game: int
+    :param policies: The names of the policies of the players, see POLICIES.
+    :type policies: list[str]
+    :param max_actions: The game is stopped after this number of actions.
+    :type max_actions: int
+    :return: The statistics of the game.
+    :rtype: GameStats
+    """
+    rng = Rng(seed).spawn(game)
+    controller, _ = new_game(rng, len(policies))
+    actions, turns, rolls = play(
+        controller, [POLICIES[name] for name in policies], rng.spawn("policy").generator(), max_actions)
+    fields = controller.gd.fields
+    players = sorted(controller.gd.players.values(), key=lambda p: p.player_id)
+    cash = [player.cash for player in players]
+    owned = [fields.get_owned(player.player_id) for player in players]
+    net_worth = net_worths(controller)
+    bankrupt = next((player.player_id for player in players if player.cash < 0), None)
+    return {
+        "seed": seed,
+        "game": game,
+        "actions": actions,
+        "turns": turns,
+        "rolls": rolls,
+        "finished": bankrupt is not None,
+        "bankrupt": bankrupt,
+        "winner": max(range(len(players)), key=lambda player_id: net_worth[player_id]),
+        "cash": cash,
+        "properties": [len(ids) for ids in owned],
+        "net_worth": net_worth,
+    }
+
+
+def _simulate_batch(task: tuple[int, range, list[str], dict[str, Any], int]) -> list[GameStats]:
+    seed, games, policies, rules, max_actions = task
+    previous = {name: getattr(config, name) for name in rules}
+    for name, value in rules.items():
+        setattr(config, name, value)
+    try:
+        return [simulate_game(seed, game, policies, max_actions) for game in games]
+    finally:
+        for name, value in previous.items():
+            setattr(config, name, value)
+
+
+def simulate(
+        games: int, seed: int = 0, policies: list[str] | None = None, rules: dict[str, Any] | None = None,
+        workers: int | None = None, max_actions: int = 10000, batch: int = 64) -> SimulationReport:
+    """
+    Plays the given number of games in a pool of processes. The results do not depend on the number of workers.
+    :param games: The number of games.
+    :type games: int
+    :param seed: The seed of the simulation.
+    :type seed: int
+    :param policies: The names of the policies of the players, see POLICIES. Four random players by default, whose
+    games end at max_actions, see random_policy.
+    :type policies: list[str] | None
+    :param rules: The house rules as names of settings in config and their values, see RULES.
+    :type rules: dict[str, Any] | None
+    :param workers: The number of processes. The games are played in this process if it is 1. All cores by default.
+    :type workers: int | None
+    :param max_actions: A game is stopped after this number of actions.
+    :type max_actions: int
+    :param batch: The number of games sent to a worker at once.
+    :type batch: int
+    :return: The report of the simulation with the statistics of every game.
+    :rtype: SimulationReport
+    :raises ValueError: If an unknown policy or rule is given.
+    """
+    policies = ["random"] * config.max_players if policies is None else list(policies)
+    rules = dict(rules or {})
+    unknown = [name for name in policies if name not in POLICIES] + [name for name in rules if name not in RULES]
+    if unknown:
+        raise ValueError(f"Unknown policies or rules: {unknown}.")
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    tasks = [
+        (seed, range(start, min(start + batch, games)), policies, rules, max_actions)
+        for start in range(0, games, batch)
+    ]
+    logging_disabled = logging.root.manager.disable
+    logging.disable(logging.CRITICAL)
+    start = time.perf_counter()
+    try:
+        if workers <= 1:
+            results = [_simulate_batch(task) for task in tasks]
+        else:
+            with multiprocessing.Pool(workers, initializer=logging.disable, initargs=(logging.CRITICAL,)) as pool:
+                results = pool.map(_simulate_batch, tasks)
+    finally:
+        logging.disable(logging_disabled)
+    seconds = time.perf_counter() - start
+    games_stats = [stats for result in results for stats in result]
+    wins = [0] * len(policies)
+    for stats in games_stats:
+        wins[stats["winner"]] += 1
+    return {
+        "games": len(games_stats),
+        "workers": workers,
+        "seconds": seconds,
+        "games_per_s": len(games_stats) / seconds if seconds else 0.0,
+        "actions_per_s": sum(stats["actions"] for stats in games_stats) / seconds if seconds else 0.0,
+        "finished_percent": 100 * sum(stats["finished"] for stats in games_stats) / len(games_stats) if games_stats else 0.0,
+        "mean_turns": statistics.fmean(stats["turns"] for stats in games_stats) if games_stats else 0.0,
+        "wins": wins,
+        "games_stats": games_stats,
+    }
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(description="Simulates games without clients.")
+    parser.add_argument("--games", type=int, default=1000, help="the number of games")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the simulation")
+    parser.add_argument("--workers", type=int, default=None, help="the number of processes, all cores by default")
+    parser.add_argument("--max-actions", type=int, default=10000, help="a game is stopped after this many actions")
+    parser.add_argument(
+        "--policy", action="append", choices=sorted(POLICIES), help="the policy of the next player, 4x random by default")
+    parser.add_argument("--rule", action="append", default=[], metavar="NAME=VALUE", help=f"one of {', '.join(RULES)}")
+    args = parser.parse_args(argv)
+    rules = {}
+    for rule in args.rule:
+        name, _, value = rule.partition("=")
+        rules[name] = int(value)
+    report = simulate(args.games, args.seed, args.policy, rules, args.workers, args.max_actions)
+    for key, value in report.items():
+        if key != "games_stats":
+            print(f"{key:<20} {value:,.2f}" if isinstance(value, float) else f"{key:<20} {value}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
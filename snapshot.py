@@ -0,0 +1,50 @@
+"""
+Point-in-time snapshots of a game. A snapshot contains the complete state of the game (the game data, the card decks,
+the dice and the turn), so that the game can be rebuilt from it without the history of the game. Snapshots are used to
+compact the write-ahead logs (see EventLog.compact) and to move games between processes (see GameRegistry.adopt).
+
+A snapshot is a header (MAGIC, VERSION and the version of the BinaryEncoder) followed by the state returned by
+IController.get_state serialized by BinaryEncoder.dumps. The state of the board is kept as the raw bytes of its arrays.
+"""
+import struct
+
+from encoders import BinaryEncoder
+from interfaces import IController
+
+MAGIC = b"MSNP"
+""" The first bytes of every snapshot. """
+VERSION = 2
+""" Version of the snapshot format. 2 added the random number streams of the game and of the dice. """
+HEADER = struct.Struct("!4sBB")
+""" MAGIC, VERSION, BinaryEncoder.VERSION """
+
+
+def dumps(controller: IController) -> bytes:
+    """
+    Takes a snapshot of the game. The game has to be between two messages, i.e. not in the middle of a turn stage.
+    :param controller: The controller of the game.
+    :type controller: IController
+    :return: The snapshot.
+    :rtype: bytes
+    """
+    return HEADER.pack(MAGIC, VERSION, BinaryEncoder.VERSION) + BinaryEncoder.dumps(controller.get_state())
+
+
+def loads(controller: IController, data: bytes | memoryview) -> None:
+    """
+    Restores the game from a snapshot. The controller is expected to be a newly created one, the change journal of
+    the game data is emptied and the clients have to receive the whole state again.
+    :param controller: The controller of the game.
+    :type controller: IController
+    :param data: The snapshot as returned by dumps.
+    :type data: bytes | memoryview
+    :raises ValueError: If the data are not a snapshot or the version of the snapshot is not supported.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("Not a game snapshot.")
+    magic, version, encoder_version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a game snapshot.")
+    if version != VERSION or encoder_version != BinaryEncoder.VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}.{encoder_version}.")
+    controller.set_state(BinaryEncoder.loads(memoryview(data)[HEADER.size:]))
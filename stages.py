@@ -0,0 +1,228 @@
+"""
+A compiled stage machine. The stages of an object are declared in a table: the method that runs the stage, the stages
+it can go to and whether the object waits for input in the stage. The table is checked when the machine is built and
+compiled to a dict, so every step of the machine is one lookup and one call, see StageMachine.run.
+
+The machine can count the steps of every stage and measure their duration. The measuring runs in a separate loop, so
+it costs nothing while it is disabled::
+
+    turn.STAGE_MACHINE.stats = StageStats()
+    ...
+    turn.STAGE_MACHINE.stats.report()
+"""
+import ast
+import inspect
+import logging
+import textwrap
+import time
+from collections.abc import Callable, Iterable
+from typing import Any, NamedTuple, TypedDict
+
+
+class Stage(NamedTuple):
+    handler: str | None
+    """ The name of the method that runs the stage and returns the next stage. None for a stage that only waits. """
+    next: tuple[str, ...] = ()
+    """ The stages the handler can return. The next stages of a waiting stage are entered by the input. """
+    input_expected: bool = False
+    """ The object waits for input in the stage. """
+
+
+class StageTiming(TypedDict):
+    count: int
+    total_us: float
+    mean_us: float
+    p50_us: float
+    p99_us: float
+
+
+class StageStats:
+    """
+    Counters of the steps of every stage and histograms of their durations. The buckets of a histogram are powers of
+    two of nanoseconds, so the percentiles are the upper bounds of their buckets.
+    """
+    BUCKETS = 40
+    """ The last bucket takes everything over 2^39 ns, about nine minutes. """
+
+    def __init__(self):
+        self.cells: dict[str, list[int]] = {}
+        """ By the stage: the number of steps, their total duration in nanoseconds and the histogram buckets. """
+        self.invalid: int = 0
+        """ The number of steps that went to a stage not declared as their next stage. """
+
+    def cell(self, stage: str) -> list[int]:
+        """
+        Returns the counters of the stage, see cells.
+        :param stage: The stage.
+        :type stage: str
+        :rtype: list[int]
+        """
+        cell = self.cells.get(stage)
+        if cell is None:
+            cell = self.cells[stage] = [0] * (2 + self.BUCKETS)
+        return cell
+
+    def record(self, stage: str, elapsed_ns: int) -> None:
+        """
+        Counts a step of the stage.
+        :param stage: The stage.
+        :type stage: str
+        :param elapsed_ns: The duration of the step in nanoseconds.
+        :type elapsed_ns: int
+        """
+        cell = self.cell(stage)
+        cell[0] += 1
+        cell[1] += elapsed_ns
+        cell[2 + min(elapsed_ns.bit_length(), self.BUCKETS - 1)] += 1
+
+    def report(self) -> dict[str, StageTiming]:
+        """
+        Returns the timing of every stage that ran, the most expensive stages first.
+        :rtype: dict[str, StageTiming]
+        """
+        report = {}
+        for stage, cell in sorted(self.cells.items(), key=lambda item: item[1][1], reverse=True):
+            count, total_ns = cell[0], cell[1]
+            report[stage] = {
+                "count": count,
+                "total_us": total_ns / 1e3,
+                "mean_us": total_ns / count / 1e3,
+                "p50_us": self._percentile(cell, 0.5),
+                "p99_us": self._percentile(cell, 0.99),
+            }
+        return report
+
+    def _percentile(self, cell: list[int], fraction: float) -> float:
+        rank = fraction * cell[0]
+        seen = 0
+        for bucket, count in enumerate(cell[2:]):
+            seen += count
+            if seen >= rank:
+                return (1 << bucket) / 1e3
+        return (1 << self.BUCKETS) / 1e3
+
+
+class StageMachine:
+    """
+    Runs the stages of the instances of a class by a table of stages.
+    """
+
+    def __init__(self, cls: type, stages: dict[str, Stage], entries: Iterable[str]):
+        """
+        Builds the machine and checks the table.
+        :param cls: The class whose methods run the stages.
+        :type cls: type
+        :param stages: The table of the stages by their names.
+        :type stages: dict[str, Stage]
+        :param entries: The stages the instances start in. Every stage has to be reachable from them.
+        :type entries: Iterable[str]
+        :raises ValueError: If the table is not consistent with itself or with the class.
+        """
+        self.stages: dict[str, Stage] = stages
+        self.stats: StageStats | None = None
+        """ The counters and timings of the stages, None disables them. """
+        self._handlers: dict[str, tuple[Callable[..., str], bool]] = {}
+        """ The compiled table: the function and whether it takes the input, by the stage. Waiting stages are not in
+        it. """
+        self._next: dict[str, frozenset[str]] = {name: frozenset(stage.next) for name, stage in stages.items()}
+        for name, stage in stages.items():
+            unknown = set(stage.next) - stages.keys()
+            if unknown:
+                raise ValueError(f"The stage {name} goes to the undeclared stages {sorted(unknown)}.")
+            if stage.handler is None:
+                if not stage.input_expected:
+                    raise ValueError(f"The stage {name} has no handler and does not wait for input.")
+                continue
+            function = getattr(cls, stage.handler, None)
+            if not callable(function):
+                raise ValueError(f"The handler {stage.handler} of the stage {name} is not a method of {cls.__name__}.")
+            parameters = len(inspect.signature(function).parameters)
+            if parameters not in (1, 2):
+                raise ValueError(f"The handler {stage.handler} has to take the instance and optionally the input.")
+            returned = _returned_literals(function) - self._next[name]
+            if returned:
+                raise ValueError(f"The handler {stage.handler} returns the undeclared next stages {sorted(returned)}.")
+            self._handlers[name] = (function, parameters == 2)
+        entries = set(entries)
+        unknown = entries - stages.keys()
+        if unknown:
+            raise ValueError(f"The undeclared stages {sorted(unknown)} are entries.")
+        reached = set(entries)
+        pending = list(entries)
+        while pending:
+            for target in stages[pending.pop()].next:
+                if target not in reached:
+                    reached.add(target)
+                    pending.append(target)
+        unreachable = stages.keys() - reached
+        if unreachable:
+            raise ValueError(f"The stages {sorted(unreachable)} cannot be reached.")
+
+    def run(self, owner: Any, message: Any) -> None:
+        """
+        Runs the stages of the owner until it expects input. A stage without handler sets owner.input_expected.
+        :param owner: The instance whose stage, a str, is in owner.stage.
+        :type owner: Any
+        :param message: The input passed to the handlers that take it.
+        :type message: Any
+        """
+        if self.stats is not None:
+            self._run_measured(owner, message)
+            return
+        handlers = self._handlers
+        while not owner.input_expected:
+            entry = handlers.get(owner.stage)
+            if entry is None:
+                owner.input_expected = True
+                continue
+            handler, takes_message = entry
+            owner.stage = handler(owner, message) if takes_message else handler(owner)
+
+    def log_stats(self) -> None:
+        """
+        Logs the report of the stats, if they are enabled.
+        """
+        if self.stats is not None:
+            logging.info(f"Stages: {self.stats.report()}, invalid steps: {self.stats.invalid}")
+
+    def _run_measured(self, owner: Any, message: Any) -> None:
+        """
+        Runs the stages like run, counts and times them and counts the steps that go to undeclared stages. The
+        counting of StageStats.record is inlined.
+        """
+        stats = self.stats
+        cells = stats.cells
+        handlers = self._handlers
+        allowed = self._next
+        clock = time.perf_counter_ns
+        last_bucket = StageStats.BUCKETS + 1
+        while not owner.input_expected:
+            stage = owner.stage
+            entry = handlers.get(stage)
+            if entry is None:
+                owner.input_expected = True
+                continue
+            handler, takes_message = entry
+            started = clock()
+            owner.stage = handler(owner, message) if takes_message else handler(owner)
+            elapsed = clock() - started
+            cell = cells.get(stage) or stats.cell(stage)
+            cell[0] += 1
+            cell[1] += elapsed
+            cell[min(elapsed.bit_length() + 2, last_bucket)] += 1
+            if owner.stage not in allowed[stage]:
+                stats.invalid += 1
+
+
+def _returned_literals(function: Callable) -> set[str]:
+    """
+    Returns the string literals the function returns. Empty if the source is not available.
+    """
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(function)))
+    except (OSError, TypeError):
+        return set()
+    return {
+        node.value.value for node in ast.walk(tree)
+        if isinstance(node, ast.Return) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+    }
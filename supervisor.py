@@ -0,0 +1,370 @@
+"""
+Multi-process mode of the server. The supervisor accepts the connections, reads the join handshake and hands the socket
+over to the worker process that hosts the requested game. Every game lives in exactly one worker, which is given by the
+hash of its game_id, so all players of a table always end up in the same process.
+"""
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import time
+import zlib
+from typing import Any, TypedDict
+
+from zope.interface import implementer
+from twisted.internet.error import ReactorNotRunning
+from twisted.internet.interfaces import IReadDescriptor
+
+import config
+from encoders import FrameTooLarge
+from registry import GameRegistry
+
+MAX_HANDSHAKE_SIZE = 1 << 16
+""" The most data the supervisor reads from a client before it has to decide where the client goes. """
+
+
+class WorkerStats(TypedDict, total=False):
+    pid: int
+    games: int
+    players: int
+    rss_bytes: int
+    cpu_seconds: float
+    connections: int
+    updated: float
+
+
+def shard_of(game_id: str, workers: int) -> int:
+    """
+    Returns the index of the worker that hosts the given game.
+    :param game_id: The identifier of the game.
+    :type game_id: str
+    :param workers: The number of workers.
+    :type workers: int
+    :return: The index of the worker.
+    :rtype: int
+    """
+    return zlib.crc32(game_id.encode()) % workers
+
+
+def parse_handshake(data: bytes) -> tuple[bool, str | None]:
+    """
+    Tries to read the join handshake from the beginning of the data received from a client.
+    :param data: The data received so far.
+    :type data: bytes
+    :return: A tuple (complete, game_id). complete is False until the whole first frame has been received.
+    :rtype: tuple[bool, str | None]
+    :raises ValueError: If the first frame is not a join handshake.
+    """
+    header = config.encoder.HEADER
+    if len(data) < header.size:
+        return False, None
+    size = header.unpack_from(data)[0]
+    if size > MAX_HANDSHAKE_SIZE - header.size:
+        raise FrameTooLarge(f"Handshake of {size} bytes is too large.")
+    if len(data) < header.size + size:
+        return False, None
+    try:
+        message = config.encoder.loads(data[header.size:header.size + size])
+        if message["action"] != "join":
+            raise ValueError(f"Expected join, got {message['action']}.")
+        game_id = message.get("parameters", {}).get("game_id")
+    except ValueError:
+        raise
+    except Exception as e:  # whatever the payload makes the decoder raise, the client is dropped
+        raise ValueError(f"Invalid handshake: {e!r}") from e
+    return True, None if game_id is None else str(game_id)
+
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index: int = index
+        self.pid: int = 0
+        self.control: socket.socket | None = None
+        self.stats: WorkerStats = {}
+        self.connections: int = 0
+        """ Connections handed over to the worker since its last stats report. """
+
+
+class _Pending:
+    def __init__(self, client: socket.socket):
+        self.client: socket.socket = client
+        self.data: bytes = b""
+        self.deadline: float = time.monotonic() + config.handshake_timeout
+
+
+class Supervisor:
+    """
+    Pre-forks the worker processes and routes the accepted connections to them. Runs on a plain selector loop, the
+    Twisted reactor is started only in the workers.
+    """
+
+    def __init__(self, workers: int, port: int = config.listen_port):
+        self.port: int = port
+        self.workers: list[_Worker] = [_Worker(index) for index in range(workers)]
+        self._selector = selectors.DefaultSelector()
+        self._listener: socket.socket | None = None
+        self._pending: dict[socket.socket, _Pending] = {}
+        self._running: bool = False
+        self._last_report: float = 0.0
+        self._matchmaking: _Worker | None = None
+        self._matchmaking_seats: int = 0
+
+    def stats(self) -> list[WorkerStats]:
+        """
+        Returns the last load statistics reported by each worker.
+        :return: The statistics by the index of the worker.
+        :rtype: list[WorkerStats]
+        """
+        return [{**worker.stats, "connections": worker.connections} for worker in self.workers]
+
+    def run(self) -> None:
+        """
+        Starts the workers and serves until SIGINT or SIGTERM is received.
+        """
+        self._listener = socket.create_server(("", self.port), backlog=socket.SOMAXCONN, reuse_port=False)
+        self._listener.setblocking(False)
+        for worker in self.workers:
+            self._spawn(worker)
+        self._selector.register(self._listener, selectors.EVENT_READ, self._accept)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self._running = True
+        logging.info(f"Supervisor listening on port {self.port} with {len(self.workers)} workers.")
+        try:
+            while self._running:
+                for key, _ in self._selector.select(timeout=1.0):
+                    key.data(key.fileobj)
+                self._expire_pending()
+                self._report()
+        finally:
+            self._shutdown()
+
+    def _spawn(self, worker: _Worker) -> None:
+        supervisor_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        pid = os.fork()
+        if pid == 0:
+            supervisor_end.close()
+            self._listener.close()
+            for other in self.workers:
+                if other.control is not None:
+                    other.control.close()
+            for client in self._pending:  # a worker restarted by _read_control must not keep the handshakes open
+                client.close()
+            self._pending.clear()
+            self._selector.close()
+            code = 0
+            try:
+                run_worker(worker.index, len(self.workers), worker_end)
+            except BaseException:
+                logging.exception(f"Worker {worker.index} crashed.")
+                code = 1
+            finally:
+                os._exit(code)
+        worker_end.close()
+        worker.pid = pid
+        worker.control = supervisor_end
+        worker.stats = {"pid": pid}
+        worker.connections = 0
+        self._selector.register(supervisor_end, selectors.EVENT_READ, self._read_control)
+
+    def _accept(self, listener: socket.socket) -> None:
+        try:
+            while True:
+                client, _ = listener.accept()
+                client.setblocking(False)
+                self._pending[client] = _Pending(client)
+                self._selector.register(client, selectors.EVENT_READ, self._read_handshake)
+        except BlockingIOError:
+            pass
+
+    def _read_handshake(self, client: socket.socket) -> None:
+        pending = self._pending[client]
+        try:
+            data = client.recv(MAX_HANDSHAKE_SIZE - len(pending.data))
+            if not data:
+                raise ConnectionError("Connection closed during handshake.")
+            pending.data += data
+            complete, game_id = parse_handshake(pending.data)
+        except (OSError, ValueError) as e:
+            logging.info(f"Dropping client: {e}")
+            self._drop(client)
+            return
+        if not complete:
+            return
+        if game_id is None:
+            worker = self._matchmaking_worker()
+        else:
+            worker = self.workers[shard_of(game_id, len(self.workers))]
+        self._selector.unregister(client)
+        del self._pending[client]
+        try:
+            socket.send_fds(worker.control, [pending.data], [client.fileno()])
+            worker.connections += 1
+        except OSError as e:
+            logging.error(f"Cannot hand the client over to worker {worker.index}: {e}")
+        finally:
+            client.close()
+
+    def _matchmaking_worker(self) -> _Worker:
+        """
+        Returns the worker for a client that did not ask for a specific game. Such clients are sent to the same worker
+        until a table could have been filled there, so that they are seated together, then the least loaded worker is
+        chosen.
+        """
+        if self._matchmaking is None or self._matchmaking_seats <= 0 or self._matchmaking.control is None:
+            self._matchmaking = min(self.workers, key=lambda w: (w.stats.get("players", 0) + w.connections, w.index))
+            self._matchmaking_seats = config.max_players
+        self._matchmaking_seats -= 1
+        return self._matchmaking
+
+    def _read_control(self, control: socket.socket) -> None:
+        worker = next(worker for worker in self.workers if worker.control is control)
+        try:
+            data = control.recv(MAX_HANDSHAKE_SIZE)
+        except OSError:
+            data = b""
+        if not data:
+            self._selector.unregister(control)
+            control.close()
+            worker.control = None
+            os.waitpid(worker.pid, 0)
+            if self._running:
+                logging.error(f"Worker {worker.index} (pid {worker.pid}) died, its games are lost. Restarting it.")
+                self._spawn(worker)
+            return
+        try:
+            worker.stats = {**json.loads(data), "updated": time.time()}
+            worker.connections = 0
+        except ValueError:
+            logging.warning(f"Invalid stats from worker {worker.index}.")
+
+    def _drop(self, client: socket.socket) -> None:
+        self._selector.unregister(client)
+        self._pending.pop(client, None)
+        client.close()
+
+    def _expire_pending(self) -> None:
+        now = time.monotonic()
+        for client in [client for client, pending in self._pending.items() if pending.deadline < now]:
+            logging.info("Dropping client: handshake timed out.")
+            self._drop(client)
+
+    def _report(self) -> None:
+        now = time.monotonic()
+        if now - self._last_report < config.worker_stats_interval:
+            return
+        self._last_report = now
+        for index, stats in enumerate(self.stats()):
+            logging.info(f"Worker {index}: {stats}")
+
+    def _stop(self, signum: int, frame: Any) -> None:
+        self._running = False
+
+    def _shutdown(self) -> None:
+        for client in list(self._pending):
+            self._drop(client)
+        for worker in self.workers:
+            if worker.control is not None:
+                self._selector.unregister(worker.control)
+                worker.control.close()
+                worker.control = None
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+                os.waitpid(worker.pid, 0)
+            except ChildProcessError:
+                pass
+            except ProcessLookupError:
+                pass
+        if self._listener is not None:
+            self._selector.unregister(self._listener)
+            self._listener.close()
+
+
+@implementer(IReadDescriptor)
+class _HandoverReceiver:
+    """
+    Receives the sockets handed over by the supervisor and adopts them in the reactor of the worker.
+    """
+
+    def __init__(self, control: socket.socket, factory, reactor):
+        self.control = control
+        self.factory = factory
+        self.reactor = reactor
+
+    def fileno(self) -> int:
+        return self.control.fileno()
+
+    def logPrefix(self) -> str:
+        return self.__class__.__name__
+
+    def doRead(self) -> None:
+        try:
+            data, fds, _, _ = socket.recv_fds(self.control, MAX_HANDSHAKE_SIZE, 1)
+        except OSError:
+            data, fds = b"", []
+        if not data and not fds:
+            self.reactor.removeReader(self)
+            self.connectionLost(None)
+            return
+        for fd in fds:
+            with socket.socket(fileno=fd) as client:
+                transport = self.reactor.adoptStreamConnection(client.fileno(), client.family, self.factory)
+            if transport is not None:
+                transport.protocol.dataReceived(data)
+
+    def connectionLost(self, reason) -> None:
+        try:
+            self.reactor.stop()
+        except ReactorNotRunning:
+            pass
+
+    def report(self, registry: GameRegistry) -> None:
+        stats = registry.stats()
+        message = {
+            "pid": os.getpid(), "games": stats["games"], "players": stats["players"],
+            "rss_bytes": stats["rss_bytes"], "cpu_seconds": stats["cpu_seconds"],
+            "round_trips_saved": stats["round_trips_saved"], "deadlines": stats["deadlines"],
+        }
+        try:
+            self.control.send(json.dumps(message).encode())
+        except OSError:
+            pass
+
+
+def run_worker(index: int, workers: int, control: socket.socket) -> None:
+    """
+    Runs the reactor of one worker. The worker hosts only the games whose game_id hashes to its index.
+    :param index: The index of the worker.
+    :type index: int
+    :param workers: The number of workers.
+    :type workers: int
+    :param control: The socket connected to the supervisor.
+    :type control: socket.socket
+    """
+    from twisted.internet import reactor
+    from twisted.internet.task import LoopingCall
+    from bots import BotPool
+    from server import ServerFactory
+    from stages import StageStats
+    from turn import STAGE_MACHINE
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    bots = BotPool(config.bot_workers, reactor.callFromThread) if config.bot_workers > 0 else None
+    registry = GameRegistry(
+        scheduler=reactor.callLater, id_filter=lambda game_id: shard_of(game_id, workers) == index,
+        log_dir=config.wal_dir, bots=bots)
+    if bots is not None:
+        reactor.addSystemEventTrigger("before", "shutdown", bots.close)
+    if registry.log_dir is not None:
+        registry.recover()
+        LoopingCall(registry.sync_logs).start(config.wal_fsync_interval, now=False)
+        reactor.addSystemEventTrigger("before", "shutdown", registry.sync_logs)
+    receiver = _HandoverReceiver(control, ServerFactory(registry), reactor)
+    reactor.addReader(receiver)
+    LoopingCall(receiver.report, registry).start(config.worker_stats_interval)
+    if config.stage_stats:
+        STAGE_MACHINE.stats = StageStats()
+        LoopingCall(STAGE_MACHINE.log_stats).start(config.worker_stats_interval, now=False)
+    reactor.run()
@@ -0,0 +1,68 @@
+import random
+
+from board import BoardData
+from board_description import FieldType
+
+PLAYERS = (0, 1, 2, 3)
+
+
+def test_indexes_follow_random_updates():
+    rng = random.Random(9)
+    board = BoardData()
+    properties = [field.id for field in board if field.is_property()]
+    for _ in range(2000):
+        field = board.get_field(rng.choice(properties))
+        if field.is_street() and field.owner is not None and rng.random() < 0.4:
+            board.update(item=str(field.id), attribute="houses", value=rng.randint(0, 5))
+        else:
+            board.update(item=str(field.id), attribute="owner", value=rng.choice(PLAYERS + (None,)))
+        assert board.check_indexes() == []
+
+
+def test_indexes_follow_set_completion_and_ownership_moves():
+    board = BoardData()
+    street = next(field for field in board if field.type == FieldType.STREET)
+    full_set = [field for field in board if field.index in street.full_set]
+    for owned, field in enumerate(full_set, 1):
+        board.update(item=str(field.id), attribute="owner", value=0)
+        assert board.check_indexes() == []
+        assert board.get_properties_in_set_owned(street) == owned
+        assert board.has_full_set(street) == (owned == len(full_set))
+    for field in full_set:
+        board.update(item=str(field.id), attribute="houses", value=5 if field is full_set[0] else 3)
+        assert board.check_indexes() == []
+    assert board.count_houses(0) == (3 * (len(full_set) - 1), 1)
+    board.update(item=str(full_set[0].id), attribute="owner", value=1)
+    assert board.check_indexes() == []
+    assert not board.has_full_set(street)
+    assert board.count_houses(1) == (0, 1)
+    assert board.get_owned(1) == {full_set[0].id}
+    board.update(item=str(full_set[0].id), attribute="owner", value=None)
+    assert board.check_indexes() == []
+    assert board.get_owned(1) == set()
+    assert board.get_properties_in_set_owned(full_set[0]) == 1
+
+
+def _owned_board(seed: int) -> BoardData:
+    rng = random.Random(seed)
+    board = BoardData()
+    for field in board:
+        if field.is_property():
+            board.update(item=str(field.id), attribute="owner", value=rng.choice(PLAYERS))
+    return board
+
+
+def test_indexes_survive_state():
+    board = _owned_board(3)
+    restored = BoardData()
+    restored.set_state(board.get_state())
+    assert restored.check_indexes() == []
+
+
+def test_indexes_survive_fork():
+    board = _owned_board(3)
+    fork = board.fork()
+    field_id = next(field.id for field in board if field.is_property())
+    fork.update(item=str(field_id), attribute="owner", value=None)
+    assert board.check_indexes() == [] and fork.check_indexes() == []
+    assert board.get_field(field_id).owner is not None
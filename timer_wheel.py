@@ -0,0 +1,139 @@
+"""
+A hashed timer wheel for the deadlines of the games. One wheel serves all games of a process: a timer is an entry in
+the slot of the tick it expires in, so arming and cancelling a timer are dict operations, whatever the number of
+pending timers. The wheel is advanced by one delayed call of the reactor per tick, and only while timers are pending.
+"""
+import logging
+import math
+import time
+from collections.abc import Callable, Hashable
+from typing import Any, TypedDict
+
+
+class WheelStats(TypedDict):
+    armed: int
+    cancelled: int
+    expired: int
+
+
+class TimerWheel:
+    """
+    Runs callbacks after their delays with the precision of one tick. Every timer has a key, arming a key again
+    replaces its timer.
+    """
+
+    def __init__(
+            self, scheduler: Callable[[float, Callable[[], Any]], Any] | None = None, resolution: float = 1.0,
+            slots: int = 512, clock: Callable[[], float] = time.monotonic):
+        """
+        :param scheduler: Schedules the next tick, e.g. reactor.callLater. Without it, the wheel has to be advanced
+        by advance.
+        :type scheduler: Callable[[float, Callable[[], Any]], Any] | None
+        :param resolution: The length of a tick in seconds.
+        :type resolution: float
+        :param slots: The number of slots. Timers further than one turn of the wheel wait in their slot for the
+        later turn.
+        :type slots: int
+        :param clock: The time in seconds.
+        :type clock: Callable[[], float]
+        """
+        self.scheduler: Callable[[float, Callable[[], Any]], Any] | None = scheduler
+        self.resolution: float = resolution
+        self.clock: Callable[[], float] = clock
+        self.stats: WheelStats = {"armed": 0, "cancelled": 0, "expired": 0}
+        """ Counters of the armed, the cancelled and the expired timers. """
+        self._slots: list[dict[Hashable, tuple[int, Callable[[], Any]]]] = [{} for _ in range(slots)]
+        """ The timers by their keys as (the tick they expire in, the callback), in the slot of that tick. """
+        self._timers: dict[Hashable, dict[Hashable, tuple[int, Callable[[], Any]]]] = {}
+        """ The slot of every pending timer by its key. """
+        self._started: float = clock()
+        """ The time of the tick 0. """
+        self._tick: int = 0
+        """ The last tick whose timers have expired. """
+        self._scheduled: bool = False
+        """ The next tick is scheduled. """
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    def arm(self, key: Hashable, delay: float, callback: Callable[[], Any]) -> None:
+        """
+        Runs the callback after the delay, rounded up to whole ticks. A pending timer of the key is cancelled.
+        :param key: The key of the timer, e.g. the game_id.
+        :type key: Hashable
+        :param delay: The delay in seconds.
+        :type delay: float
+        :param callback: The function to be run.
+        :type callback: Callable[[], Any]
+        """
+        self.cancel(key)
+        now = self._now()
+        if not self._timers:
+            self._tick = max(self._tick, now)  # nothing is pending, so the idle ticks need not be run
+        due = max(now + math.ceil(delay / self.resolution), self._tick + 1)
+        slot = self._timers[key] = self._slots[due % len(self._slots)]
+        slot[key] = (due, callback)
+        self.stats["armed"] += 1
+        if self.scheduler is not None and not self._scheduled:
+            self._scheduled = True
+            self.scheduler(self.resolution, self._run)
+
+    def cancel(self, key: Hashable) -> bool:
+        """
+        Cancels the timer of the key.
+        :param key: The key of the timer.
+        :type key: Hashable
+        :return: False if there was no pending timer of the key.
+        :rtype: bool
+        """
+        slot = self._timers.pop(key, None)
+        if slot is None:
+            return False
+        del slot[key]
+        self.stats["cancelled"] += 1
+        return True
+
+    def advance(self) -> int:
+        """
+        Runs the callbacks of the timers that have expired by now.
+        :return: The number of expired timers.
+        :rtype: int
+        """
+        now = self._now()
+        expired = 0
+        while self._tick < now and self._timers:
+            self._tick += 1
+            slot = self._slots[self._tick % len(self._slots)]
+            for key in [key for key, (tick, _) in slot.items() if tick <= self._tick]:
+                entry = slot.get(key)
+                if entry is None or entry[0] > self._tick:  # cancelled or armed again by an earlier callback
+                    continue
+                del slot[key]
+                del self._timers[key]
+                expired += 1
+                try:
+                    entry[1]()
+                except Exception:  # the other timers of the tick still expire
+                    logging.exception(f"The timer {key!r} failed.")
+        if not self._timers:
+            self._tick = max(self._tick, now)
+        self.stats["expired"] += expired
+        return expired
+
+    def _now(self) -> int:
+        """
+        Returns the current tick.
+        """
+        return int((self.clock() - self._started) / self.resolution)
+
+    def _run(self) -> None:
+        self._scheduled = False
+        try:
+            self.advance()
+        finally:
+            if self._timers and not self._scheduled:
+                self._scheduled = True
+                self.scheduler(self.resolution, self._run)
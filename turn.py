@@ -1,10 +1,15 @@
+import functools
 import logging
 
 from uuid import UUID
 
+import actions
 import config
+from auction import Auction
 from board_description import FieldType
+from dice import Roll
 from interfaces import ClientMessage, IPlayer, IField, IController, IRoll
+from stages import Stage, StageMachine
 
 
 class Turn:
@@ -12,38 +17,166 @@ class Turn:
         self.controller: IController = controller
         self.on_turn_player: IPlayer | None = None
         self.extra_roll: IRoll | None = None
+        self.special_rent: str = ""
         self.stage = "pre_game"
         self.input_expected = True
+        self._actions: int = actions.NONE
+        """ The possible actions of the player on turn, or of all players before the game. """
+        self._actions_for_all: bool = False
+        """ The actions are possible for all players, not only for the player on turn. """
+        self._sent_actions: dict[UUID, int] = {}
+        """ The masks of actions the connected players have received last, by their UUIDs. """
+        self.round_trips_saved: int = 0
+        """ The number of times a standing order took an action instead of waiting for a message, see set_orders. """
+        self.actions_taken: int = 0
+        """ The number of actions accepted from the players and the standing orders. """
+        self.auction: Auction | None = None
+        """ The running auction, see _auction. """
+        self._announcement_due: bool = False
+        """ The high bid of the auction will be announced, see _announce_bid. """
+        self._refresh_actions()
 
     @property
     def on_turn_player_field(self) -> IField:
         return self.controller.gd.fields.get_field(self.on_turn_player.field)
 
-    def get_possible_actions(self, player_uuid: UUID) -> set[str]:
+    def get_actions(self, player_uuid: UUID) -> int:
+        """
+        Returns the possible actions of the player. The mask is cached, see _refresh_actions, except in an auction,
+        where every player has their own actions, see _bidding_actions.
+        :param player_uuid: The UUID of the player.
+        :type player_uuid: UUID
+        :return: The mask of actions.Action bits.
+        :rtype: int
+        """
+        if self.auction is not None:
+            return self._bidding_actions(player_uuid)
         if player_uuid == self.controller.server_uuid:
-            return {"add_player"}
-        if self.stage in ("pre_game", "add_player"):
-            return {"update_player", "start_game"}
-        if player_uuid != self.on_turn_player.uuid:
-            return set()
-        match self.stage:
-            case "begin_turn":
-                return {"roll"}
-            case "in_jail":
-                return self._get_possible_actions_in_jail()
-            case "rent_roll":
-                return {"roll"}
-            case "buying_decision":
-                return {"buy", "auction"}
-            case "end_turn":
-                return {"end_turn"}
+            return _SERVER_PRE_GAME_ACTIONS if self._actions_for_all else actions.Action.ADD_PLAYER.value
+        if self._actions_for_all or (self.on_turn_player is not None and player_uuid == self.on_turn_player.uuid):
+            return self._actions
+        return actions.NONE
+
+    def get_possible_actions(self, player_uuid: UUID) -> frozenset[str]:
+        """
+        Returns the names of the possible actions of the player, see get_actions.
+        :param player_uuid: The UUID of the player.
+        :type player_uuid: UUID
+        :rtype: frozenset[str]
+        """
+        return actions.names(self.get_actions(player_uuid))
 
     def parse(self, message: ClientMessage):
-        if message["action"] not in self.get_possible_actions(message["my_uuid"]):
+        if message["action"] == "set_orders":
+            if not self._set_orders(message):
+                return
+        elif actions.CODES.get(message["action"], actions.NONE) & self.get_actions(message["my_uuid"]):
+            self._enter(message["action"])
+            self.actions_taken += 1
+        else:
             return
-        match message["action"]:
+        self._run_action_loop(message)
+        self._refresh_actions()
+        if self.auction is None:  # the actions of the bidders are pushed with the high bid, see _announce_bid
+            self._push_actions()
+        if self.controller.log is not None:
+            self.controller.log.checkpoint(self.get_state())
+
+    def get_state(self) -> tuple:
+        """
+        Returns the state of the turn that is not kept in the game data, so that it can be written to the log.
+        :return: The state as (stage, input_expected, special_rent, extra_roll, doubles, last_roll, position of the
+        random number stream of the dice, auction).
+        :rtype: tuple
+        """
+        dice = self.controller.dice
+        return (
+            self.stage, self.input_expected, self.special_rent,
+            self.extra_roll.get() if self.extra_roll else None,
+            dice.doubles, dice.last_roll.get() if dice.last_roll else None, dice.rng.get_state(),
+            self.auction.get_state() if self.auction else None,
+        )
+
+    def set_state(self, state: tuple) -> None:
+        """
+        Restores the state returned by get_state. The game data have to be restored first.
+        :param state: The state. The states written before the auctions have no auction.
+        :type state: tuple
+        """
+        self.stage, self.input_expected, self.special_rent, extra_roll, doubles, last_roll, dice_rng = state[:7]
+        auction = state[7] if len(state) > 7 else None
+        self.auction = Auction.from_state(auction) if auction else None
+        self._announcement_due = False
+        self.extra_roll = Roll(extra_roll) if extra_roll else None
+        self.controller.dice.doubles = doubles
+        self.controller.dice.rng.set_state(dice_rng)
+        self.controller.dice.last_roll = Roll(last_roll) if last_roll else None
+        self.on_turn_player = self.controller.gd.on_turn_player
+        self._sent_actions = {}
+        self._refresh_actions()
+
+    def fork(self, controller: IController) -> "Turn":
+        """
+        Returns a copy of the turn for the fork of the game, see GameController.fork.
+        :param controller: The fork of the controller.
+        :type controller: IController
+        :return: The copy.
+        :rtype: Turn
+        """
+        turn = object.__new__(type(self))
+        turn.__dict__.update(self.__dict__)
+        turn.controller = controller
+        turn.on_turn_player = controller.gd.on_turn_player
+        turn._sent_actions = dict(self._sent_actions)
+        turn.auction = self.auction.fork() if self.auction else None
+        turn._announcement_due = False
+        return turn
+
+    def send_initial_state(self, player_uuid: UUID) -> None:
+        """
+        Sends the initial message for the given player containing all necessary data from the game data in one frame.
+        :param player_uuid: The UUID of the player.
+        :type player_uuid: UUID
+        """
+        mask = self._sent_actions[player_uuid] = self.get_actions(player_uuid)
+        self.controller.message.send_initial_state(player_uuid, [
+            {"section": "events", "item": "initialize", "value": True},
+            {"section": "events", "item": "possible_actions", "value": mask},
+        ])
+
+    def _set_orders(self, message: ClientMessage) -> bool:
+        """
+        Registers the standing orders of the player who sent the message: the actions the server takes for the player
+        whenever they are possible, instead of waiting for a message. The parameters are "orders", the mask of
+        actions.ORDERABLE bits, and "buy_limit", the highest price the order to buy pays. An order that applies in the
+        current stage is carried out by the action loop.
+        :return: False if the orders are not valid.
+        """
+        parameters = message["parameters"]
+        orders, buy_limit = parameters.get("orders"), parameters.get("buy_limit", 0)
+        if type(orders) is not int or orders & ~actions.ORDERABLE or type(buy_limit) is not int or buy_limit < 0:
+            logging.warning("Invalid standing orders %s of %s.", parameters, message["my_uuid"])
+            return False
+        try:
+            player = self.controller.gd.players[message["my_uuid"]]
+        except KeyError:
+            logging.warning("Standing orders of %s, who is not a player of the game.", message["my_uuid"])
+            return False
+        self.controller.gd.update(section="players", item=player.player_id, attribute="orders", value=orders)
+        self.controller.gd.update(section="players", item=player.player_id, attribute="buy_limit", value=buy_limit)
+        logging.info("Player %s set the standing orders %s with the buy limit %s.", player.name, orders, buy_limit)
+        self._broadcast_changes()
+        return True
+
+    def _enter(self, action: str) -> None:
+        """
+        Leaves the stage that waits for input by the action.
+        """
+        match action:
             case "add_player":
                 self.stage = "add_player"
+            case "remove_player":
+                self.stage = "remove_player"
             case "update_player":
                 self.stage = "update_player"
             case "start_game":
@@ -63,105 +196,173 @@ class Turn:
                 self.stage = "buying_property"
             case "auction":
                 self.stage = "auctioning"
+            case "bid":
+                self.stage = "placing_bid"
+            case "pass":
+                self.stage = "passing_bid"
+            case "close_auction":
+                self.stage = "closing_auction"
             case "end_turn":
                 self.stage = "end_turn_confirmed"
             # TODO add possibilities of buying houses, mortgaging and trading.
         self.input_expected = False
-        self._run_action_loop(message)
 
     def _run_action_loop(self, message: ClientMessage):
-        while not self.input_expected:
-            match self.stage:
-                case "add_player":
-                    self.stage = self._add_player(message)
-                case "auctioning":
-                    self.stage = "end_roll"  # TODO
-                case "buying_property":
-                    self.stage = self._buy_property()
-                case "end_roll":
-                    self.stage = self._end_roll()
-                case "end_turn":
-                    self.stage = self._end_turn()
-                case "end_turn_confirmed":
-                    self.stage = self._end_turn_confirmed()
-                case "go_to_jail":
-                    self.stage = self._go_to_jail()
-                case "leaving_jail":
-                    self.stage = self._leave_jail()
-                case "moved":
-                    self.stage = self._moved()
-                case "moving":
-                    self.stage = self._move()
-                case "on_card":
-                    self.stage = self._take_card()
-                case "on_property":
-                    self.stage = self._on_property()
-                case "payout":
-                    self.stage = self._payout()
-                case "pay_rent":
-                    self.stage = self._pay_rent()
-                case "pay_tax":
-                    self.stage = self._pay_tax()
-                case "rent_rolling":
-                    self.stage = self._rent_roll()
-                case "roll_in_jail":
-                    self.stage = self._roll_in_jail()
-                case "rolling":
-                    self.stage = self._roll_dice()
-                case "start_game":
-                    self.stage = self._start_game()
-                case "unowned_property":
-                    self.stage = self._unowned_property()
-                case "update_player":
-                    self.stage = self._update_player(message)
-                case "use_card":
-                    self.stage = self._use_card()
-                case "triple_double":
-                    self.stage = self._go_to_jail()
-                case _:
-                    self.input_expected = True
+        STAGE_MACHINE.run(self, message)
+        while (action := self._standing_action()) is not None:
+            logging.info("Player %s has a standing order to %s.", self.on_turn_player.name, action)
+            self.round_trips_saved += 1
+            self.actions_taken += 1
+            self._enter(action)
+            STAGE_MACHINE.run(self, message)
+
+    def _standing_action(self) -> str | None:
+        """
+        Returns the action of a standing order of the player on turn that applies in the stage the turn waits in.
+        """
+        player = self.on_turn_player
+        if player is None or not player.orders:
+            return None
+        self._refresh_actions()
+        possible = self._actions & player.orders
+        for code in actions.ORDER_PRIORITY:
+            if not code & possible:
+                continue
+            if code == actions.Action.BUY:
+                field = self.on_turn_player_field
+                if field.price > player.buy_limit or field.price > player.cash:
+                    continue
+            return actions.NAMES[code]
+        return None
 
     def _add_player(self, message: ClientMessage) -> str:
-        def send_initial_message(to: IPlayer) -> None:
-            """
-            Generates the initial message for the given player containing all necessary data from the game data.
-            The message is then sent.
-            :param to: The player.
-            :type to: IPlayer
-            :return: The initial message as bytes.
-            :rtype: bytes
-            """
-            for record in self.controller.gd.get_all_for_player(to.uuid):
-                self.controller.message.add(to=to.uuid, **record)
-            (self.controller.message
-             .add(to=to.uuid, section="events", item="initialize", value=True)
-             .add(to=to.uuid, section="events", item="possible_actions", value=self.get_possible_actions(to.uuid))
-             .send(to.uuid))
-
         if message["my_uuid"] != self.controller.server_uuid:
             ''' Only the server should be able to add other players. '''
-            logging.warning(f"Player {message['my_uuid']} is trying to add other player.")
+            logging.warning("Player %s is trying to add other player.", message["my_uuid"])
         else:
             parameters = message["parameters"]
             for player in self.controller.gd.players:
                 self.controller.gd.update(section="players", item=player, attribute="ready", value=False)
             player = self.controller.gd.add_player(parameters["player_uuid"], parameters["player_id"])
-            send_initial_message(player)
+            self.send_initial_state(player.uuid)
             self.controller.message.add(section="events", item="player_connected", value=player.player_id)
             self._broadcast_changes()
-            logging.info(f"Player {player.name} connected to the game.")
+            logging.info("Player %s connected to the game.", player.name)
         self.input_expected = True
         return "pre_game"
 
+    def _remove_player(self, message: ClientMessage) -> str:
+        if message["my_uuid"] != self.controller.server_uuid:
+            logging.warning("Player %s is trying to remove other player.", message["my_uuid"])
+        else:
+            player = self.controller.gd.remove_player(message["parameters"]["player_id"])
+            self._sent_actions.pop(player.uuid, None)
+            self.controller.message.add(section="events", item="player_disconnected", value=player.player_id)
+            self._broadcast_changes()
+            logging.info("Player %s left the game.", player.name)
+        self.input_expected = True
+        return "pre_game"
+
+    def _announce_bid(self, auction: Auction) -> None:
+        """
+        Broadcasts the high bid of the auction with the possible actions of the bidders, once for all bids accepted
+        in config.auction_bid_window. Nothing is sent if the auction has closed, the close is broadcast on its own.
+        """
+        if auction is not self.auction:
+            return
+        self._announcement_due = False
+        self.controller.message.add(
+            section="events", item="high_bid", value=(auction.field_id, auction.high_bid, auction.high_bidder))
+        self._push_actions(force=True)
+
+    def _auction(self) -> str:
+        game_data = self.controller.gd
+        order = list(game_data.get_value("misc", "player_order"))
+        start = order.index(self.on_turn_player.player_id)
+        bidders = tuple(order[start:] + order[:start])
+        self.auction = Auction(self.on_turn_player.field, bidders, config.auction_increment)
+        logging.info("Player %s put %s up for auction.", self.on_turn_player.name, self.on_turn_player_field.name)
+        game_data.update(section="events", item="auction", value=self.auction.field_id)
+        self._broadcast_changes()
+        self._push_actions()
+        self.input_expected = True
+        return "bidding"
+
+    def _bidding_actions(self, player_uuid: UUID) -> int:
+        """
+        Returns the possible actions in the auction: a bidder who has not passed and is not the high bidder can pass,
+        and bid if they have the cash for the minimum bid. The server closes the auction when its timer runs out.
+        """
+        if player_uuid == self.controller.server_uuid:
+            return int(actions.Action.ADD_PLAYER | actions.Action.CLOSE_AUCTION)
+        try:
+            player = self.controller.gd.players[player_uuid]
+        except KeyError:
+            return actions.NONE
+        auction = self.auction
+        if not auction.can_bid(player.player_id) or player.player_id == auction.high_bidder:
+            return actions.NONE
+        if player.cash < auction.minimum:
+            return actions.Action.PASS.value
+        return int(actions.Action.BID | actions.Action.PASS)
+
+    def _close_auction(self) -> str:
+        auction, self.auction = self.auction, None
+        self._announcement_due = False
+        field = self.controller.gd.fields.get_field(auction.field_id)
+        if auction.high_bidder is None:
+            logging.info("Nobody bid for %s.", field.name)
+        else:
+            bidder = self.controller.gd.players[auction.high_bidder]
+            self.controller.buy_property(field, bidder, auction.high_bid)
+            logging.info("Player %s won the auction of %s for %s.", bidder.name, field.name, auction.high_bid)
+        self.controller.gd.update(
+            section="events", item="auction_closed", value=(auction.field_id, auction.high_bid, auction.high_bidder))
+        return "end_roll"
+
+    def _pass_bid(self, message: ClientMessage) -> str:
+        player = self.controller.gd.players[message["my_uuid"]]
+        if not self.auction.leave(player.player_id):
+            self.actions_taken -= 1
+            self.input_expected = True
+            return "bidding"
+        logging.info("Player %s passed in the auction.", player.name)
+        self._schedule_announcement()
+        if self.auction.is_over:
+            return "closing_auction"
+        self.input_expected = True
+        return "bidding"
+
+    def _place_bid(self, message: ClientMessage) -> str:
+        player = self.controller.gd.players[message["my_uuid"]]
+        amount = message["parameters"].get("amount", self.auction.minimum)
+        if type(amount) is not int or not self.auction.bid(player.player_id, amount, player.cash):
+            logging.info("Player %s bid %s, the minimum is %s.", player.name, amount, self.auction.minimum)
+            self.actions_taken -= 1  # the bid was not accepted, so it does not restart the closing timer either
+            self.input_expected = True
+            return "bidding"
+        self._schedule_announcement()
+        if self.auction.is_over:
+            return "closing_auction"
+        self.input_expected = True
+        return "bidding"
+
+    def _schedule_announcement(self) -> None:
+        if not self._announcement_due:
+            self._announcement_due = True
+            self.controller.message.server.call_later(
+                config.auction_bid_window, functools.partial(self._announce_bid, self.auction))
+
     def _buy_property(self) -> str:
         self.controller.buy_property(self.on_turn_player_field, self.on_turn_player)
-        logging.info(f"Player {self.on_turn_player.uuid} bought {self.on_turn_player_field.name} for "
-                     f"{self.on_turn_player_field.price}.")
+        logging.info(
+            "Player %s bought %s for %s.", self.on_turn_player.name, self.on_turn_player_field.name,
+            self.on_turn_player_field.price)
         return "end_roll"
 
     def _end_roll(self) -> str:
         if self.controller.dice.last_roll.is_double():
-            logging.info(f"Player {self.on_turn_player.name} rolled a double and rolls again.")
+            logging.info("Player %s rolled a double and rolls again.", self.on_turn_player.name)
             self._broadcast_changes()
             self.input_expected = True
             return "begin_turn"
@@ -169,7 +370,7 @@ class Turn:
             return "end_turn"
 
     def _end_turn(self) -> str:
-        logging.info(f"Player {self.on_turn_player.name} ended their turn.")
+        logging.info("Player %s ended their turn.", self.on_turn_player.name)
         self._broadcast_changes()
         self.input_expected = True
         return "end_turn"
@@ -181,7 +382,7 @@ class Turn:
         self.special_rent = ""
         self.extra_roll = None
         self.controller.dice.reset()
-        logging.info(f"Player {self.on_turn_player.name} is on turn.")
+        logging.info("Player %s is on turn.", self.on_turn_player.name)
         self._broadcast_changes()
         self.input_expected = True
         if self.on_turn_player.in_jail:
@@ -190,22 +391,22 @@ class Turn:
             return "begin_turn"
 
     def _go_to_jail(self) -> str:
-        logging.info(f"Player {self.on_turn_player.name} was sent to jail.")
+        logging.info("Player %s was sent to jail.", self.on_turn_player.name)
         self.controller.move_to(self.controller.gd.fields.JAIL)
         return "end_turn"
 
     def _leave_jail(self):
-        self.on_turn_player.in_jail = False
-        self.on_turn_player.jail_turns = 0
+        self._update_player_on_turn("in_jail", False)
+        self._update_player_on_turn("jail_turns", 0)
         self.controller.move_to(self.controller.gd.fields.JUST_VISITING)
-        logging.info(f"Player {self.on_turn_player.name} left jail.")
+        logging.info("Player %s left jail.", self.on_turn_player.name)
         self._broadcast_changes()
         self.input_expected = True
         return "begin_turn"
 
     def _move(self) -> str:
         self.controller.move_by(self.controller.dice.last_roll.sum())
-        logging.info(f"Player {self.on_turn_player.name} moved to {self.on_turn_player_field.name}.")
+        logging.info("Player %s moved to %s.", self.on_turn_player.name, self.on_turn_player_field.name)
         return "moved"
 
     def _moved(self) -> str:
@@ -222,16 +423,16 @@ class Turn:
                 return "go_to_jail"
 
     def _on_property(self) -> str:
-        if not self.on_turn_player_field.owner:
+        if self.on_turn_player_field.owner is None:
             return "unowned_property"
-        elif self.on_turn_player_field.owner == self.on_turn_player.uuid:
+        elif self.on_turn_player_field.owner == self.on_turn_player.player_id:
             return "end_roll"
         else:
             return "pay_rent"
 
     def _payout(self) -> str:
-        logging.info(f"Player {self.on_turn_player.name} pays the fine.")
-        self.controller.pay(config.payout_price, self.on_turn_player.uuid)
+        logging.info("Player %s pays the fine.", self.on_turn_player.name)
+        self.controller.pay(config.payout_price, self.on_turn_player.player_id)
         self.controller.gd.update(section="events", item="payout", value=True)
         return "leaving_jail"
 
@@ -251,23 +452,24 @@ class Turn:
                 rent *= self.controller.dice.last_roll.sum()
             if self.special_rent == "double":
                 rent *= 2
-        logging.info(f"Player {self.on_turn_player.name} pays the rent of £{rent} to {self.on_turn_player_field.owner}.")
-        self.controller.pay(rent, self.on_turn_player.uuid, self.on_turn_player_field.owner)
+        owner = self.controller.gd.players[self.on_turn_player_field.owner]
+        logging.info("Player %s pays the rent of £%s to %s.", self.on_turn_player.name, rent, owner.name)
+        self.controller.pay(rent, self.on_turn_player.player_id, self.on_turn_player_field.owner)
         return "end_roll"
 
     def _pay_tax(self):
-        logging.info(f"Player {self.on_turn_player.name} pays the tax of £{self.on_turn_player_field.tax}.")
-        self.controller.pay(self.on_turn_player_field.tax, self.on_turn_player.uuid)
+        logging.info("Player %s pays the tax of £%s.", self.on_turn_player.name, self.on_turn_player_field.tax)
+        self.controller.pay(self.on_turn_player_field.tax, self.on_turn_player.player_id)
         return "end_roll"
 
     def _rent_roll(self) -> str:
         self.extra_roll = self.controller.roll(False)
-        logging.info(f"Player {self.on_turn_player.name} rolled a {self.extra_roll.sum()}.")
+        logging.info("Player %s rolled a %s.", self.on_turn_player.name, self.extra_roll.sum())
         return "pay_rent"
 
     def _roll_dice(self) -> str:
         roll = self.controller.roll()
-        logging.info(f"Player {self.on_turn_player.name} rolled a {roll.sum()}.")
+        logging.info("Player %s rolled a %s.", self.on_turn_player.name, roll.sum())
         if self.controller.dice.triple_double:
             self.controller.gd.update(section="events", item="triple_double", value=True)
             return "triple_double"
@@ -276,11 +478,11 @@ class Turn:
 
     def _roll_in_jail(self) -> str:
         roll = self.controller.dice.roll(False)
-        logging.info(f"Player {self.on_turn_player.name} rolled {roll.get()[0]} and {roll.get()[1]}.")
+        logging.info("Player %s rolled %s and %s.", self.on_turn_player.name, roll.get()[0], roll.get()[1])
         if roll.is_double():
             return "leaving_jail"
         else:
-            self.controller.gd.on_turn_player.jail_turns += 1
+            self._update_player_on_turn("jail_turns", self.on_turn_player.jail_turns + 1)
             return "end_turn"
 
     def _start_game(self) -> str:
@@ -303,7 +505,7 @@ class Turn:
     def _take_card(self) -> str:
         deck = self.controller.cc if self.on_turn_player_field.type == FieldType.CC else self.controller.chance
         card = deck.draw()
-        logging.info(f"Player {self.on_turn_player.name} takes card saying: {card.text}.")
+        logging.info("Player %s takes card saying: %s.", self.on_turn_player.name, card.text)
         self.controller.gd.update(section="events", item="card", value=(card.id, card.text))
         card.apply(self.controller)
         if card.special_rent:
@@ -325,12 +527,13 @@ class Turn:
     def _update_player(self, message: ClientMessage):
         player = self.controller.gd.players[message["my_uuid"]]
         if message["parameters"]["attribute"] not in ("name", "token", "ready"):
-            logging.warning(f"Attempt to update invalid player attribute: {message['parameters']['attribute']} by "
-                            f"player {player.name}: {player.uuid}.")
+            logging.warning(
+                "Attempt to update invalid player attribute: %s by player %s: %s.", message["parameters"]["attribute"],
+                player.name, player.uuid)
             return "pre_game"
         self.controller.gd.update(
             section="players",
-            item=player.uuid,
+            item=player.player_id,
             attribute=message["parameters"]["attribute"],
             value=message["parameters"]["value"]
         )
@@ -345,54 +548,136 @@ class Turn:
 
     def _use_card(self):
         self.controller.gd.update(section="events", item="use_card", value=True)
-        self.on_turn_player.get_out_of_jail_cards -= 1
-        logging.info(f"Player {self.on_turn_player.name} uses a get out of jail card.")
+        self._update_player_on_turn("get_out_of_jail_cards", self.on_turn_player.get_out_of_jail_cards - 1)
+        logging.info("Player %s uses a get out of jail card.", self.on_turn_player.name)
         return "leaving_jail"
 
+    def _update_player_on_turn(self, attribute: str, value) -> None:
+        self.controller.gd.update(section="players", item=self.on_turn_player.player_id, attribute=attribute, value=value)
+
     def _broadcast_changes(self):
         for record in self.controller.gd.get_changes():
             self.controller.message.add(**record)
         self.controller.message.broadcast()
 
-    def _get_possible_actions_in_jail(self):
-        actions = {"payout"}
-        if self.controller.gd.on_turn_player.get_out_of_jail_cards > 0:
-            actions.add("use_card")
-        if self.controller.gd.on_turn_player.jail_turns < 3:
-            actions.add("roll")
-        return actions
-
-# === STAGES LIST ===
-'''
-stages = {
-    "add_player",  # player joined the game
-    "auctioning",  # player decided not to buy a property
-    "begin_turn",  # player is on turn and rolls dices, input is expected
-    "buying_property",  # player decided to buy a property
-    "end_roll",  # player did all actions after roll. If player rolled doubles,
-                 # rolls again
-    "end_turn",  # player's turn is over, waiting for confirmation, input is expected
-    "end_turn_confirmed",  # player confirmed his turn, new turn begins, input is expected
-    "go_to_jail",  # player is moving to jail
-    "in_jail",  # player is in jail, input is expected
-    "leaving_jail",  # player is leaving jail
-    "moved",  # player moved to a new field. It is separated from "moving"
-              # because cards can move the player
-    "moving",  # player is moving to a new field
-    "on_card",  # player landed on a card field
-    "on_property",  # player landed on a property field
-    "pay_rent",  # player is going to pay a rent. When player got to a utility field
-                 # due to Chance card, he will pay 10x roll, so input is expected
-    "pay_tax",  # player is going to pay a tax
-    "payout",  # player decided to pay the fine to get out of jail
-    "rent_roll",  # special roll required. Induced by chance card for paying 10x roll
-                  # rent on utility field
-    "rent_rolling",  # player is rolling for the "rent_roll"(see above)
-    "roll_in_jail",  # player in jail decided to roll
-    "rolling",  # player is rolling for regular movement
-    "start_game",  # game is starting
-    "unowned_property",  # player landed on an unowned property, input is expected
-    "update_player",  # player changed his properties
-    "use_card",  # player in jail decided to use a free of jail card
-    "triple_double",  # player rolled 3 doubles in a row
-} '''
\ No newline at end of file
+    def _refresh_actions(self) -> None:
+        """
+        Computes the possible actions after the stage, the player on turn or their jail state have changed. They change
+        only by parse and set_state, so the actions are computed once per message instead of on every validation.
+        """
+        self._actions_for_all = self.stage in ("pre_game", "add_player", "remove_player")
+        if self.stage == "in_jail":
+            mask = actions.Action.PAYOUT
+            if self.on_turn_player.get_out_of_jail_cards > 0:
+                mask |= actions.Action.USE_CARD
+            if self.on_turn_player.jail_turns < 3:
+                mask |= actions.Action.ROLL
+        else:
+            mask = STAGE_ACTIONS.get(self.stage, actions.NONE)
+        self._actions = int(mask)
+
+    def _push_actions(self, force: bool = False) -> None:
+        """
+        Sends the possible actions to the connected players whose actions have changed since they received them last.
+        :param force: Broadcasts the queued messages even if no actions have changed.
+        """
+        changed = force
+        for player_uuid in self.controller.message.server.connected_clients:
+            mask = self.get_actions(player_uuid)
+            if self._sent_actions.get(player_uuid) != mask:
+                self._sent_actions[player_uuid] = mask
+                self.controller.message.add(to=player_uuid, section="events", item="possible_actions", value=mask)
+                changed = True
+        if changed:
+            self.controller.message.broadcast()
+
+
+STAGES: dict[str, Stage] = {
+    # player joined the game
+    "add_player": Stage("_add_player", ("pre_game",)),
+    # player decided not to buy a property, it is auctioned to all players
+    "auctioning": Stage("_auction", ("bidding",)),
+    # player is on turn and rolls dices
+    "begin_turn": Stage(None, ("rolling",), input_expected=True),
+    # player decided to buy a property
+    "buying_property": Stage("_buy_property", ("end_roll",)),
+    # the players bid until all but the high bidder pass or the closing timer runs out
+    "bidding": Stage(None, ("placing_bid", "passing_bid", "closing_auction"), input_expected=True),
+    # player landed on an unowned property and decides whether to buy it
+    "buying_decision": Stage(None, ("buying_property", "auctioning"), input_expected=True),
+    # player did all actions after roll. If player rolled doubles, rolls again
+    "end_roll": Stage("_end_roll", ("begin_turn", "end_turn")),
+    # player's turn is over, waiting for confirmation
+    "end_turn": Stage("_end_turn", ("end_turn", "end_turn_confirmed"), input_expected=True),
+    # the high bidder buys the property for the high bid
+    "closing_auction": Stage("_close_auction", ("end_roll",)),
+    # player confirmed his turn, new turn begins
+    "end_turn_confirmed": Stage("_end_turn_confirmed", ("in_jail", "begin_turn")),
+    # player is moving to jail
+    "go_to_jail": Stage("_go_to_jail", ("end_turn",)),
+    # player is in jail
+    "in_jail": Stage(None, ("payout", "use_card", "roll_in_jail"), input_expected=True),
+    # player is leaving jail
+    "leaving_jail": Stage("_leave_jail", ("begin_turn",)),
+    # player moved to a new field. It is separated from "moving" because cards can move the player
+    "moved": Stage("_moved", ("end_roll", "on_property", "pay_tax", "on_card", "go_to_jail")),
+    # player is moving to a new field
+    "moving": Stage("_move", ("moved",)),
+    # player landed on a card field
+    "on_card": Stage("_take_card", ("moved", "go_to_jail", "end_turn", "end_roll")),
+    # player landed on a property field
+    "on_property": Stage("_on_property", ("unowned_property", "end_roll", "pay_rent")),
+    # player is going to pay a rent. When player got to a utility field due to Chance card, he will pay 10x roll, so
+    # the rent is rolled first
+    "pay_rent": Stage("_pay_rent", ("rent_roll", "end_roll")),
+    # player is going to pay a tax
+    "pay_tax": Stage("_pay_tax", ("end_roll",)),
+    # a bidder left the auction
+    "passing_bid": Stage("_pass_bid", ("bidding", "closing_auction")),
+    # player decided to pay the fine to get out of jail
+    "payout": Stage("_payout", ("leaving_jail",)),
+    # a bidder raised the high bid
+    "placing_bid": Stage("_place_bid", ("bidding", "closing_auction")),
+    # players join, update themselves and get ready
+    "pre_game": Stage(None, ("add_player", "remove_player", "update_player", "start_game"), input_expected=True),
+    # special roll required. Induced by chance card for paying 10x roll rent on utility field
+    "rent_roll": Stage(None, ("rent_rolling",), input_expected=True),
+    # player is rolling for the "rent_roll" (see above)
+    "rent_rolling": Stage("_rent_roll", ("pay_rent",)),
+    # player in jail decided to roll
+    "roll_in_jail": Stage("_roll_in_jail", ("leaving_jail", "end_turn")),
+    # player is rolling for regular movement
+    "rolling": Stage("_roll_dice", ("triple_double", "moving")),
+    # game is starting
+    "start_game": Stage("_start_game", ("pre_game", "begin_turn")),
+    # player landed on an unowned property
+    "unowned_property": Stage("_unowned_property", ("buying_decision",)),
+    # player left the game before it started
+    "remove_player": Stage("_remove_player", ("pre_game",)),
+    # player changed his properties
+    "update_player": Stage("_update_player", ("pre_game", "start_game")),
+    # player in jail decided to use a free of jail card
+    "use_card": Stage("_use_card", ("leaving_jail",)),
+    # player rolled 3 doubles in a row
+    "triple_double": Stage("_go_to_jail", ("end_turn",)),
+}
+""" The stages of a turn. The stages that expect input are left by the actions of the players, see Turn.parse. """
+
+STAGE_ACTIONS: dict[str, actions.Action] = {
+    "pre_game": actions.Action.UPDATE_PLAYER | actions.Action.START_GAME,
+    "add_player": actions.Action.UPDATE_PLAYER | actions.Action.START_GAME,
+    "remove_player": actions.Action.UPDATE_PLAYER | actions.Action.START_GAME,
+    "begin_turn": actions.Action.ROLL,
+    "buying_decision": actions.Action.BUY | actions.Action.AUCTION,
+    "end_turn": actions.Action.END_TURN,
+    "rent_roll": actions.Action.ROLL,
+}
+""" The possible actions by the stage, of all players before the game and of the player on turn later. The actions in
+jail depend on the player, the stages missing here have none. """
+
+_SERVER_PRE_GAME_ACTIONS = int(actions.Action.ADD_PLAYER | actions.Action.REMOVE_PLAYER)
+""" The actions of the server before the game starts. Later the server can only add players, see
+GameSession.join. """
+
+STAGE_MACHINE = StageMachine(Turn, STAGES, entries=("pre_game",))
+""" Runs the stages of all turns of the process. """